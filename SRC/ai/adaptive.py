@@ -0,0 +1,133 @@
+"""
+Latency-SLA adaptive quality: pick the processing resolution per request.
+
+The analysis pipelines run at a fixed resolution whatever the load, so a burst
+of uploads queues up and every request misses its latency target together.
+AdaptiveQuality keeps recent service times per QualityLevel (from the
+PipelineRun timings of finished analyses) and, for each new request, predicts
+
+    latency(level) = (waves of work already queued + 1) * p95 service time(level)
+
+with waves = queue_depth / workers, then picks the best level whose prediction
+meets the p95 target (the cheapest level when none does). Levels without
+observations yet are extrapolated from an observed one by relative cost
+(pixels x Frangi scales). Results record the level they were computed at, so
+degraded ones can be re-analysed at full quality later.
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+from collections import deque
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Optional, Sequence
+
+
+@dataclass(frozen=True)
+class QualityLevel:
+    name: str
+    max_side: int                  # longest side the image is processed at
+    scales: Optional[int] = None   # Frangi scales (None: all of the pipeline's default)
+
+    def cost(self, all_scales: int) -> float:
+        """Relative cost: pixels x number of scales."""
+        return self.max_side ** 2 * (self.scales or all_scales)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def _p95(samples) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+class AdaptiveQuality:
+    """Chooses a QualityLevel (levels[0] = full quality) to keep p95 latency under target_p95_ms."""
+
+    def __init__(self, levels: Sequence[QualityLevel], target_p95_ms: float = 0.0, window: int = 50,
+                 all_scales: int = 5):
+        if not levels:
+            raise ValueError("at least one quality level is required")
+        self.levels = tuple(levels)
+        self.target_p95_ms = target_p95_ms
+        self.all_scales = all_scales
+        self._samples = {level.name: deque(maxlen=window) for level in self.levels}
+        self._stage_ms: Dict[str, Dict[str, float]] = {}
+        self._chosen = {level.name: 0 for level in self.levels}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.target_p95_ms > 0
+
+    @property
+    def full(self) -> QualityLevel:
+        return self.levels[0]
+
+    @classmethod
+    def from_env(cls, levels: Sequence[QualityLevel], prefix: str = "ADAPTIVE_", **kwargs) -> "AdaptiveQuality":
+        """ADAPTIVE_TARGET_P95_MS (0 = disabled: always full quality), ADAPTIVE_WINDOW (50 samples per level)."""
+        return cls(levels, target_p95_ms=float(os.getenv(f"{prefix}TARGET_P95_MS", "0")),
+                   window=int(os.getenv(f"{prefix}WINDOW", "50")), **kwargs)
+
+    def level(self, name: str) -> QualityLevel:
+        return next(level for level in self.levels if level.name == name)
+
+    def service_p95_ms(self, level: QualityLevel) -> Optional[float]:
+        """p95 of recent service times of level, extrapolated from another level if it has none."""
+        with self._lock:
+            samples = self._samples[level.name]
+            if samples:
+                return _p95(samples)
+            for other in self.levels:
+                if self._samples[other.name]:
+                    ratio = level.cost(self.all_scales) / other.cost(self.all_scales)
+                    return _p95(self._samples[other.name]) * ratio
+        return None
+
+    def predict_ms(self, level: QualityLevel, queue_depth: int, workers: int) -> Optional[float]:
+        service = self.service_p95_ms(level)
+        if service is None:
+            return None
+        waves = queue_depth / max(workers, 1)
+        return (waves + 1) * service
+
+    def choose(self, queue_depth: int, workers: int = 1) -> QualityLevel:
+        """Best level predicted to meet the target; full quality when disabled or nothing is known yet."""
+        chosen = self.full
+        if self.enabled:
+            chosen = self.levels[-1]
+            for level in self.levels:
+                predicted = self.predict_ms(level, queue_depth, workers)
+                if predicted is None or predicted <= self.target_p95_ms:
+                    chosen = level
+                    break
+        with self._lock:
+            self._chosen[chosen.name] += 1
+        return chosen
+
+    def record(self, level: QualityLevel, service_ms: float, stage_ms: Optional[Dict[str, float]] = None):
+        """Service time of a finished analysis (and optionally its per-stage times)."""
+        with self._lock:
+            self._samples[level.name].append(service_ms)
+            if stage_ms:
+                # exponential moving average per stage, reported in stats()
+                avg = self._stage_ms.setdefault(level.name, {})
+                for stage, ms in stage_ms.items():
+                    avg[stage] = ms if stage not in avg else 0.8 * avg[stage] + 0.2 * ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            levels = {
+                level.name: {
+                    **level.to_dict(),
+                    "chosen": self._chosen[level.name],
+                    "samples": len(self._samples[level.name]),
+                    "p95_ms": round(_p95(self._samples[level.name]), 1) if self._samples[level.name] else None,
+                    "stage_ms": {k: round(v, 1) for k, v in self._stage_ms.get(level.name, {}).items()},
+                }
+                for level in self.levels
+            }
+        return {"enabled": self.enabled, "target_p95_ms": self.target_p95_ms, "levels": levels}
@@ -1,26 +1,97 @@
 import cv2
 import numpy as np
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, Sequence, Tuple, Union
 
+from .fov import FovROI, detect_fov
+from .pipeline import Pipeline, Stage, StageCache
 
-def analyze_image(input_path: str, output_path: str) -> Tuple[float, str]:
-    """A simple stub that generates a fake vessel mask and an annotated image.
-    Returns (risk_score, annotated_image_path)
-    """
-    img = cv2.imread(input_path)
+# Bump whenever analyze_image output changes (used to key cached results)
+ENGINE_VERSION = "canny-2"
+
+
+@dataclass
+class EngineResult:
+    """In-memory analysis output (no files involved)."""
+    risk_score: float
+    mask: np.ndarray        # uint8 edge mask (0 / 255), full frame
+    annotated: np.ndarray   # BGR uint8, same size as the input
+    roi: FovROI
+    timings: Dict[str, Any] = field(default_factory=dict)  # PipelineRun.to_dict()
+
+
+def decode(data: Union[bytes, bytearray, memoryview, np.ndarray]) -> np.ndarray:
+    """Decode encoded image bytes to a BGR uint8 array."""
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
     if img is None:
         raise ValueError("Cannot read image")
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    edges = cv2.Canny(gray, 30, 100)
+    return img
+
+
+def _fov(img: np.ndarray, crop_fov: bool = True) -> FovROI:
+    return detect_fov(img) if crop_fov else FovROI.full(*img.shape[:2])
+
+
+def _edges(img: np.ndarray, roi: FovROI) -> np.ndarray:
+    gray = cv2.cvtColor(img[roi.slices], cv2.COLOR_BGR2GRAY)
+    return roi.paste(cv2.Canny(gray, 30, 100))
+
+
+def _overlay(img: np.ndarray, edges: np.ndarray) -> np.ndarray:
     # make mask RGB
     mask = np.zeros_like(img)
     mask[:, :, 1] = edges  # green channel
+    return cv2.addWeighted(img, 0.8, mask, 0.5, 0)
 
-    annotated = cv2.addWeighted(img, 0.8, mask, 0.5, 0)
-    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(output_path, annotated)
 
+def _risk(edges: np.ndarray) -> float:
     # risk score heuristic: proportion of edge pixels
-    risk_score = float(edges.sum()) / (edges.size * 255) * 100
-    return risk_score, str(output_path)
+    return float(edges.sum()) / (edges.size * 255) * 100
+
+
+# overlay and risk score both depend only on the edges and run in parallel.
+# Stage caching is off by default (results are already cached per upload by
+# ResultCache); ENGINE_STAGE_CACHE_MB > 0 enables it.
+PIPELINE = Pipeline([
+    Stage("fov", _fov, ("image",), params=("crop_fov",)),
+    Stage("edges", _edges, ("image", "fov")),
+    Stage("overlay", _overlay, ("image", "edges")),
+    Stage("risk", _risk, ("edges",), cache=False),
+], sources=("image",), cache=StageCache.from_env("ENGINE_STAGE_CACHE_", default_mb=0), name=ENGINE_VERSION)
+
+
+def analyze_array(img: np.ndarray, crop_fov: bool = True) -> EngineResult:
+    """Edge-based vessel mask, annotated overlay and risk score of a BGR uint8 image.
+    Edge detection runs only inside the retina's bounding box unless crop_fov is False.
+    """
+    if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+    run = PIPELINE.run({"image": img}, {"crop_fov": crop_fov}, outputs=("risk", "edges", "overlay", "fov"))
+    return EngineResult(run["risk"], run["edges"], run["overlay"], run["fov"], run.to_dict())
+
+
+def analyze_bytes(data: Union[bytes, bytearray, memoryview], crop_fov: bool = True) -> EngineResult:
+    """Decode once and analyze; the caller decides whether/how to encode and persist."""
+    return analyze_array(decode(data), crop_fov=crop_fov)
+
+
+def encode(image: np.ndarray, ext: str = ".png", params: Sequence[int] = ()) -> bytes:
+    """Encode an array (e.g. EngineResult.annotated) to image bytes; ext picks the format."""
+    ok, buf = cv2.imencode(ext, image, list(params))
+    if not ok:
+        raise ValueError(f"Cannot encode image as {ext}")
+    return buf.tobytes()
+
+
+def analyze_image(input_path: str, output_path: str, crop_fov: bool = True) -> Tuple[float, str]:
+    """Path-based wrapper around analyze_array: reads input_path, writes the annotated image.
+    Returns (risk_score, annotated_image_path)
+    """
+    img = cv2.imread(input_path)
+    if img is None:
+        raise ValueError("Cannot read image")
+    result = analyze_array(img, crop_fov=crop_fov)
+    Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    cv2.imwrite(output_path, result.annotated)
+    return result.risk_score, str(output_path)
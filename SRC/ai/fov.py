@@ -0,0 +1,96 @@
+"""
+Field of view (FOV) - vùng võng mạc trong ảnh đáy mắt.
+
+Fundus photos are a bright disc on a black background. Processing only the
+disc's bounding box skips the black corners (roughly 20-45% of the frame,
+depending on the camera's aspect ratio); results computed on the crop are
+pasted back into a full-frame array.
+"""
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class FovROI:
+    """Bounding box of the field of view: rows y0:y1, columns x0:x1 of a height x width frame."""
+    y0: int
+    y1: int
+    x0: int
+    x1: int
+    height: int
+    width: int
+
+    @classmethod
+    def full(cls, height: int, width: int) -> "FovROI":
+        return cls(0, height, 0, width, height, width)
+
+    @property
+    def slices(self) -> Tuple[slice, slice]:
+        return slice(self.y0, self.y1), slice(self.x0, self.x1)
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.y1 - self.y0, self.x1 - self.x0
+
+    @property
+    def is_full(self) -> bool:
+        return self.shape == (self.height, self.width)
+
+    @property
+    def saved_fraction(self) -> float:
+        """Share of the frame's pixels outside the ROI (not processed)."""
+        total = self.height * self.width
+        return 1.0 - (self.shape[0] * self.shape[1]) / total if total else 0.0
+
+    def paste(self, crop: np.ndarray, fill=0) -> np.ndarray:
+        """Place a result computed on the crop into a full-frame array filled with `fill`
+        (the crop itself is returned when the ROI is the whole frame)."""
+        if self.is_full:
+            return crop
+        out = np.full((self.height, self.width) + crop.shape[2:], fill, dtype=crop.dtype)
+        out[self.slices] = crop
+        return out
+
+    def to_dict(self) -> dict:
+        return {"bbox": [self.x0, self.y0, self.x1, self.y1], "saved_fraction": round(self.saved_fraction, 4)}
+
+
+def fov_mask(image: np.ndarray, threshold: int = 20) -> np.ndarray:
+    """Pixels brighter than `threshold` in any channel (uint8 gray or color image)."""
+    a = np.asarray(image)
+    if a.ndim == 3:
+        # elementwise max of the channel planes (much faster than a.max(axis=2) on uint8)
+        a = np.maximum.reduce([a[..., c] for c in range(a.shape[2])])
+    return a > threshold
+
+
+def detect_fov(image: np.ndarray, threshold: int = 20, margin: int = 4,
+               min_fraction: float = 0.01, align: int = 1) -> FovROI:
+    """Bounding box of the retina disc, padded by `margin` pixels.
+
+    Rows/columns count as inside when more than `min_fraction` of their pixels
+    are above `threshold`, which ignores isolated bright noise and text overlays
+    in the corners. With `align` > 1 the box is grown so both sides are multiples
+    of `align` (for models that need e.g. /32 inputs). Returns the full frame when
+    no disc is found.
+    """
+    mask = fov_mask(image, threshold)
+    h, w = mask.shape
+    rows = np.flatnonzero(np.count_nonzero(mask, axis=1) > min_fraction * w)
+    cols = np.flatnonzero(np.count_nonzero(mask, axis=0) > min_fraction * h)
+    if rows.size == 0 or cols.size == 0:
+        return FovROI.full(h, w)
+    y0, y1 = _aligned(max(0, rows[0] - margin), min(h, rows[-1] + 1 + margin), h, align)
+    x0, x1 = _aligned(max(0, cols[0] - margin), min(w, cols[-1] + 1 + margin), w, align)
+    return FovROI(y0, y1, x0, x1, h, w)
+
+
+def _aligned(start: int, stop: int, length: int, align: int) -> Tuple[int, int]:
+    if align <= 1:
+        return int(start), int(stop)
+    size = min(length, -(-(stop - start) // align) * align)
+    # giữ tâm, dịch vào trong ảnh nếu chạm mép
+    start = max(0, min(start - (size - (stop - start)) // 2, length - size))
+    return int(start), int(start + size)
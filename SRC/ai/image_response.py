@@ -0,0 +1,180 @@
+"""
+Image response - trả ảnh kết quả dưới dạng nhị phân thay vì base64 trong JSON.
+
+Analyze endpoints support three response modes (query parameter `response`):
+
+  - json:      legacy body, images inlined as base64 data URIs (~1.37x the bytes,
+               plus encode/decode CPU on both sides)
+  - multipart: multipart/form-data body; part "metrics" is the JSON document,
+               every image is its own binary part (browsers read it with
+               `await response.formData()`)
+  - url:       JSON only; images are short-lived fetch URLs served from an
+               in-memory ImageLinkStore (GET /images/{token})
+
+EncoderConfig makes the image format configurable (JPEG / WebP quality, PNG
+compression level) from environment variables.
+"""
+import base64
+import json
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # pragma: no cover - PIL fallback for services without OpenCV
+    cv2 = None
+
+JSON, MULTIPART, URL = "json", "multipart", "url"
+RESPONSE_MODES = (JSON, MULTIPART, URL)
+
+# format -> (file extension, media type)
+FORMATS = {
+    "jpeg": (".jpg", "image/jpeg"),
+    "webp": (".webp", "image/webp"),
+    "png": (".png", "image/png"),
+}
+
+
+@dataclass(frozen=True)
+class EncoderConfig:
+    """Output image format; quality applies to JPEG/WebP (0-100), png_compression to PNG (0-9)."""
+    format: str = "jpeg"
+    quality: int = 95
+    png_compression: int = 3
+
+    def __post_init__(self):
+        if self.format not in FORMATS:
+            raise ValueError(f"Unsupported image format {self.format!r} (expected one of {', '.join(FORMATS)})")
+        if not 0 <= self.quality <= 100:
+            raise ValueError("quality must be in 0-100")
+        if not 0 <= self.png_compression <= 9:
+            raise ValueError("png_compression must be in 0-9")
+
+    @classmethod
+    def from_env(cls, default_format: str = "jpeg", prefix: str = "IMAGE_") -> "EncoderConfig":
+        """IMAGE_FORMAT, IMAGE_QUALITY, IMAGE_PNG_COMPRESSION (prefix configurable)."""
+        return cls(
+            format=os.getenv(f"{prefix}FORMAT", default_format).lower(),
+            quality=int(os.getenv(f"{prefix}QUALITY", str(cls.quality))),
+            png_compression=int(os.getenv(f"{prefix}PNG_COMPRESSION", str(cls.png_compression))),
+        )
+
+    @property
+    def ext(self) -> str:
+        return FORMATS[self.format][0]
+
+    @property
+    def media_type(self) -> str:
+        return FORMATS[self.format][1]
+
+    @property
+    def tag(self) -> str:
+        """Short id for cache keys: results encoded differently must not share an entry."""
+        return f"png{self.png_compression}" if self.format == "png" else f"{self.format}{self.quality}"
+
+    def encode(self, image: np.ndarray, rgb: bool = False) -> bytes:
+        """Encode a uint8 image array (BGR, or RGB with rgb=True)."""
+        if cv2 is None:
+            return self._encode_pil(image if rgb or image.ndim == 2 else image[..., ::-1])
+        if rgb and image.ndim == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+        if self.format == "png":
+            params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+        elif self.format == "webp":
+            params = [cv2.IMWRITE_WEBP_QUALITY, self.quality]
+        else:
+            params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        ok, buf = cv2.imencode(self.ext, image, params)
+        if not ok:
+            raise ValueError(f"Cannot encode image as {self.format}")
+        return buf.tobytes()
+
+    def _encode_pil(self, rgb: np.ndarray) -> bytes:
+        import io
+        from PIL import Image
+
+        out = io.BytesIO()
+        if self.format == "png":
+            Image.fromarray(rgb).save(out, format="PNG", compress_level=self.png_compression)
+        else:
+            Image.fromarray(rgb).save(out, format=self.format.upper(), quality=self.quality)
+        return out.getvalue()
+
+
+def data_uri(data: bytes, media_type: str) -> str:
+    return f"data:{media_type};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def multipart_body(metrics: Dict[str, Any], images: Dict[str, Tuple[bytes, str]]) -> Tuple[bytes, str]:
+    """multipart/form-data body: a "metrics" JSON part, then one binary part per image.
+
+    images: name -> (bytes, media type). Returns (body, content type header value).
+    """
+    boundary = secrets.token_hex(16)
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="metrics"\r\n'
+        f'Content-Type: application/json\r\n\r\n'.encode("ascii")
+        + json.dumps(metrics, ensure_ascii=False).encode("utf-8") + b"\r\n"
+    ]
+    for name, (data, media_type) in images.items():
+        ext = next((e for e, t in FORMATS.values() if t == media_type), "")
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{name}{ext}"\r\n'
+            f'Content-Type: {media_type}\r\nContent-Length: {len(data)}\r\n\r\n'.encode("ascii")
+            + data + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode("ascii"))
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+
+class ImageLinkStore:
+    """Short-lived, unguessable fetch URLs for encoded images (in memory, bounded)."""
+
+    def __init__(self, ttl_seconds: float = 300, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[bytes, str, float]]" = OrderedDict()
+        self._bytes = 0
+
+    def put(self, data: bytes, media_type: str) -> str:
+        token = secrets.token_urlsafe(18)
+        with self._lock:
+            self._evict(time.time())
+            self._items[token] = (data, media_type, time.time() + self.ttl_seconds)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                self._drop(next(iter(self._items)))
+        return token
+
+    def get(self, token: str) -> Optional[Tuple[bytes, str]]:
+        with self._lock:
+            item = self._items.get(token)
+            if item is None:
+                return None
+            if item[2] < time.time():
+                self._drop(token)
+                return None
+            return item[0], item[1]
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def _evict(self, now: float):
+        # entries are in insertion order with a fixed TTL, so expired ones are at the front
+        while self._items:
+            token, (_, _, expires) = next(iter(self._items.items()))
+            if expires >= now:
+                break
+            self._drop(token)
+
+    def _drop(self, token: str):
+        data, _, _ = self._items.pop(token)
+        self._bytes -= len(data)
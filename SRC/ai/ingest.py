@@ -0,0 +1,307 @@
+"""
+Upload ingestion - stream ảnh upload xuống file tạm thay vì đọc toàn bộ vào RAM.
+
+ingest_upload() reads an upload (anything with an async `read(n)`, e.g.
+FastAPI's UploadFile) chunk by chunk and, for every chunk, on a worker thread:
+
+  - appends it to a spool file (or to `dest` when the caller keeps the file)
+  - updates the SHA-256 digest (ResultCache keys need no second pass)
+  - sniffs the image header (PNG / JPEG / WebP dimensions, SVG) as soon as
+    enough bytes have arrived
+
+Limits are enforced while streaming: the upload is aborted as soon as it
+passes max_bytes, or as soon as the header declares more than max_pixels
+(decompression-bomb guard: a few KB of PNG can declare a 100k x 100k image).
+The result exposes the content as a read-only mmap, which cv2.imdecode /
+np.frombuffer / PIL.Image.open accept without copying it into a bytes object.
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+CHUNK_SIZE = 1024 * 1024
+
+# header bytes kept for sniffing; JPEG dimensions normally sit in the first few KB,
+# but EXIF / ICC segments can push them further (resolved from the mmap at the end)
+SNIFF_LIMIT = 256 * 1024
+
+MEDIA_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+    "svg": "image/svg+xml",
+}
+
+# formats decoded to a pixel grid (pixel limits apply)
+RASTER_FORMATS = ("png", "jpeg", "webp")
+
+
+class IngestError(ValueError):
+    """Upload rejected; status_code is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass(frozen=True)
+class IngestLimits:
+    max_bytes: int = 25 * 1024 * 1024
+    max_pixels: int = 50_000_000
+    max_side: int = 20000
+
+    @classmethod
+    def from_env(cls, prefix: str = "UPLOAD_") -> "IngestLimits":
+        """UPLOAD_MAX_MB, UPLOAD_MAX_MEGAPIXELS, UPLOAD_MAX_SIDE (prefix configurable)."""
+        return cls(
+            max_bytes=int(float(os.getenv(f"{prefix}MAX_MB", str(cls.max_bytes / 1024 / 1024))) * 1024 * 1024),
+            max_pixels=int(float(os.getenv(f"{prefix}MAX_MEGAPIXELS", str(cls.max_pixels / 1e6))) * 1e6),
+            max_side=int(os.getenv(f"{prefix}MAX_SIDE", str(cls.max_side))),
+        )
+
+    def check_dimensions(self, width: int, height: int):
+        if width <= 0 or height <= 0:
+            raise IngestError("Invalid image dimensions")
+        if width * height > self.max_pixels or max(width, height) > self.max_side:
+            raise IngestError(
+                f"Image is {width}x{height} pixels (limit {self.max_pixels / 1e6:g} MP, {self.max_side} px per side)",
+                status_code=413,
+            )
+
+
+# ---------------------------------------------------------------- header sniffing
+
+_NEED_MORE = None
+
+# JPEG start-of-frame markers (baseline, progressive, lossless, arithmetic); not DHT/JPG/DAC
+_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _sniff_png(buf) -> Optional[Tuple[int, int]]:
+    if len(buf) < 24:
+        return _NEED_MORE
+    if bytes(buf[12:16]) != b"IHDR":
+        raise IngestError("Corrupt PNG header")
+    return struct.unpack_from(">II", buf, 16)
+
+
+def _sniff_jpeg(buf) -> Optional[Tuple[int, int]]:
+    pos, n = 2, len(buf)
+    while True:
+        # markers may be preceded by any number of 0xFF fill bytes
+        while pos < n and buf[pos] == 0xFF:
+            pos += 1
+        if pos >= n:
+            return _NEED_MORE
+        marker = buf[pos]
+        pos += 1
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            continue  # standalone markers, no length
+        if marker in (0xD9, 0xDA):
+            raise IngestError("JPEG has no frame header before scan data")
+        if pos + 2 > n:
+            return _NEED_MORE
+        (length,) = struct.unpack_from(">H", buf, pos)
+        if length < 2:
+            raise IngestError("Corrupt JPEG segment")
+        if marker in _SOF_MARKERS:
+            if pos + 7 > n:
+                return _NEED_MORE
+            height, width = struct.unpack_from(">HH", buf, pos + 3)
+            return width, height
+        pos += length
+
+
+def _sniff_webp(buf) -> Optional[Tuple[int, int]]:
+    if len(buf) < 30:
+        return _NEED_MORE
+    chunk = bytes(buf[12:16])
+    if chunk == b"VP8 ":
+        w, h = struct.unpack_from("<HH", buf, 26)
+        return w & 0x3FFF, h & 0x3FFF
+    if chunk == b"VP8L":
+        (bits,) = struct.unpack_from("<I", buf, 21)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X":
+        w = int.from_bytes(bytes(buf[24:27]), "little") + 1
+        h = int.from_bytes(bytes(buf[27:30]), "little") + 1
+        return w, h
+    raise IngestError("Corrupt WebP header")
+
+
+def sniff(buf) -> Optional[Tuple[str, Optional[Tuple[int, int]]]]:
+    """(format, (width, height)) from the leading bytes of an image; None if more bytes are needed.
+
+    SVG has no pixel size (dimensions None). Raises IngestError for anything else.
+    """
+    head = bytes(buf[:16])
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return ("png", _sniff_png(buf)) if len(buf) >= 24 else _NEED_MORE
+    if head.startswith(b"\xff\xd8"):
+        size = _sniff_jpeg(buf)
+        return ("jpeg", size) if size is not None else _NEED_MORE
+    if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+        size = _sniff_webp(buf)
+        return ("webp", size) if size is not None else _NEED_MORE
+    if len(buf) < 16:
+        return _NEED_MORE
+    text = bytes(buf[:1024]).lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith(b"<svg") or (text.startswith(b"<?xml") and b"<svg" in text):
+        return "svg", None
+    raise IngestError("Unsupported image type", status_code=415)
+
+
+# ---------------------------------------------------------------- spooling
+
+class SpooledUpload:
+    """A streamed upload on disk: size, SHA-256, sniffed format/size and a zero-copy buffer.
+
+    Use as a context manager (or call close()); the spool file is deleted on
+    close unless it was written to a caller-provided `dest`.
+    """
+
+    def __init__(self, path: Path, size: int, sha256: str, format: str,
+                 dimensions: Optional[Tuple[int, int]], filename: Optional[str] = None, keep: bool = False):
+        self.path = path
+        self.size = size
+        self.sha256 = sha256
+        self.format = format
+        self.width, self.height = dimensions or (None, None)
+        self.filename = filename
+        self._keep = keep
+        self._file = None
+        self._map = None
+
+    @property
+    def media_type(self) -> str:
+        return MEDIA_TYPES[self.format]
+
+    def buffer(self) -> mmap.mmap:
+        """Read-only memory map of the content (supports the buffer protocol and read/seek)."""
+        if self._map is None:
+            self._file = open(self.path, "rb")
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._map.seek(0)
+        return self._map
+
+    def read_bytes(self) -> bytes:
+        return self.path.read_bytes()
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # an array still views the map; it is released with the last reference
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not self._keep:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _Spooler:
+    """Per-upload state; feed() runs on a worker thread (hashing and file writes release the GIL)."""
+
+    def __init__(self, out, limits: IngestLimits, allowed: Optional[Sequence[str]]):
+        self.out = out
+        self.limits = limits
+        self.allowed = allowed
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = bytearray()
+        self.sniffed = None
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.limits.max_bytes:
+            raise IngestError(f"File is larger than {self.limits.max_bytes // (1024 * 1024)} MB", status_code=413)
+        self.digest.update(chunk)
+        self.out.write(chunk)
+        if self.sniffed is None and len(self.head) < SNIFF_LIMIT:
+            self.head += chunk[:SNIFF_LIMIT - len(self.head)]
+            self._accept(sniff(self.head))
+
+    def finish(self, path: Path) -> Tuple[str, Optional[Tuple[int, int]]]:
+        self.out.close()
+        if self.size == 0:
+            raise IngestError("Empty file")
+        if self.sniffed is None:
+            # header longer than SNIFF_LIMIT (large EXIF / ICC profile): parse the whole file
+            with map_file(path) as buf:
+                self._accept(sniff(buf))
+        if self.sniffed is None:
+            raise IngestError("Truncated image header")
+        return self.sniffed
+
+    def _accept(self, sniffed):
+        if sniffed is None:
+            return
+        fmt, dims = sniffed
+        if self.allowed is not None and fmt not in self.allowed:
+            raise IngestError(f"Unsupported image type {fmt!r}", status_code=415)
+        if fmt in RASTER_FORMATS:
+            self.limits.check_dimensions(*dims)
+        self.sniffed = sniffed
+
+
+async def ingest_upload(upload, limits: Optional[IngestLimits] = None, allowed: Optional[Sequence[str]] = None,
+                        dest: Union[str, Path, None] = None, spool_dir: Union[str, Path, None] = None,
+                        chunk_size: int = CHUNK_SIZE) -> SpooledUpload:
+    """Stream `upload` to disk, hashing and validating on the fly.
+
+    allowed: accepted formats (keys of MEDIA_TYPES), default all.
+    dest: keep the content at this path; otherwise a temporary spool file in
+    spool_dir (system temp dir by default) is deleted by SpooledUpload.close().
+    Raises IngestError; nothing is left on disk after a failure.
+    """
+    limits = limits or IngestLimits()
+    if dest is not None:
+        path = Path(dest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        out = path.open("wb")
+    else:
+        fd, name = tempfile.mkstemp(prefix="upload-", suffix=".spool", dir=spool_dir)
+        path, out = Path(name), os.fdopen(fd, "wb")
+    spooler = _Spooler(out, limits, allowed)
+    try:
+        while True:
+            chunk = await upload.read(chunk_size)
+            if not chunk:
+                break
+            await asyncio.to_thread(spooler.feed, chunk)
+        fmt, dims = await asyncio.to_thread(spooler.finish, path)
+    except BaseException:
+        out.close()
+        path.unlink(missing_ok=True)
+        raise
+    return SpooledUpload(path, spooler.size, spooler.digest.hexdigest(), fmt, dims,
+                         filename=getattr(upload, "filename", None), keep=dest is not None)
+
+
+@contextmanager
+def map_file(path: Union[str, Path]) -> Iterator[Union[mmap.mmap, bytes]]:
+    """Read-only memory map of a file (b"" for an empty file, which cannot be mapped)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            yield b""
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            yield buf
@@ -0,0 +1,297 @@
+"""
+Perceptual-hash index of recent uploads, for near-duplicate result reuse.
+
+The result caches are keyed by the SHA-256 of the upload, so the same eye photo
+re-sent after recompression, resizing or as a screenshot is a miss and runs the
+full segmentation again. Two 64-bit perceptual hashes of a small grayscale
+thumbnail survive those transformations:
+
+- pHash: signs of the low-frequency 8x8 DCT coefficients of a 32x32 thumbnail
+  (against their median); robust to scaling, JPEG and mild colour changes.
+- dHash: signs of horizontal gradients of a 9x8 thumbnail; cheap and
+  sensitive to structure, used to confirm pHash matches.
+
+NearDuplicateIndex keeps, per scope (one user / patient), the hashes of recent
+analyses in a BK-tree over the pHash Hamming distance, so a lookup only visits
+the part of the tree within max_distance instead of every entry. A match must be
+within max_distance on pHash and dhash_max_distance on dHash.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .prescreen import decode_thumbnail
+
+try:
+    import cv2
+except ImportError:  # pragma: no cover
+    cv2 = None
+
+# thumbnail decoded for hashing; IMREAD_REDUCED keeps this a few ms for large JPEGs
+HASH_THUMB_SIDE = 256
+# below this grey-level standard deviation an image has too little structure to hash
+MIN_CONTRAST = 4.0
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def _resize(gray: np.ndarray, w: int, h: int) -> np.ndarray:
+    if cv2 is not None:
+        return cv2.resize(gray, (w, h), interpolation=cv2.INTER_AREA)
+    from PIL import Image
+    return np.asarray(Image.fromarray(gray).resize((w, h), Image.BOX), dtype=np.float32)
+
+
+def _dct2(a: np.ndarray) -> np.ndarray:
+    if cv2 is not None:
+        return cv2.dct(a)
+    # DCT-II as a matrix product (cheap at 32x32)
+    n = a.shape[0]
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    return m @ a @ m.T
+
+
+def phash(gray: np.ndarray) -> int:
+    """64-bit DCT hash of a grayscale image."""
+    small = _resize(gray, 32, 32).astype(np.float32)
+    low = _dct2(small)[:8, :8].ravel()
+    # the DC term only encodes brightness; the median of the other 63 terms splits the bits
+    return _bits_to_int(low > np.median(low[1:]))
+
+
+def dhash(gray: np.ndarray) -> int:
+    """64-bit difference hash of a grayscale image."""
+    small = _resize(gray, 9, 8).astype(np.float32)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+def trim_border(gray: np.ndarray, threshold: float = 24.0, min_fraction: float = 0.02,
+                max_rounds: int = 3) -> np.ndarray:
+    """Crop away uniform borders, repeatedly.
+
+    A screenshot adds a UI frame around the photo, and the photo itself has the
+    black surround of the retina disc: while the outer ring is (90%) one colour,
+    keep the rows/columns where more than min_fraction of the pixels differ from
+    it, so both end up cropped to the same disc. Photos without a uniform border
+    are left alone.
+    """
+    for _ in range(max_rounds):
+        h, w = gray.shape
+        if h < 8 or w < 8:
+            break
+        ring = np.concatenate([gray[0], gray[-1], gray[:, 0], gray[:, -1]])
+        background = np.median(ring)
+        if np.mean(np.abs(ring - background) > threshold) > 0.1:
+            break
+        mask = np.abs(gray - background) > threshold
+        rows = np.flatnonzero(mask.mean(axis=1) > min_fraction)
+        cols = np.flatnonzero(mask.mean(axis=0) > min_fraction)
+        if rows.size == 0 or cols.size == 0:
+            break
+        box = (rows[0], rows[-1] + 1, cols[0], cols[-1] + 1)
+        if box == (0, h, 0, w):
+            break
+        # one more pixel on trimmed sides: resampling blends the border into the edge row
+        top, bottom = rows[0] + (rows[0] > 0), rows[-1] + 1 - (rows[-1] < h - 1)
+        left, right = cols[0] + (cols[0] > 0), cols[-1] + 1 - (cols[-1] < w - 1)
+        if bottom - top < 8 or right - left < 8:
+            break
+        gray = gray[top:bottom, left:right]
+    return gray
+
+
+def image_hashes(data) -> Optional[Tuple[int, int]]:
+    """(pHash, dHash) of encoded image bytes / buffer, or None if it cannot be decoded."""
+    rgb = decode_thumbnail(data, HASH_THUMB_SIDE)
+    if rgb is None:
+        return None
+    gray = (rgb[..., 0] * 0.299 + rgb[..., 1] * 0.587 + rgb[..., 2] * 0.114).astype(np.float32)
+    gray = trim_border(gray)
+    if min(gray.shape) < 8 or float(gray.std()) < MIN_CONTRAST:
+        # (nearly) flat images hash to all-zero bits and would all "match" each other
+        return None
+    return phash(gray), dhash(gray)
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with Hamming distance.
+
+    Children are keyed by their distance to the parent; by the triangle
+    inequality a search for radius r only descends into children whose key is
+    within [d - r, d + r] of the query's distance d to the node.
+    """
+
+    __slots__ = ("_root", "size")
+
+    def __init__(self):
+        self._root: Optional[list] = None  # [hash, item, {distance: child}]
+        self.size = 0
+
+    def add(self, h: int, item: Any):
+        self.size += 1
+        node = [h, item, {}]
+        if self._root is None:
+            self._root = node
+            return
+        cur = self._root
+        while True:
+            d = hamming(h, cur[0])
+            child = cur[2].get(d)
+            if child is None:
+                cur[2][d] = node
+                return
+            cur = child
+
+    def search(self, h: int, radius: int) -> List[Tuple[int, Any]]:
+        """All (distance, item) within radius, closest first."""
+        out = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                out.append((d, node[1]))
+            for k, child in node[2].items():
+                if d - radius <= k <= d + radius:
+                    stack.append(child)
+        out.sort(key=lambda t: t[0])
+        return out
+
+    def __iter__(self) -> Iterator[Tuple[int, Any]]:
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            yield node[0], node[1]
+            stack.extend(node[2].values())
+
+
+@dataclass
+class _Entry:
+    phash: int
+    dhash: int
+    value: Any
+    added: float
+
+
+@dataclass
+class Match:
+    value: Any                 # what was stored with the earlier image (e.g. its cache key)
+    distance: int              # pHash Hamming distance (0-64)
+    dhash_distance: int
+    age_seconds: float
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"distance": self.distance, "dhash_distance": self.dhash_distance,
+                "age_seconds": round(self.age_seconds, 1)}
+
+
+class _Scope:
+    """Entries of one scope: insertion-ordered for age/size eviction, plus the BK-tree."""
+
+    def __init__(self):
+        self.entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self.tree = BKTree()
+        self.next_id = 0
+        self.dead = 0
+
+    def rebuild(self):
+        # BK-trees have no cheap delete: evicted entries are tombstoned and the tree is rebuilt
+        # once they make up half of it
+        self.tree = BKTree()
+        for entry_id, e in self.entries.items():
+            self.tree.add(e.phash, entry_id)
+        self.dead = 0
+
+
+class NearDuplicateIndex:
+    """Per-scope perceptual-hash index of recent analyses (thread-safe, in memory)."""
+
+    def __init__(self, max_distance: int = 10, dhash_max_distance: int = 12, max_entries_per_scope: int = 500,
+                 max_age_seconds: float = 30 * 24 * 3600, max_scopes: int = 10000):
+        self.max_distance = max_distance
+        self.dhash_max_distance = dhash_max_distance
+        self.max_entries_per_scope = max_entries_per_scope
+        self.max_age_seconds = max_age_seconds
+        self.max_scopes = max_scopes
+        self._scopes: "OrderedDict[str, _Scope]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"lookups": 0, "matches": 0, "added": 0}
+
+    @classmethod
+    def from_env(cls, prefix: str = "NEAR_DUP_") -> "NearDuplicateIndex":
+        """NEAR_DUP_MAX_DISTANCE (10), NEAR_DUP_DHASH_MAX_DISTANCE (12), NEAR_DUP_MAX_ENTRIES (500 per user),
+        NEAR_DUP_MAX_AGE_HOURS (720)."""
+        import os
+
+        return cls(
+            max_distance=int(os.getenv(f"{prefix}MAX_DISTANCE", "10")),
+            dhash_max_distance=int(os.getenv(f"{prefix}DHASH_MAX_DISTANCE", "12")),
+            max_entries_per_scope=int(os.getenv(f"{prefix}MAX_ENTRIES", "500")),
+            max_age_seconds=float(os.getenv(f"{prefix}MAX_AGE_HOURS", "720")) * 3600,
+        )
+
+    def _expire(self, scope: _Scope, now: float):
+        entries = scope.entries
+        while entries and (len(entries) > self.max_entries_per_scope
+                           or now - next(iter(entries.values())).added > self.max_age_seconds):
+            entries.popitem(last=False)
+            scope.dead += 1
+        if scope.dead and scope.dead * 2 >= scope.tree.size:
+            scope.rebuild()
+
+    def find(self, scope_key: str, hashes: Tuple[int, int]) -> Optional[Match]:
+        """Closest earlier image of this scope within both thresholds, or None."""
+        ph, dh = hashes
+        now = time.time()
+        with self._lock:
+            self._counters["lookups"] += 1
+            scope = self._scopes.get(scope_key)
+            if scope is None:
+                return None
+            self._expire(scope, now)
+            for distance, entry_id in scope.tree.search(ph, self.max_distance):
+                e = scope.entries.get(entry_id)
+                if e is None:
+                    continue
+                dd = hamming(dh, e.dhash)
+                if dd <= self.dhash_max_distance:
+                    self._counters["matches"] += 1
+                    return Match(e.value, distance, dd, now - e.added)
+        return None
+
+    def add(self, scope_key: str, hashes: Tuple[int, int], value: Any):
+        ph, dh = hashes
+        now = time.time()
+        with self._lock:
+            scope = self._scopes.get(scope_key)
+            if scope is None:
+                scope = self._scopes[scope_key] = _Scope()
+                if len(self._scopes) > self.max_scopes:
+                    self._scopes.popitem(last=False)
+            else:
+                self._scopes.move_to_end(scope_key)
+            entry_id = scope.next_id
+            scope.next_id += 1
+            scope.entries[entry_id] = _Entry(ph, dh, value, now)
+            scope.tree.add(ph, entry_id)
+            self._counters["added"] += 1
+            self._expire(scope, now)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "scopes": len(self._scopes),
+                    "entries": sum(len(s.entries) for s in self._scopes.values()),
+                    "max_distance": self.max_distance}
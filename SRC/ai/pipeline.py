@@ -0,0 +1,376 @@
+"""
+Pipeline DAG - khai báo pipeline phân tích ảnh dưới dạng đồ thị các stage.
+
+A Pipeline is a set of named Stages. Each stage declares the upstream values it
+consumes (pipeline sources or other stages) and the run parameters it depends
+on. The executor:
+
+  - computes only the stages needed for the requested outputs
+  - caches each stage's output in a StageCache under a key derived from the
+    stage name/version, its parameter values and the keys of its inputs (the
+    source keys are content hashes). Keys are known before anything runs, so
+    changing a rendering parameter re-runs only rendering and what depends on
+    it; the cached segmentation is reused and nothing upstream is recomputed
+  - runs independent stages concurrently (Pipeline.run: thread pool, the
+    numpy / OpenCV kernels release the GIL; Pipeline.arun: asyncio tasks,
+    stages may be coroutine functions)
+  - records the wall time of every stage in the returned PipelineRun
+
+Cached arrays are made read-only: stages must not modify their inputs in place.
+"""
+import asyncio
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, fields, is_dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_MISS = object()
+
+
+@dataclass(frozen=True)
+class Stage:
+    """fn(*inputs, **{p: params[p] for p in params if given}) -> value."""
+    name: str
+    fn: Callable[..., Any]
+    inputs: Tuple[str, ...] = ()
+    params: Tuple[str, ...] = ()
+    version: str = "1"          # bump when fn's output changes
+    cache: bool = True          # False for cheap or non-deterministic stages
+
+
+@dataclass
+class PipelineRun:
+    """Outputs of one run plus per-stage wall times (ms) and which stages came from the cache."""
+    values: Dict[str, Any]
+    timings: Dict[str, float] = field(default_factory=dict)
+    cached: Tuple[str, ...] = ()
+    total_ms: float = 0.0
+
+    def __getitem__(self, name: str) -> Any:
+        return self.values[name]
+
+    def to_dict(self) -> Dict[str, Any]:
+        stages = {name: {"ms": round(ms, 3), "cached": False} for name, ms in self.timings.items()}
+        stages.update({name: {"ms": 0.0, "cached": True} for name in self.cached})
+        return {"total_ms": round(self.total_ms, 3), "stages": stages}
+
+
+# ---------------------------------------------------------------- cache
+
+def _walk(value, visit, depth: int = 0):
+    """Apply visit to value and the containers / dataclass fields inside it (bounded depth)."""
+    visit(value)
+    if depth >= 3:
+        return
+    if isinstance(value, (tuple, list)):
+        items = value
+    elif isinstance(value, dict):
+        items = value.values()
+    elif is_dataclass(value) and not isinstance(value, type):
+        items = [getattr(value, f.name) for f in fields(value)]
+    else:
+        return
+    for item in items:
+        _walk(item, visit, depth + 1)
+
+
+def _nbytes(value) -> int:
+    total = 0
+
+    def visit(v):
+        nonlocal total
+        if isinstance(v, np.ndarray):
+            total += v.nbytes
+        elif isinstance(v, (bytes, bytearray)):
+            total += len(v)
+        elif not isinstance(v, (tuple, list, dict)):
+            total += sys.getsizeof(v)
+
+    _walk(value, visit)
+    return total
+
+
+def _freeze(value):
+    def visit(v):
+        if isinstance(v, np.ndarray) and v.flags.writeable and v.flags.owndata:
+            v.flags.writeable = False
+
+    _walk(value, visit)
+    return value
+
+
+class StageCache:
+    """In-memory LRU of stage outputs, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._items: "OrderedDict[str, Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self._counters = {"hits": 0, "misses": 0, "puts": 0, "evictions": 0}
+
+    @classmethod
+    def from_env(cls, prefix: str = "STAGE_CACHE_", default_mb: float = 256) -> Optional["StageCache"]:
+        """STAGE_CACHE_MB (prefix configurable); 0 disables stage caching (returns None)."""
+        mb = float(os.getenv(f"{prefix}MB", str(default_mb)))
+        return cls(int(mb * 1024 * 1024)) if mb > 0 else None
+
+    def get(self, key: str):
+        """Cached value, or the module sentinel _MISS (None is a valid stage output)."""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self._counters["misses"] += 1
+                return _MISS
+            self._items.move_to_end(key)
+            self._counters["hits"] += 1
+            return item[0]
+
+    def put(self, key: str, value: Any):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        _freeze(value)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            self._counters["puts"] += 1
+            while self._bytes > self.max_bytes:
+                _, (_, dropped) = self._items.popitem(last=False)
+                self._bytes -= dropped
+                self._counters["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._items), "bytes": self._bytes, "max_bytes": self.max_bytes}
+
+
+def content_key(value) -> str:
+    """SHA-256 hex of bytes-like content or of an array (shape and dtype included)."""
+    h = hashlib.sha256()
+    if isinstance(value, np.ndarray):
+        h.update(f"{value.dtype.str}{value.shape}".encode("ascii"))
+        value = np.ascontiguousarray(value)
+    h.update(memoryview(value).cast("B"))
+    return h.hexdigest()
+
+
+def _canonical(value):
+    """Deterministic repr for parameter values (dicts sorted by key)."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _canonical(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_canonical(v) for v in value)
+    return value
+
+
+# ---------------------------------------------------------------- executor
+
+class Pipeline:
+    """Declarative stage graph; see the module docstring."""
+
+    def __init__(self, stages: Sequence[Stage], sources: Sequence[str] = ("image",),
+                 cache: Optional[StageCache] = None, workers: int = 4, name: str = "pipeline"):
+        self.name = name
+        self.sources = tuple(sources)
+        self.stages: Dict[str, Stage] = {}
+        for stage in stages:
+            if stage.name in self.stages or stage.name in self.sources:
+                raise ValueError(f"Duplicate stage name {stage.name!r}")
+            self.stages[stage.name] = stage
+        for stage in self.stages.values():
+            unknown = [i for i in stage.inputs if i not in self.stages and i not in self.sources]
+            if unknown:
+                raise ValueError(f"Stage {stage.name!r} has unknown inputs {unknown}")
+        self.order = self._toposort()
+        self.cache = cache
+        self.workers = max(1, workers)
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def _toposort(self) -> List[str]:
+        order, state = [], {}
+
+        def visit(name: str, path: Tuple[str, ...]):
+            if state.get(name) == "done" or name in self.sources:
+                return
+            if state.get(name) == "visiting":
+                raise ValueError(f"Cycle in pipeline: {' -> '.join(path + (name,))}")
+            state[name] = "visiting"
+            for dep in self.stages[name].inputs:
+                visit(dep, path + (name,))
+            state[name] = "done"
+            order.append(name)
+
+        for name in self.stages:
+            visit(name, ())
+        return order
+
+    def stage_keys(self, source_keys: Dict[str, str], params: Dict[str, Any],
+                   outputs: Iterable[str]) -> Dict[str, str]:
+        """Cache key of every stage needed for `outputs` (no stage is executed)."""
+        needed = self._ancestors(outputs)
+        keys = dict(source_keys)
+        for name in self.order:
+            if name not in needed:
+                continue
+            stage = self.stages[name]
+            used = tuple((p, _canonical(params[p])) for p in stage.params if p in params)
+            token = f"{self.name}/{name}:{stage.version}:{used!r}:{','.join(keys[i] for i in stage.inputs)}"
+            keys[name] = hashlib.sha256(token.encode("utf-8")).hexdigest()
+        return keys
+
+    def _ancestors(self, outputs: Iterable[str]) -> set:
+        needed, stack = set(), list(outputs)
+        while stack:
+            name = stack.pop()
+            if name in needed or name in self.sources:
+                continue
+            if name not in self.stages:
+                raise KeyError(f"Unknown stage {name!r}")
+            needed.add(name)
+            stack.extend(self.stages[name].inputs)
+        return needed
+
+    def _plan(self, sources: Dict[str, Any], params: Dict[str, Any], outputs: Sequence[str],
+              source_keys: Optional[Dict[str, str]], use_cache: bool):
+        """Values available up front (sources + cache hits) and the stages left to run, in order."""
+        missing = [s for s in self.sources if s not in sources]
+        if missing:
+            raise ValueError(f"Missing pipeline sources {missing}")
+        values = dict(sources)
+        keys: Dict[str, str] = {}
+        cached: List[str] = []
+        cache = self.cache if use_cache else None
+        if cache is not None:
+            src_keys = {s: (source_keys or {}).get(s) or content_key(sources[s]) for s in self.sources}
+            keys = self.stage_keys(src_keys, params, outputs)
+        # walk back from the outputs; a cache hit cuts off everything upstream of it
+        required = set(outputs)
+        for name in reversed(self.order):
+            if name not in required:
+                continue
+            stage = self.stages[name]
+            if cache is not None and stage.cache:
+                value = cache.get(keys[name])
+                if value is not _MISS:
+                    values[name] = value
+                    cached.append(name)
+                    continue
+            required.update(stage.inputs)
+        todo = [n for n in self.order if n in required and n not in values]
+        return values, keys if cache is not None else None, todo, tuple(reversed(cached))
+
+    def _call(self, stage: Stage, values: Dict[str, Any], params: Dict[str, Any]):
+        kwargs = {p: params[p] for p in stage.params if p in params}
+        return stage.fn(*(values[i] for i in stage.inputs), **kwargs)
+
+    def _store(self, stage: Stage, keys: Optional[Dict[str, str]], value):
+        if keys is not None and stage.cache:
+            self.cache.put(keys[stage.name], value)
+
+    def _executor(self) -> ThreadPoolExecutor:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-stage")
+            return self._pool
+
+    def run(self, sources: Dict[str, Any], params: Optional[Dict[str, Any]] = None,
+            outputs: Optional[Sequence[str]] = None, source_keys: Optional[Dict[str, str]] = None,
+            use_cache: bool = True) -> PipelineRun:
+        """Compute `outputs` (default: stages nothing else consumes) from `sources`.
+
+        source_keys: precomputed content hashes of sources (e.g. the upload
+        SHA-256); missing ones are hashed when a cache is configured.
+        use_cache=False neither reads nor fills the stage cache (benchmarks).
+        """
+        params = params or {}
+        outputs = tuple(outputs or self.sinks())
+        start = time.perf_counter()
+        values, keys, todo, cached = self._plan(sources, params, outputs, source_keys, use_cache)
+        timings: Dict[str, float] = {}
+        remaining = set(todo)
+        running: Dict[Any, str] = {}
+
+        def execute(name: str):
+            t0 = time.perf_counter()
+            value = self._call(self.stages[name], values, params)
+            return value, (time.perf_counter() - t0) * 1000.0
+
+        def finish(name: str, result):
+            values[name], timings[name] = result
+            self._store(self.stages[name], keys, values[name])
+
+        try:
+            while remaining or running:
+                ready = [n for n in todo if n in remaining and all(i in values for i in self.stages[n].inputs)]
+                if len(ready) == 1 and not running:
+                    # a linear chain runs on the calling thread, no hand-off cost
+                    remaining.discard(ready[0])
+                    finish(ready[0], execute(ready[0]))
+                    continue
+                for name in ready:
+                    remaining.discard(name)
+                    running[self._executor().submit(execute, name)] = name
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    finish(running.pop(fut), fut.result())
+        finally:
+            for fut in running:
+                fut.cancel()
+        return PipelineRun({o: values[o] for o in outputs}, timings, cached, (time.perf_counter() - start) * 1000.0)
+
+    async def arun(self, sources: Dict[str, Any], params: Optional[Dict[str, Any]] = None,
+                   outputs: Optional[Sequence[str]] = None,
+                   source_keys: Optional[Dict[str, str]] = None, use_cache: bool = True) -> PipelineRun:
+        """Like run() inside an event loop: coroutine stages are awaited, plain stages run via asyncio.to_thread."""
+        params = params or {}
+        outputs = tuple(outputs or self.sinks())
+        start = time.perf_counter()
+        # hashing sources and cache lookups can take a few ms on large inputs
+        values, keys, todo, cached = await asyncio.to_thread(self._plan, sources, params, outputs, source_keys, use_cache)
+        timings: Dict[str, float] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def execute(name: str):
+            stage = self.stages[name]
+            for dep in stage.inputs:
+                if dep in tasks:
+                    await tasks[dep]
+            t0 = time.perf_counter()
+            if asyncio.iscoroutinefunction(stage.fn):
+                value = await self._call(stage, values, params)
+            else:
+                value = await asyncio.to_thread(self._call, stage, values, params)
+            timings[name] = (time.perf_counter() - t0) * 1000.0
+            values[name] = value
+            self._store(stage, keys, value)
+
+        for name in todo:
+            tasks[name] = asyncio.ensure_future(execute(name))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            raise
+        return PipelineRun({o: values[o] for o in outputs}, timings, cached, (time.perf_counter() - start) * 1000.0)
+
+    def sinks(self) -> Tuple[str, ...]:
+        consumed = {i for s in self.stages.values() for i in s.inputs}
+        return tuple(n for n in self.order if n not in consumed)
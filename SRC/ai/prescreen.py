@@ -0,0 +1,142 @@
+"""
+Pre-screen - kiểm tra nhanh ảnh đầu vào trước khi chạy phân tích nặng.
+
+Runs on a small thumbnail decoded at reduced resolution (cv2.IMREAD_REDUCED_COLOR_4,
+or PIL draft mode when OpenCV is not installed), so the cost is a few milliseconds
+regardless of the upload size. Checks, in order:
+
+  - decode:       bytes are not a readable image
+  - overexposed:  most of the frame is clipped white
+  - underexposed: nothing in the frame is bright enough to show vessels
+  - selfie:       large white area (sclera) -> ordinary eye photo, not a fundus image
+  - fov:          the circular fundus field of view covers too little of the frame
+  - blur:         low Laplacian variance inside the field of view
+
+The first check that fires decides the outcome. A selfie is a valid photo with a
+known answer (no retinal risk), so callers short-circuit it; every other check rejects.
+"""
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # pragma: no cover - PIL fallback for services without OpenCV
+    cv2 = None
+
+PASS = "pass"
+SHORT_CIRCUIT = "short_circuit"
+REJECT = "reject"
+
+
+@dataclass
+class PrescreenConfig:
+    """Thresholds, all measured on the thumbnail (gray levels are 0-255)."""
+    thumb_max_side: int = 256
+    overexposed_fraction: float = 0.4   # share of pixels >= 250
+    underexposed_p99: float = 30.0      # 99th percentile gray level
+    selfie_white_ratio: float = 0.15    # share of pixels > 200
+    fov_threshold: int = 20             # max(R, G, B) above this is inside the field of view
+    min_fov_fraction: float = 0.25
+    min_blur_variance: float = 20.0     # variance of the 4-neighbour Laplacian inside the FOV
+
+
+@dataclass
+class PrescreenResult:
+    action: str                         # pass | short_circuit | reject
+    check: Optional[str] = None         # which check fired (None when passed)
+    reason: str = ""
+    metrics: Dict[str, float] = field(default_factory=dict)
+    elapsed_ms: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.action == PASS
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+def decode_thumbnail(data: bytes, max_side: int = 256) -> Optional[np.ndarray]:
+    """Decode an RGB uint8 thumbnail whose longest side is at most max_side (None if unreadable)."""
+    if cv2 is not None:
+        buf = np.frombuffer(data, np.uint8)
+        img = cv2.imdecode(buf, cv2.IMREAD_REDUCED_COLOR_4)
+        if img is not None and max(img.shape[:2]) < max_side // 2:
+            # ảnh gốc đã nhỏ: giải mã đủ độ phân giải (vẫn rẻ)
+            img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        if img is None:
+            return None
+        h, w = img.shape[:2]
+        if max(h, w) > max_side:
+            scale = max_side / max(h, w)
+            img = cv2.resize(img, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+        return np.ascontiguousarray(img[:, :, ::-1])
+
+    import io
+    from PIL import Image
+
+    try:
+        im = Image.open(io.BytesIO(data))
+        im.draft("RGB", (max_side, max_side))  # JPEG: giải mã thu nhỏ theo DCT
+        im = im.convert("RGB")
+        im.thumbnail((max_side, max_side))
+    except Exception:
+        return None
+    return np.asarray(im)
+
+
+def _erode(mask: np.ndarray, iterations: int = 2) -> np.ndarray:
+    """4-neighbour binary erosion (numpy only); keeps the Laplacian off the FOV rim."""
+    m = mask.copy()
+    for _ in range(iterations):
+        inner = np.zeros_like(m)
+        inner[1:-1, 1:-1] = m[1:-1, 1:-1] & m[:-2, 1:-1] & m[2:, 1:-1] & m[1:-1, :-2] & m[1:-1, 2:]
+        m = inner
+    return m
+
+
+def measure(rgb: np.ndarray, config: PrescreenConfig) -> Dict[str, float]:
+    rgb_f = rgb.astype(np.float32)
+    gray = rgb_f @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+    fov = rgb.max(axis=2) > config.fov_threshold
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]) - 4.0 * gray[1:-1, 1:-1]
+    inner = _erode(fov)[1:-1, 1:-1]
+    return {
+        "width": float(rgb.shape[1]),
+        "height": float(rgb.shape[0]),
+        "clipped_fraction": float(np.mean(gray >= 250)),
+        "p99": float(np.percentile(gray, 99)),
+        "white_ratio": float(np.mean(gray > 200)),
+        "fov_fraction": float(fov.mean()),
+        "blur_variance": float(lap[inner].var()) if inner.any() else 0.0,
+    }
+
+
+def prescreen(data: bytes, config: Optional[PrescreenConfig] = None) -> PrescreenResult:
+    """Run all checks on a reduced-resolution decode of `data`."""
+    config = config or PrescreenConfig()
+    t0 = time.perf_counter()
+
+    def done(action: str, check: Optional[str] = None, reason: str = "", metrics=None) -> PrescreenResult:
+        return PrescreenResult(action, check, reason, metrics or {}, (time.perf_counter() - t0) * 1000)
+
+    rgb = decode_thumbnail(data, config.thumb_max_side)
+    if rgb is None or rgb.size == 0:
+        return done(REJECT, "decode", "File is not a readable image")
+
+    m = measure(rgb, config)
+    if m["clipped_fraction"] > config.overexposed_fraction:
+        return done(REJECT, "overexposed", "Image is overexposed", m)
+    if m["p99"] < config.underexposed_p99:
+        return done(REJECT, "underexposed", "Image is too dark", m)
+    if m["white_ratio"] > config.selfie_white_ratio:
+        return done(SHORT_CIRCUIT, "selfie", "Ordinary eye photo (selfie), not a fundus image", m)
+    if m["fov_fraction"] < config.min_fov_fraction:
+        return done(REJECT, "fov", "Fundus field of view is too small", m)
+    if m["blur_variance"] < config.min_blur_variance:
+        return done(REJECT, "blur", "Image is too blurry", m)
+    return done(PASS, metrics=m)
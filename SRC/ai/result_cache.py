@@ -0,0 +1,268 @@
+"""
+Result cache - cache kết quả phân tích ảnh theo nội dung (SHA-256) + phiên bản pipeline.
+
+Two tiers:
+  - memory: bounded LRU (entry count + total bytes)
+  - disk (optional): one JSON file with the metrics plus one file per encoded image
+
+Entries older than max_age_seconds are treated as misses and removed. When the
+disk tier grows past disk_max_bytes the least recently used entries are deleted.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+
+@dataclass
+class CachedResult:
+    """Cached analysis output: JSON-serialisable metrics and encoded images by name."""
+    metrics: Dict[str, Any]
+    images: Dict[str, bytes] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.time)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(b) for b in self.images.values()) + len(json.dumps(self.metrics))
+
+
+class ResultCache:
+    """Two-tier (memory LRU + disk) cache for analysis results."""
+
+    def __init__(
+        self,
+        disk_dir: Optional[Union[str, Path]] = None,
+        memory_max_entries: int = 128,
+        memory_max_bytes: int = 64 * 1024 * 1024,
+        disk_max_bytes: int = 512 * 1024 * 1024,
+        max_age_seconds: float = 7 * 24 * 3600,
+    ):
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.memory_max_entries = memory_max_entries
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+        self.max_age_seconds = max_age_seconds
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._memory_sizes: Dict[str, int] = {}
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None  # computed lazily on first disk write
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "puts": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0,
+            "expired": 0,
+        }
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(content: Union[bytes, memoryview], version: str) -> str:
+        """Key for raw uploaded bytes under a given pipeline/model version."""
+        return ResultCache.key_for_digest(hashlib.sha256(content).hexdigest(), version)
+
+    @staticmethod
+    def key_for_digest(sha256_hex: str, version: str) -> str:
+        """Key for an already computed SHA-256 hex digest of the upload."""
+        return hashlib.sha256(f"{version}:{sha256_hex}".encode("utf-8")).hexdigest()
+
+    # ---- public API -------------------------------------------------------
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if self._expired(entry, now):
+                    self._drop_memory(key)
+                    self._counters["expired"] += 1
+                else:
+                    self._memory.move_to_end(key)
+                    self._counters["hits"] += 1
+                    self._counters["memory_hits"] += 1
+                    return entry
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._counters["disk_hits"] += 1
+            self._store_memory(key, entry)
+        return entry
+
+    def put(self, key: str, metrics: Dict[str, Any], images: Optional[Dict[str, bytes]] = None) -> CachedResult:
+        entry = CachedResult(metrics=dict(metrics), images=dict(images or {}))
+        with self._lock:
+            self._counters["puts"] += 1
+            self._store_memory(key, entry)
+        self._write_disk(key, entry)
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self._counters["hits"] + self._counters["misses"]
+            return {
+                **self._counters,
+                "hit_rate": (self._counters["hits"] / lookups) if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": self._disk_bytes or 0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_sizes.clear()
+            self._memory_bytes = 0
+        if self.disk_dir:
+            for p in self.disk_dir.glob("*/*"):
+                try:
+                    p.unlink()
+                except OSError:
+                    pass
+            self._disk_bytes = 0
+
+    def prune(self):
+        """Remove expired disk entries and enforce disk_max_bytes."""
+        if not self.disk_dir:
+            return
+        now = time.time()
+        entries = []  # (last_used, key, size)
+        total = 0
+        for meta in self.disk_dir.glob("*/*.json"):
+            key = meta.stem
+            files = self._disk_files(key)
+            try:
+                st = meta.stat()
+                size = sum(f.stat().st_size for f in files if f.exists())
+            except OSError:
+                continue
+            # mtime is never older than created_at, so an old mtime means expired
+            if now - st.st_mtime > self.max_age_seconds or now - self._created_at(meta) > self.max_age_seconds:
+                self._remove_disk(key)
+                with self._lock:
+                    self._counters["expired"] += 1
+                continue
+            entries.append((st.st_mtime, key, size))
+            total += size
+
+        if total > self.disk_max_bytes:
+            entries.sort()
+            for _, key, size in entries:
+                if total <= self.disk_max_bytes * 0.9:
+                    break
+                self._remove_disk(key)
+                total -= size
+                with self._lock:
+                    self._counters["disk_evictions"] += 1
+        self._disk_bytes = total
+
+    # ---- memory tier ------------------------------------------------------
+
+    def _expired(self, entry: CachedResult, now: float) -> bool:
+        return now - entry.created_at > self.max_age_seconds
+
+    def _store_memory(self, key: str, entry: CachedResult):
+        if key in self._memory:
+            self._drop_memory(key)
+        size = entry.nbytes
+        if size > self.memory_max_bytes:
+            return
+        self._memory[key] = entry
+        self._memory_sizes[key] = size
+        self._memory_bytes += size
+        while len(self._memory) > self.memory_max_entries or self._memory_bytes > self.memory_max_bytes:
+            old_key, _ = next(iter(self._memory.items()))
+            self._drop_memory(old_key)
+            self._counters["memory_evictions"] += 1
+
+    def _drop_memory(self, key: str):
+        if self._memory.pop(key, None) is not None:
+            self._memory_bytes -= self._memory_sizes.pop(key)
+
+    # ---- disk tier --------------------------------------------------------
+
+    def _meta_path(self, key: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.json"
+
+    def _image_path(self, key: str, name: str) -> Path:
+        return self.disk_dir / key[:2] / f"{key}.{name}.bin"
+
+    def _disk_files(self, key: str):
+        meta = self._meta_path(key)
+        return [meta] + list(meta.parent.glob(f"{key}.*.bin"))
+
+    @staticmethod
+    def _created_at(meta: Path) -> float:
+        try:
+            return float(json.loads(meta.read_text(encoding="utf-8")).get("created_at", 0))
+        except Exception:
+            return 0.0
+
+    def _read_disk(self, key: str, now: float) -> Optional[CachedResult]:
+        if not self.disk_dir:
+            return None
+        meta = self._meta_path(key)
+        try:
+            doc = json.loads(meta.read_text(encoding="utf-8"))
+            entry = CachedResult(metrics=doc["metrics"], created_at=float(doc["created_at"]))
+            if self._expired(entry, now):
+                self._remove_disk(key)
+                with self._lock:
+                    self._counters["expired"] += 1
+                return None
+            for name in doc.get("images", []):
+                entry.images[name] = self._image_path(key, name).read_bytes()
+            # bump mtime so size-based eviction drops least recently used entries first
+            os.utime(meta, None)
+            return entry
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key: str, entry: CachedResult):
+        if not self.disk_dir:
+            return
+        meta = self._meta_path(key)
+        meta.parent.mkdir(parents=True, exist_ok=True)
+        written = 0
+        try:
+            for name, data in entry.images.items():
+                written += self._atomic_write(self._image_path(key, name), data)
+            doc = {"metrics": entry.metrics, "images": sorted(entry.images), "created_at": entry.created_at}
+            written += self._atomic_write(meta, json.dumps(doc).encode("utf-8"))
+        except OSError:
+            self._remove_disk(key)
+            return
+
+        if self._disk_bytes is None:
+            self.prune()
+        else:
+            self._disk_bytes += written
+            if self._disk_bytes > self.disk_max_bytes:
+                self.prune()
+
+    @staticmethod
+    def _atomic_write(path: Path, data: bytes) -> int:
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        return len(data)
+
+    def _remove_disk(self, key: str):
+        for p in self._disk_files(key):
+            try:
+                p.unlink()
+            except OSError:
+                pass
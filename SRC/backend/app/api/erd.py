@@ -4,7 +4,6 @@ ERD Processing API Endpoints
 from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from fastapi.responses import FileResponse
 from typing import Dict, List, Optional
-import shutil
 import uuid
 import os
 from pathlib import Path
@@ -23,6 +22,8 @@ if str(BASE_DIR) not in sys.path:
 from ai.erd_parser import ERDParser
 from ai.model_generator import ModelGenerator
 from ai.database_generator import DatabaseGenerator
+from ai.ingest import IngestError, ingest_upload
+from ..services.analysis import upload_limits
 
 router = APIRouter(prefix="/erd", tags=["erd"])
 
@@ -48,8 +49,10 @@ async def upload_erd(
     filename = f"{uuid.uuid4().hex}_{file.filename}"
     file_path = ERD_DIR / filename
     
-    with file_path.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    try:
+        await ingest_upload(file, upload_limits, allowed=("png", "jpeg", "svg"), dest=file_path)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     
     try:
         # Parse ERD
@@ -1,8 +1,28 @@
 import os
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
 
 class Settings:
     secret_key: str = os.getenv("SECRET_KEY", "change-me")
     algorithm: str = os.getenv("ALGORITHM", "HS256")
     access_token_expire_minutes: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+    # Analysis result cache (keyed by upload SHA-256 + ENGINE_VERSION)
+    result_cache_dir: str = os.getenv("RESULT_CACHE_DIR", str(BACKEND_DIR / "cache" / "results"))
+    result_cache_memory_entries: int = int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "128"))
+    result_cache_disk_mb: int = int(os.getenv("RESULT_CACHE_DISK_MB", "512"))
+    result_cache_max_age_hours: float = float(os.getenv("RESULT_CACHE_MAX_AGE_HOURS", "168"))
+    # Upload limits (streamed ingestion, see ai.ingest)
+    upload_max_mb: float = float(os.getenv("UPLOAD_MAX_MB", "25"))
+    upload_max_megapixels: float = float(os.getenv("UPLOAD_MAX_MEGAPIXELS", "50"))
+    upload_max_side: int = int(os.getenv("UPLOAD_MAX_SIDE", "20000"))
+    # Background analysis jobs (SQLite queue + worker processes)
+    jobs_db_path: str = os.getenv("JOBS_DB_PATH", str(BACKEND_DIR / "jobs.db"))
+    job_workers: int = int(os.getenv("JOB_WORKERS", "2"))
+    job_visibility_timeout: float = float(os.getenv("JOB_VISIBILITY_TIMEOUT", "300"))
+    job_max_attempts: int = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+    # Near-duplicate uploads of the same user (perceptual hash, see ai.near_duplicate):
+    # reuse = return the earlier result, flag = analyze anyway but report the match, off
+    near_dup_mode: str = os.getenv("NEAR_DUP_MODE", "reuse")
 
 settings = Settings()
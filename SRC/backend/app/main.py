@@ -11,9 +11,13 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 PROJECT_ROOT = BASE_DIR.parent
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
-from ai.engine import analyze_image
 from .services.storage import storage
-import shutil
+from .services.analysis import result_cache, upload_limits, near_duplicates
+from .services.jobs import job_queue, WorkerPool, Job, DONE, FAILED
+from .config import settings
+from ai.ingest import IngestError, ingest_upload
+from ai.near_duplicate import image_hashes
+import asyncio
 import uuid
 import os
 from typing import Dict, List, Optional
@@ -96,37 +100,113 @@ def on_startup():
             ensure_user("admin@example.com", "admin", "adminpass")
             session.commit()
 
-@app.post("/upload")
+@app.post("/upload", status_code=202)
 async def upload_image(file: UploadFile = File(...), current_user: User = Depends(auth.get_current_user)):
-    # save file
+    # stream to disk off the event loop; hashed and size/pixel checked while receiving
     filename = f"{uuid.uuid4().hex}_{file.filename}"
     dest = MEDIA_DIR / filename
-    with dest.open("wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    # call AI engine
-    annotated_name = f"annotated_{filename}"
-    annotated_path = MEDIA_DIR / annotated_name
     try:
-        risk, annotated = analyze_image(str(dest), str(annotated_path))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+        spool = await ingest_upload(file, upload_limits, allowed=("png", "jpeg", "webp"), dest=dest)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    # queue the analysis; a worker process runs the AI engine
+    annotated_path = MEDIA_DIR / f"annotated_{filename}"
+    payload = {
+        "input_path": str(dest),
+        "annotated_path": str(annotated_path),
+        "sha256": spool.sha256,
+    }
+    # near-duplicate of one of this user's recent uploads: the job reuses (or just flags) its result
+    if settings.near_dup_mode != "off":
+        with spool:
+            hashes = await asyncio.to_thread(image_hashes, spool.buffer())
+        if hashes is not None:
+            scope = str(current_user.id)
+            match = near_duplicates.find(scope, hashes)
+            if match is not None and match.value != spool.sha256:
+                payload["near_duplicate"] = {"of": match.value, "reuse": settings.near_dup_mode == "reuse",
+                                             **match.to_dict()}
+            near_duplicates.add(scope, hashes, spool.sha256)
+    job_id = job_queue.enqueue(current_user.id, payload)
+    return {"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"}
+
+
+async def finalize_job(job: Job) -> Job:
+    """Persist the outcome of a finished job and notify its owner (exactly once)."""
+    if job.status not in (DONE, FAILED) or not job_queue.begin_finalize(job.id):
+        return job
+    if job.status == FAILED:
+        await manager.send_personal_message(job.user_id, f"Analysis failed: job_id={job.id}")
+        return job
 
     # upload / map to URL
-    original_url = storage.upload_if_configured(str(dest))
-    annotated_url = storage.upload_if_configured(str(annotated_path))
+    original_url = storage.upload_if_configured(job.payload["input_path"])
+    annotated_url = storage.upload_if_configured(job.payload["annotated_path"])
 
     # write to DB using get_session
     with get_session() as session:
-        rec = AnalysisRecord(user_id=current_user.id if current_user else 0, original_image=original_url, annotated_image=annotated_url, risk_score=risk)
+        rec = AnalysisRecord(user_id=job.user_id, original_image=original_url, annotated_image=annotated_url, risk_score=job.result["risk_score"])
         session.add(rec)
         session.commit()
         session.refresh(rec)
+    job_queue.set_record(job.id, rec.id)
+    job.record_id = rec.id
 
     # notify user via websocket if connected
-    await manager.send_personal_message(current_user.id, f"Analysis complete: record_id={rec.id}, risk={rec.risk_score:.2f}")
+    await manager.send_personal_message(job.user_id, f"Analysis complete: record_id={rec.id}, risk={rec.risk_score:.2f}")
+    return job
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, current_user: User = Depends(auth.get_current_user)):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.user_id != current_user.id and current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Access denied")
+    job = await finalize_job(job)
+
+    out = {"job_id": job.id, "status": job.status, "attempts": job.attempts, "error": job.error if job.status == FAILED else None}
+    if job.status == DONE and job.record_id is not None:
+        with get_session() as session:
+            rec = session.get(AnalysisRecord, job.record_id)
+        out["record"] = {"id": rec.id, "risk_score": rec.risk_score, "annotated_image": rec.annotated_image, "original_image": rec.original_image, "status": rec.status, "created_at": rec.created_at.isoformat(), "cache_hit": job.result.get("cache_hit", False), "near_duplicate": job.result.get("near_duplicate")}
+    return out
+
+worker_pool: Optional[WorkerPool] = None
+
+async def dispatch_finished_jobs(poll_interval: float = 0.5):
+    """Background loop: record finished jobs, push notifications, respawn crashed workers."""
+    while True:
+        try:
+            for job in job_queue.unfinalized():
+                await finalize_job(job)
+            if worker_pool:
+                worker_pool.ensure_alive()
+        except Exception as e:
+            print(f"job dispatcher error: {e}")
+        await asyncio.sleep(poll_interval)
+
+@app.on_event("startup")
+async def start_job_workers():
+    global worker_pool
+    if settings.job_workers > 0:
+        worker_pool = WorkerPool(job_queue, settings.job_workers)
+        worker_pool.start()
+    app.state.job_dispatcher = asyncio.create_task(dispatch_finished_jobs())
+
+@app.on_event("shutdown")
+async def stop_job_workers():
+    task = getattr(app.state, "job_dispatcher", None)
+    if task:
+        task.cancel()
+    if worker_pool:
+        worker_pool.stop()
 
-    return {"id": rec.id, "risk_score": rec.risk_score, "annotated_image": annotated_url, "original_image": original_url, "status": rec.status, "created_at": rec.created_at.isoformat()}
+@app.get("/admin/cache/stats")
+def cache_stats(current_user: User = require_roles("admin")):
+    """Hit/miss counters and size of the analysis result cache"""
+    return result_cache.stats()
 
 # Patient endpoints
 @app.get("/patient/records")
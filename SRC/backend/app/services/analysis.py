@@ -0,0 +1,82 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Ensure top-level project packages like `ai/` are importable
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent.parent
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from ai.engine import analyze_bytes, encode, ENGINE_VERSION
+from ai.ingest import IngestLimits, map_file
+from ai.near_duplicate import NearDuplicateIndex
+from ai.result_cache import ResultCache
+from ..config import settings
+
+result_cache = ResultCache(
+    disk_dir=settings.result_cache_dir,
+    memory_max_entries=settings.result_cache_memory_entries,
+    disk_max_bytes=settings.result_cache_disk_mb * 1024 * 1024,
+    max_age_seconds=settings.result_cache_max_age_hours * 3600,
+)
+
+# perceptual hashes of each user's recent uploads (NEAR_DUP_MAX_DISTANCE, NEAR_DUP_MAX_ENTRIES,
+# NEAR_DUP_MAX_AGE_HOURS); in memory, per API process
+near_duplicates = NearDuplicateIndex.from_env()
+
+upload_limits = IngestLimits(
+    max_bytes=int(settings.upload_max_mb * 1024 * 1024),
+    max_pixels=int(settings.upload_max_megapixels * 1_000_000),
+    max_side=settings.upload_max_side,
+)
+
+
+# persistence of one result (annotated file + cache entry) runs on these threads in parallel
+_io_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="analysis-io")
+
+
+def _write(path: str, data: bytes):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    Path(path).write_bytes(data)
+
+
+def reuse_cached(sha256_hex: str, output_path: str) -> Optional[float]:
+    """Risk score of the cached result for another upload (a near duplicate), written to
+    output_path; None when that result is no longer cached."""
+    cached = result_cache.get(ResultCache.key_for_digest(sha256_hex, ENGINE_VERSION))
+    if cached is None:
+        return None
+    _write(output_path, cached.images["annotated"])
+    return float(cached.metrics["risk_score"])
+
+
+def analyze_with_cache(input_path: str, output_path: str, sha256_hex: str,
+                       data: Optional[bytes] = None) -> Tuple[float, bool]:
+    """Run the AI engine on the upload unless a result for the same content is cached.
+
+    The upload is decoded once from memory (`data`, or a read-only memory map
+    of input_path); the annotated image is encoded once, in the format of
+    output_path's extension, and written to output_path while the same bytes
+    are stored in the cache.
+    Returns (risk_score, cache_hit).
+    """
+    key = ResultCache.key_for_digest(sha256_hex, ENGINE_VERSION)
+    cached = result_cache.get(key)
+    if cached is not None:
+        _write(output_path, cached.images["annotated"])
+        return float(cached.metrics["risk_score"]), True
+
+    if data is None:
+        with map_file(input_path) as buf:
+            result = analyze_bytes(buf)
+    else:
+        result = analyze_bytes(data)
+    annotated = encode(result.annotated, Path(output_path).suffix or ".png")
+    pending = [
+        _io_pool.submit(_write, output_path, annotated),
+        _io_pool.submit(result_cache.put, key, {"risk_score": result.risk_score}, {"annotated": annotated}),
+    ]
+    for fut in pending:
+        fut.result()
+    return result.risk_score, False
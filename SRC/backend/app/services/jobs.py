@@ -0,0 +1,280 @@
+"""
+Durable analysis job queue backed by SQLite.
+
+/upload enqueues a job and returns immediately; a pool of worker processes
+claims jobs, runs the AI engine and stores the result. A claimed job stays
+invisible to other workers for `visibility_timeout` seconds: if its worker
+dies (or the whole server restarts) the job becomes claimable again and is
+retried until `max_attempts` is reached.
+"""
+import json
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from ..config import settings
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+@dataclass
+class Job:
+    id: str
+    user_id: int
+    status: str
+    payload: Dict[str, Any]
+    result: Optional[Dict[str, Any]]
+    error: Optional[str]
+    attempts: int
+    record_id: Optional[int]
+    created_at: float
+    updated_at: float
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Job":
+        return cls(
+            id=row["id"],
+            user_id=row["user_id"],
+            status=row["status"],
+            payload=json.loads(row["payload"]),
+            result=json.loads(row["result"]) if row["result"] else None,
+            error=row["error"],
+            attempts=row["attempts"],
+            record_id=row["record_id"],
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+        )
+
+
+class JobQueue:
+    def __init__(self, db_path: str, visibility_timeout: float = 300, max_attempts: int = 3):
+        self.db_path = db_path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                '''CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    status TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    visible_at REAL NOT NULL,
+                    finalized INTEGER NOT NULL DEFAULT 0,
+                    record_id INTEGER,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_jobs_claim ON jobs (status, visible_at)")
+        finally:
+            conn.close()
+
+    def enqueue(self, user_id: int, payload: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT INTO jobs (id, user_id, status, payload, visible_at, created_at, updated_at) VALUES (?,?,?,?,?,?,?)",
+                (job_id, user_id, QUEUED, json.dumps(payload), now, now, now))
+        finally:
+            conn.close()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return Job.from_row(row) if row else None
+
+    def claim(self) -> Optional[Job]:
+        """Take the oldest visible job (queued, or running with an expired lease)."""
+        conn = self._connect()
+        try:
+            while True:
+                now = time.time()
+                conn.execute("BEGIN IMMEDIATE")
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE status IN (?, ?) AND visible_at <= ? ORDER BY created_at LIMIT 1",
+                    (QUEUED, RUNNING, now)).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row["attempts"] >= self.max_attempts:
+                    # lease expired on the last attempt: worker died mid-job
+                    conn.execute(
+                        "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+                        (FAILED, row["error"] or "worker lease expired", now, row["id"]))
+                    conn.execute("COMMIT")
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, visible_at = ?, updated_at = ? WHERE id = ?",
+                    (RUNNING, now + self.visibility_timeout, now, row["id"]))
+                conn.execute("COMMIT")
+                return self.get(row["id"])
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete(self, job_id: str, result: Dict[str, Any]):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, updated_at = ? WHERE id = ? AND status = ?",
+                (DONE, json.dumps(result), time.time(), job_id, RUNNING))
+        finally:
+            conn.close()
+
+    def fail(self, job_id: str, error: str):
+        """Record a failed attempt; the job is retried with backoff until max_attempts."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            if row["attempts"] >= self.max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (FAILED, error, now, job_id, RUNNING))
+            else:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, visible_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                    (QUEUED, error, now + 2 ** row["attempts"], now, job_id, RUNNING))
+        finally:
+            conn.close()
+
+    def unfinalized(self, limit: int = 50) -> List[Job]:
+        """Finished jobs whose outcome has not yet been recorded/notified by the API."""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) AND finalized = 0 ORDER BY updated_at LIMIT ?",
+                (DONE, FAILED, limit)).fetchall()
+        finally:
+            conn.close()
+        return [Job.from_row(r) for r in rows]
+
+    def begin_finalize(self, job_id: str) -> bool:
+        """Atomically take ownership of finalizing a job; False if someone else did."""
+        conn = self._connect()
+        try:
+            cur = conn.execute("UPDATE jobs SET finalized = 1 WHERE id = ? AND finalized = 0", (job_id,))
+            return cur.rowcount == 1
+        finally:
+            conn.close()
+
+    def set_record(self, job_id: str, record_id: int):
+        conn = self._connect()
+        try:
+            conn.execute("UPDATE jobs SET record_id = ? WHERE id = ?", (record_id, job_id))
+        finally:
+            conn.close()
+
+
+def run_job(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Execute one analysis job; runs inside a worker process."""
+    from .analysis import analyze_with_cache, reuse_cached
+    near = payload.get("near_duplicate")
+    if near is not None and near.get("reuse"):
+        # same eye photo re-sent (recompressed / resized / screenshot): earlier result
+        risk = reuse_cached(near["of"], payload["annotated_path"])
+        if risk is not None:
+            return {"risk_score": risk, "cache_hit": True, "near_duplicate": {**near, "reused": True}}
+    risk, cache_hit = analyze_with_cache(payload["input_path"], payload["annotated_path"], payload["sha256"])
+    result = {"risk_score": risk, "cache_hit": cache_hit}
+    if near is not None:
+        result["near_duplicate"] = {**near, "reused": False}
+    return result
+
+
+def process_next(queue: "JobQueue") -> bool:
+    """Claim and run one job. Returns False when nothing was claimable."""
+    job = queue.claim()
+    if job is None:
+        return False
+    try:
+        result = run_job(job.payload)
+    except Exception as e:
+        queue.fail(job.id, str(e))
+    else:
+        queue.complete(job.id, result)
+    return True
+
+
+def worker_main(db_path: str, visibility_timeout: float, max_attempts: int, poll_interval: float, stop_event):
+    queue = JobQueue(db_path, visibility_timeout=visibility_timeout, max_attempts=max_attempts)
+    while not stop_event.is_set():
+        try:
+            busy = process_next(queue)
+        except sqlite3.OperationalError:
+            busy = False
+        if not busy:
+            stop_event.wait(poll_interval)
+
+
+class WorkerPool:
+    """Fixed-size pool of worker processes draining a JobQueue."""
+
+    def __init__(self, queue: JobQueue, size: int, poll_interval: float = 0.5):
+        self.queue = queue
+        self.size = size
+        self.poll_interval = poll_interval
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = self._ctx.Event()
+        self._procs: List[multiprocessing.Process] = []
+
+    def _spawn(self, i: int) -> multiprocessing.Process:
+        p = self._ctx.Process(
+            target=worker_main,
+            args=(self.queue.db_path, self.queue.visibility_timeout, self.queue.max_attempts, self.poll_interval, self._stop),
+            name=f"analysis-worker-{i}",
+            daemon=True,
+        )
+        p.start()
+        return p
+
+    def start(self):
+        self._stop.clear()
+        self._procs = [self._spawn(i) for i in range(self.size)]
+
+    def ensure_alive(self):
+        """Replace workers that crashed; their jobs are retried once the lease expires."""
+        if self._stop.is_set():
+            return
+        for i, p in enumerate(self._procs):
+            if not p.is_alive():
+                self._procs[i] = self._spawn(i)
+
+    def stop(self, timeout: float = 10):
+        self._stop.set()
+        for p in self._procs:
+            p.join(timeout)
+            if p.is_alive():
+                p.terminate()
+        self._procs = []
+
+
+os.makedirs(os.path.dirname(os.path.abspath(settings.jobs_db_path)), exist_ok=True)
+job_queue = JobQueue(settings.jobs_db_path, visibility_timeout=settings.job_visibility_timeout, max_attempts=settings.job_max_attempts)
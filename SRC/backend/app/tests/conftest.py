@@ -1,5 +1,6 @@
 import os
 import pathlib
+import tempfile
 
 # Use in-memory database for tests to keep isolation
 os.environ.setdefault("DATABASE_URL", "sqlite:///:memory:")
@@ -13,3 +14,17 @@ if db_file.exists():
 
 # Ensure registration secret isn't set unless explicitly needed by a test
 os.environ.setdefault("REGISTRATION_SECRET", "")
+
+# Keep cached analysis results out of the source tree
+os.environ.setdefault("RESULT_CACHE_DIR", tempfile.mkdtemp(prefix="aura-cache-"))
+
+# Jobs are processed in-process by the tests (see drain_jobs); no worker processes
+os.environ.setdefault("JOBS_DB_PATH", os.path.join(tempfile.mkdtemp(prefix="aura-jobs-"), "jobs.db"))
+os.environ.setdefault("JOB_WORKERS", "0")
+
+
+def drain_jobs():
+    """Run every queued analysis job in the current process."""
+    from app.services.jobs import job_queue, process_next
+    while process_next(job_queue):
+        pass
@@ -1,6 +1,7 @@
 import io
 from fastapi.testclient import TestClient
 from app.main import app
+from app.tests.conftest import drain_jobs
 
 client = TestClient(app)
 
@@ -26,8 +27,18 @@ def test_register_login_and_upload():
     headers = {"Authorization": f"Bearer {token}"}
     files = {"file": ("small.png", buf, "image/png")}
     r = client.post("/upload", headers=headers, files=files)
+    assert r.status_code == 202
+    job_id = r.json()["job_id"]
+
+    r = client.get(f"/jobs/{job_id}", headers=headers)
+    assert r.status_code == 200
+    assert r.json()["status"] == "queued"
+
+    drain_jobs()
+    r = client.get(f"/jobs/{job_id}", headers=headers)
     assert r.status_code == 200
     data = r.json()
-    assert "risk_score" in data
-    assert data.get("annotated_image")
+    assert data["status"] == "done"
+    assert "risk_score" in data["record"]
+    assert data["record"].get("annotated_image")
 
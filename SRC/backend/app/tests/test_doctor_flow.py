@@ -1,5 +1,6 @@
 from fastapi.testclient import TestClient
 from app.main import app
+from app.tests.conftest import drain_jobs
 
 client = TestClient(app)
 
@@ -69,7 +70,10 @@ def test_doctor_review_flow():
     headers = {"Authorization": f"Bearer {token_patient}"}
     files = {"file": ("small.png", buf, "image/png")}
     r = client.post("/upload", headers=headers, files=files)
-    assert r.status_code == 200
+    assert r.status_code == 202
+    drain_jobs()
+    r = client.get(f"/jobs/{r.json()['job_id']}", headers=headers)
+    assert r.json()["status"] == "done"
 
     # login as doctor and get pending
     r = client.post("/auth/login", data={"username": "doc@example.com", "password": "pass"})
@@ -0,0 +1,50 @@
+import hashlib
+
+import cv2
+import numpy as np
+import pytest
+from app.services.analysis import analyze_with_cache
+from ai.engine import analyze_array, analyze_bytes, analyze_image, decode, encode
+
+
+def _fundus(h=240, w=320):
+    img = np.zeros((h, w, 3), np.uint8)
+    cv2.circle(img, (w // 2, h // 2), 100, (40, 90, 170), -1)
+    cv2.line(img, (100, 80), (220, 160), (20, 40, 90), 3)
+    return img
+
+
+def test_bytes_api_matches_path_wrapper(tmp_path):
+    img = _fundus()
+    data = encode(img)
+    path = tmp_path / "in.png"
+    path.write_bytes(data)
+
+    result = analyze_bytes(data)
+    risk, out = analyze_image(str(path), str(tmp_path / "out.png"))
+    assert result.risk_score == risk
+    assert np.array_equal(cv2.imread(out), result.annotated)
+    assert result.mask.shape == img.shape[:2] and result.mask.dtype == np.uint8
+    assert analyze_array(img).risk_score == risk
+
+
+def test_decode_encode_round_trip():
+    img = _fundus()
+    assert np.array_equal(decode(encode(img)), img)
+    assert decode(encode(img, ".jpg", [cv2.IMWRITE_JPEG_QUALITY, 90])).shape == img.shape
+    with pytest.raises(ValueError):
+        decode(b"not an image")
+
+
+def test_analyze_with_cache_from_memory(tmp_path):
+    data = encode(_fundus(200, 300))
+    sha = hashlib.sha256(data).hexdigest()
+    out = tmp_path / "annotated.jpg"
+    # the input path is never read when the bytes are passed in
+    risk, hit = analyze_with_cache(str(tmp_path / "missing.png"), str(out), sha, data=data)
+    assert not hit and risk == analyze_bytes(data).risk_score
+    assert out.read_bytes()[:2] == b"\xff\xd8"  # encoded in the output path's format
+
+    out2 = tmp_path / "again.jpg"
+    risk2, hit2 = analyze_with_cache(str(tmp_path / "missing.png"), str(out2), sha, data=data)
+    assert hit2 and risk2 == risk and out2.read_bytes() == out.read_bytes()
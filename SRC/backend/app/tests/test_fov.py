@@ -0,0 +1,43 @@
+import cv2
+import numpy as np
+import app.services.analysis  # noqa: F401  (puts SRC on sys.path for the `ai` package)
+from ai.engine import analyze_image
+from ai.fov import detect_fov
+
+
+def _framed_fundus(h=300, w=400):
+    img = np.zeros((h, w, 3), np.uint8)
+    cv2.circle(img, (w // 2, h // 2), 120, (40, 90, 170), -1)
+    cv2.line(img, (120, 100), (280, 200), (20, 40, 90), 3)
+    return img
+
+
+def test_detect_fov_bbox_and_paste():
+    img = _framed_fundus()
+    roi = detect_fov(img, margin=2)
+    # disc of radius 120 centred at (200, 150); the box hugs it within a few pixels
+    for got, expected in zip((roi.y0, roi.y1, roi.x0, roi.x1), (30, 271, 80, 321)):
+        assert abs(got - expected) <= 4
+    assert 0.45 < roi.saved_fraction < 0.55
+
+    full = roi.paste(np.ones(roi.shape, np.uint8))
+    assert full.shape == img.shape[:2]
+    assert full.sum() == roi.shape[0] * roi.shape[1]
+    assert full[0, 0] == 0
+
+
+def test_detect_fov_alignment_and_empty_frame():
+    roi = detect_fov(_framed_fundus(), align=32)
+    assert roi.shape[0] % 32 == 0 and roi.shape[1] % 32 == 0
+    assert 0 <= roi.y0 and roi.y1 <= 300 and 0 <= roi.x0 and roi.x1 <= 400
+
+    empty = detect_fov(np.zeros((50, 60), np.uint8))
+    assert empty.is_full and empty.saved_fraction == 0.0
+
+
+def test_engine_roi_matches_full_frame(tmp_path):
+    path = str(tmp_path / "in.png")
+    cv2.imwrite(path, _framed_fundus())
+    risk_roi, _ = analyze_image(path, str(tmp_path / "a.png"))
+    risk_full, _ = analyze_image(path, str(tmp_path / "b.png"), crop_fov=False)
+    assert risk_roi == risk_full
@@ -0,0 +1,65 @@
+import email.policy
+import json
+import time
+from email.parser import BytesParser
+
+import cv2
+import numpy as np
+import pytest
+import app.services.analysis  # noqa: F401  (puts SRC on sys.path for the `ai` package)
+from ai.image_response import EncoderConfig, ImageLinkStore, multipart_body
+
+
+def _image():
+    img = np.zeros((120, 160, 3), np.uint8)
+    cv2.circle(img, (80, 60), 50, (40, 90, 170), -1)
+    return img
+
+
+def test_encoder_formats_and_validation():
+    img = _image()
+    for fmt, magic in (("jpeg", b"\xff\xd8"), ("png", b"\x89PNG"), ("webp", b"RIFF")):
+        data = EncoderConfig(format=fmt).encode(img)
+        assert data.startswith(magic)
+        assert cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape == img.shape
+    # lossless PNG keeps pixels; RGB input is converted
+    png = EncoderConfig(format="png", png_compression=9).encode(img[..., ::-1].copy(), rgb=True)
+    assert np.array_equal(cv2.imdecode(np.frombuffer(png, np.uint8), cv2.IMREAD_COLOR), img)
+    assert len(EncoderConfig(quality=30).encode(img)) < len(EncoderConfig(quality=95).encode(img))
+    assert EncoderConfig(format="webp", quality=80).tag != EncoderConfig(format="webp", quality=90).tag
+    with pytest.raises(ValueError):
+        EncoderConfig(format="gif")
+
+
+def test_encoder_from_env(monkeypatch):
+    monkeypatch.setenv("IMAGE_FORMAT", "WEBP")
+    monkeypatch.setenv("IMAGE_QUALITY", "70")
+    cfg = EncoderConfig.from_env(default_format="png")
+    assert (cfg.format, cfg.quality, cfg.media_type, cfg.ext) == ("webp", 70, "image/webp", ".webp")
+
+
+def test_multipart_body_parts():
+    jpeg = EncoderConfig().encode(_image())
+    body, content_type = multipart_body({"risk_score": 1.5, "message": "xong"}, {"processed": (jpeg, "image/jpeg")})
+    msg = BytesParser(policy=email.policy.default).parsebytes(
+        b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+    parts = list(msg.iter_parts())
+    assert [p.get_param("name", header="content-disposition") for p in parts] == ["metrics", "processed"]
+    assert json.loads(parts[0].get_content()) == {"risk_score": 1.5, "message": "xong"}
+    assert parts[1].get_content_type() == "image/jpeg" and parts[1].get_content() == jpeg
+    # binary parts: no base64 inflation
+    assert len(body) < len(jpeg) + 600
+
+
+def test_link_store_expiry_and_size_bound():
+    store = ImageLinkStore(ttl_seconds=0.05, max_bytes=10)
+    token = store.put(b"abcd", "image/png")
+    assert store.get(token) == (b"abcd", "image/png")
+    assert store.get("unknown") is None
+    time.sleep(0.1)
+    assert store.get(token) is None
+
+    store = ImageLinkStore(ttl_seconds=60, max_bytes=10)
+    first = store.put(b"123456", "image/png")
+    second = store.put(b"789012", "image/png")
+    assert store.get(first) is None and store.get(second) is not None
@@ -0,0 +1,105 @@
+import asyncio
+import hashlib
+import io
+import struct
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.main import app
+from ai.ingest import IngestError, IngestLimits, SNIFF_LIMIT, ingest_upload, sniff
+
+client = TestClient(app)
+
+
+class FakeUpload:
+    """Async read(n) over bytes, recording how much was consumed."""
+
+    def __init__(self, data: bytes, filename: str = "x.png"):
+        self.stream = io.BytesIO(data)
+        self.filename = filename
+        self.reads = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        self.reads += 1
+        return self.stream.read(n)
+
+
+def _ingest(data, **kwargs):
+    return asyncio.run(ingest_upload(FakeUpload(data), **kwargs))
+
+
+def _png_bomb(width: int, height: int) -> bytes:
+    """PNG whose IHDR declares width x height pixels, followed by junk."""
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    chunk = struct.pack(">I", len(ihdr)) + b"IHDR" + ihdr + struct.pack(">I", zlib.crc32(b"IHDR" + ihdr))
+    return b"\x89PNG\r\n\x1a\n" + chunk + b"\0" * (4 * 1024 * 1024)
+
+
+def test_streams_hashes_and_maps(tmp_path):
+    img = np.random.default_rng(0).integers(0, 255, (300, 200, 3), dtype=np.uint8)
+    data = cv2.imencode(".png", img)[1].tobytes()
+    with _ingest(data, spool_dir=tmp_path, chunk_size=4096) as spool:
+        assert spool.sha256 == hashlib.sha256(data).hexdigest()
+        assert (spool.format, spool.width, spool.height, spool.size) == ("png", 200, 300, len(data))
+        decoded = cv2.imdecode(np.frombuffer(spool.buffer(), np.uint8), cv2.IMREAD_COLOR)
+        assert np.array_equal(decoded, img)
+        del decoded
+    # spool file removed on close
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_dest_is_kept(tmp_path):
+    data = cv2.imencode(".jpg", np.zeros((40, 60, 3), np.uint8))[1].tobytes()
+    dest = tmp_path / "keep.jpg"
+    with _ingest(data, dest=dest) as spool:
+        assert (spool.format, spool.width, spool.height) == ("jpeg", 60, 40)
+    assert dest.read_bytes() == data
+
+
+def test_decompression_bomb_rejected_from_header(tmp_path):
+    upload = FakeUpload(_png_bomb(30000, 30000))
+    with pytest.raises(IngestError) as err:
+        asyncio.run(ingest_upload(upload, spool_dir=tmp_path, chunk_size=64 * 1024))
+    assert err.value.status_code == 413
+    # rejected on the first chunk, the remaining megabytes were never read
+    assert upload.reads == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_byte_limit_and_type_checks(tmp_path):
+    data = cv2.imencode(".png", np.zeros((8, 8, 3), np.uint8))[1].tobytes() + b"\0" * 5000
+    with pytest.raises(IngestError) as err:
+        _ingest(data, limits=IngestLimits(max_bytes=4096), spool_dir=tmp_path, chunk_size=1024)
+    assert err.value.status_code == 413
+    with pytest.raises(IngestError) as err:
+        _ingest(b"GIF89a" + b"\0" * 64, spool_dir=tmp_path)
+    assert err.value.status_code == 415
+    with pytest.raises(IngestError) as err:
+        _ingest(data, allowed=("jpeg",), spool_dir=tmp_path)
+    assert err.value.status_code == 415
+    with pytest.raises(IngestError):
+        _ingest(b"", spool_dir=tmp_path)
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_sniff_formats():
+    jpeg = cv2.imencode(".jpg", np.zeros((33, 77, 3), np.uint8))[1].tobytes()
+    # an APP segment larger than the sniff window pushes the frame header past it
+    app1 = b"\xff\xe1" + struct.pack(">H", 65535) + b"\0" * 65533
+    big_exif = jpeg[:2] + app1 * (SNIFF_LIMIT // 65537 + 1) + jpeg[2:]
+    assert sniff(big_exif) == ("jpeg", (77, 33))
+    assert sniff(big_exif[:SNIFF_LIMIT]) is None
+    assert sniff(cv2.imencode(".webp", np.zeros((21, 13, 3), np.uint8))[1].tobytes()) == ("webp", (13, 21))
+    assert sniff(b'<?xml version="1.0"?>\n<svg xmlns="http://www.w3.org/2000/svg"/>') == ("svg", None)
+
+
+def test_upload_endpoint_rejects_bomb():
+    client.post("/auth/register", json={"email": "ingest@example.com", "password": "pass"})
+    r = client.post("/auth/login", data={"username": "ingest@example.com", "password": "pass"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    files = {"file": ("bomb.png", io.BytesIO(_png_bomb(40000, 40000)), "image/png")}
+    r = client.post("/upload", headers=headers, files=files)
+    assert r.status_code == 413
@@ -0,0 +1,50 @@
+import time
+from app.services.jobs import JobQueue, QUEUED, RUNNING, DONE, FAILED
+
+
+def test_claim_complete(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"))
+    job_id = q.enqueue(7, {"input_path": "x"})
+
+    job = q.claim()
+    assert job.id == job_id and job.status == RUNNING and job.attempts == 1
+    assert q.claim() is None  # invisible while leased
+
+    q.complete(job_id, {"risk_score": 1.5})
+    job = q.get(job_id)
+    assert job.status == DONE and job.result == {"risk_score": 1.5}
+    assert [j.id for j in q.unfinalized()] == [job_id]
+    assert q.begin_finalize(job_id) is True
+    assert q.begin_finalize(job_id) is False
+    assert q.unfinalized() == []
+
+
+def test_expired_lease_is_retried_then_failed(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), visibility_timeout=0.05, max_attempts=2)
+    job_id = q.enqueue(1, {})
+
+    assert q.claim().attempts == 1
+    time.sleep(0.1)  # worker "died": lease expires
+    assert q.claim().attempts == 2
+    time.sleep(0.1)
+    assert q.claim() is None
+    job = q.get(job_id)
+    assert job.status == FAILED and job.error == "worker lease expired"
+
+
+def test_failed_attempt_requeued_with_backoff(tmp_path):
+    q = JobQueue(str(tmp_path / "jobs.db"), max_attempts=2)
+    job_id = q.enqueue(1, {})
+    q.claim()
+    q.fail(job_id, "boom")
+    job = q.get(job_id)
+    assert job.status == QUEUED and job.error == "boom"
+    assert q.claim() is None  # backoff delay
+
+    q2 = JobQueue(q.db_path, max_attempts=2)  # same durable queue after a "restart"
+    conn = q2._connect()
+    conn.execute("UPDATE jobs SET visible_at = 0 WHERE id = ?", (job_id,))
+    conn.close()
+    assert q2.claim().attempts == 2
+    q2.fail(job_id, "boom again")
+    assert q2.get(job_id).status == FAILED
@@ -0,0 +1,99 @@
+import io
+import random
+
+import cv2
+import numpy as np
+from fastapi.testclient import TestClient
+from app.main import app
+from app.tests.conftest import drain_jobs
+from ai.near_duplicate import BKTree, NearDuplicateIndex, hamming, image_hashes
+
+client = TestClient(app)
+
+
+def _fundus(seed: int) -> np.ndarray:
+    """Synthetic fundus: orange disc on black with random dark vessels and a bright optic disc."""
+    rng = np.random.default_rng(seed)
+    img = np.zeros((600, 640, 3), np.uint8)
+    cv2.circle(img, (320, 300), 280, (40, 80, 170), -1)
+    for _ in range(25):
+        p1, p2 = (tuple(int(v) for v in rng.integers(80, 560, 2)) for _ in range(2))
+        cv2.line(img, p1, p2, (20, 30, 90), int(rng.integers(2, 7)))
+    cv2.circle(img, (int(rng.integers(200, 440)), 300), 40, (120, 200, 240), -1)
+    return img
+
+
+def _png(img) -> bytes:
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def test_hashes_survive_recompression_resize_and_screenshots():
+    img = _fundus(1)
+    index = NearDuplicateIndex()
+    base = image_hashes(_png(img))
+    variants = {
+        "jpeg": cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, 40])[1].tobytes(),
+        "half": _png(cv2.resize(img, (320, 300), interpolation=cv2.INTER_AREA)),
+        "screenshot": _png(cv2.copyMakeBorder(cv2.resize(img, (832, 780)), 40, 60, 30, 30,
+                                              cv2.BORDER_CONSTANT, value=(240, 240, 240))),
+    }
+    for name, data in variants.items():
+        ph, dh = image_hashes(data)
+        assert hamming(base[0], ph) <= index.max_distance, name
+        assert hamming(base[1], dh) <= index.dhash_max_distance, name
+    for other in (_png(img[:, ::-1]), _png(_fundus(2))):
+        assert hamming(base[0], image_hashes(other)[0]) > index.max_distance
+    # flat images carry no structure to compare
+    assert image_hashes(_png(np.full((50, 50, 3), 128, np.uint8))) is None
+
+
+def test_bktree_matches_brute_force():
+    rng = random.Random(0)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    # a few clusters of near-identical hashes
+    hashes += [h ^ (1 << rng.randrange(64)) for h in hashes[:50]]
+    tree = BKTree()
+    for i, h in enumerate(hashes):
+        tree.add(h, i)
+    for q in hashes[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        expected = sorted((hamming(q, h), i) for i, h in enumerate(hashes) if hamming(q, h) <= 10)
+        assert sorted(tree.search(q, 10)) == expected
+
+
+def test_index_is_scoped_and_bounded():
+    index = NearDuplicateIndex(max_entries_per_scope=3)
+    h = (0x0F0F0F0F0F0F0F0F, 0x1234)
+    index.add("alice", h, "sha-a")
+    assert index.find("alice", (h[0] ^ 0b111, h[1])).value == "sha-a"
+    assert index.find("bob", h) is None
+    for i in range(3):
+        index.add("alice", (h[0] ^ (0xFFFF << (16 * i + 8)), h[1]), f"other-{i}")
+    # oldest entry evicted
+    assert index.find("alice", h) is None
+    assert index.stats()["entries"] == 3
+
+
+def test_near_duplicate_upload_reuses_result_for_same_user():
+    def login(email):
+        client.post("/auth/register", json={"email": email, "password": "pass"})
+        r = client.post("/auth/login", data={"username": email, "password": "pass"})
+        return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    def upload(headers, name, data, media_type):
+        r = client.post("/upload", headers=headers, files={"file": (name, io.BytesIO(data), media_type)})
+        assert r.status_code == 202
+        drain_jobs()
+        return client.get(f"/jobs/{r.json()['job_id']}", headers=headers).json()["record"]
+
+    img = _fundus(3)
+    recompressed = cv2.imencode(".jpg", cv2.resize(img, (480, 450)), [cv2.IMWRITE_JPEG_QUALITY, 70])[1].tobytes()
+    alice, bob = login("near-alice@example.com"), login("near-bob@example.com")
+
+    first = upload(alice, "eye.png", _png(img), "image/png")
+    assert first["near_duplicate"] is None and first["cache_hit"] is False
+    again = upload(alice, "eye.jpg", recompressed, "image/jpeg")
+    assert again["near_duplicate"]["reused"] is True
+    assert again["cache_hit"] is True and again["risk_score"] == first["risk_score"]
+    # another user's upload of the same photo is never matched against alice's
+    other = upload(bob, "eye.jpg", recompressed, "image/jpeg")
+    assert other["near_duplicate"] is None and other["cache_hit"] is False
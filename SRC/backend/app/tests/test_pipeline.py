@@ -0,0 +1,106 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+import app.services.analysis  # noqa: F401  (puts SRC on sys.path for the `ai` package)
+from ai.pipeline import Pipeline, Stage, StageCache
+
+
+def _counting_pipeline(cache):
+    calls = []
+
+    def stage(name, fn):
+        def wrapped(*args, **kwargs):
+            calls.append(name)
+            return fn(*args, **kwargs)
+        return wrapped
+
+    pipeline = Pipeline([
+        Stage("segment", stage("segment", lambda img, threshold=0.5: img > threshold), ("image",), params=("threshold",)),
+        Stage("metrics", stage("metrics", lambda mask: int(mask.sum())), ("segment",)),
+        Stage("render", stage("render", lambda img, mask, alpha=1.0: img + alpha * mask), ("image", "segment"),
+              params=("alpha",)),
+    ], cache=cache)
+    return pipeline, calls
+
+
+def test_param_change_reuses_upstream_stages():
+    pipeline, calls = _counting_pipeline(StageCache())
+    img = np.linspace(0, 1, 100).reshape(10, 10)
+
+    first = pipeline.run({"image": img}, {"alpha": 1.0})
+    assert sorted(calls) == ["metrics", "render", "segment"]
+    assert set(first.timings) == {"segment", "metrics", "render"} and first.cached == ()
+
+    calls.clear()
+    second = pipeline.run({"image": img}, {"alpha": 0.5})
+    assert calls == ["render"]
+    assert set(second.cached) == {"segment", "metrics"}
+    assert second["metrics"] == first["metrics"]
+    assert second.to_dict()["stages"]["segment"] == {"ms": 0.0, "cached": True}
+
+    # a changed upstream parameter invalidates everything downstream of it
+    calls.clear()
+    pipeline.run({"image": img}, {"alpha": 0.5, "threshold": 0.9})
+    assert sorted(calls) == ["metrics", "render", "segment"]
+
+    # other content, other keys; cached arrays are read-only
+    calls.clear()
+    pipeline.run({"image": img[::-1].copy()}, {"alpha": 0.5})
+    assert sorted(calls) == ["metrics", "render", "segment"]
+    assert not pipeline.run({"image": img}, outputs=["segment"])["segment"].flags.writeable
+
+    # only what the requested outputs need runs
+    pipeline_nc, calls = _counting_pipeline(None)
+    pipeline_nc.run({"image": img}, outputs=["metrics"])
+    assert calls == ["segment", "metrics"]
+
+
+def test_independent_stages_run_in_parallel():
+    barrier = threading.Barrier(2, timeout=5)
+
+    def meet(x):
+        barrier.wait()  # deadlocks (BrokenBarrierError) unless both stages run at once
+        return x
+
+    pipeline = Pipeline([
+        Stage("a", meet, ("image",)),
+        Stage("b", meet, ("image",)),
+        Stage("sum", lambda a, b: a + b, ("a", "b")),
+    ])
+    assert pipeline.run({"image": 2})["sum"] == 4
+
+
+def test_arun_awaits_coroutine_stages():
+    async def slow_double(x):
+        await asyncio.sleep(0.01)
+        return 2 * x
+
+    cache = StageCache()
+    pipeline = Pipeline([
+        Stage("double", slow_double, ("image",)),
+        Stage("plus", lambda x, k=1: x + k, ("double",), params=("k",)),
+    ], cache=cache)
+    run = asyncio.run(pipeline.arun({"image": 3}, {"k": 1}, source_keys={"image": "three"}))
+    assert run["plus"] == 7
+    assert run.timings["double"] >= 10
+
+    run = asyncio.run(pipeline.arun({"image": 3}, {"k": 5}, source_keys={"image": "three"}))
+    assert run.cached == ("double",) and set(run.timings) == {"plus"}
+    assert run["plus"] == 11
+
+def test_graph_validation_and_cache_bound():
+    with pytest.raises(ValueError, match="Cycle"):
+        Pipeline([Stage("a", abs, ("b",)), Stage("b", abs, ("a",))])
+    with pytest.raises(ValueError, match="unknown inputs"):
+        Pipeline([Stage("a", abs, ("missing",))])
+
+    cache = StageCache(max_bytes=2500)
+    for i in range(3):
+        cache.put(str(i), np.zeros(1000, np.uint8))
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 1 and stats["bytes"] == 2000
+    cache.put("none", None)
+    assert cache.get("none") is None
@@ -0,0 +1,54 @@
+import cv2
+import numpy as np
+import app.services.analysis  # noqa: F401  (puts SRC on sys.path for the `ai` package)
+from ai.prescreen import PASS, REJECT, SHORT_CIRCUIT, prescreen
+
+
+def _fundus(size=1200, seed=0):
+    """Synthetic fundus: dark background, orange disc with thin dark vessels."""
+    rng = np.random.default_rng(seed)
+    img = np.zeros((size, size, 3), np.uint8)
+    c = size // 2
+    cv2.circle(img, (c, c), int(size * 0.45), (40, 90, 170), -1)
+    for _ in range(40):
+        p1 = tuple(int(v) for v in rng.integers(size // 4, 3 * size // 4, 2))
+        p2 = tuple(int(v) for v in rng.integers(size // 4, 3 * size // 4, 2))
+        cv2.line(img, p1, p2, (20, 40, 90), max(2, size // 200))
+    return img
+
+
+def _png(img):
+    return cv2.imencode(".png", img)[1].tobytes()
+
+
+def test_fundus_passes_on_thumbnail():
+    result = prescreen(_png(_fundus()))
+    assert result.action == PASS and result.check is None
+    # decoded at reduced resolution, not full size
+    assert max(result.metrics["width"], result.metrics["height"]) <= 256
+    assert result.elapsed_ms > 0
+
+
+def test_each_check_fires():
+    img = _fundus()
+    cases = {
+        "decode": b"not an image",
+        "overexposed": _png(np.full_like(img, 255)),
+        "underexposed": _png((img // 10).astype(np.uint8)),
+        "blur": _png(cv2.GaussianBlur(img, (0, 0), 12)),
+    }
+    small_fov = np.zeros_like(img)
+    small_fov[500:700, 500:700] = img[500:700, 500:700]
+    cases["fov"] = _png(small_fov)
+    for check, data in cases.items():
+        result = prescreen(data)
+        assert result.action == REJECT, check
+        assert result.check == check
+
+
+def test_selfie_short_circuits():
+    img = np.full((600, 800, 3), 120, np.uint8)
+    img[150:450, 100:700] = 235  # large sclera-like white area
+    result = prescreen(_png(img))
+    assert result.action == SHORT_CIRCUIT and result.check == "selfie"
+    assert result.to_dict()["metrics"]["white_ratio"] > 0.15
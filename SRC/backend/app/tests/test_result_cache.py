@@ -0,0 +1,82 @@
+import io
+import os
+import time
+from fastapi.testclient import TestClient
+from app.main import app
+from app.tests.conftest import drain_jobs
+from ai.result_cache import ResultCache
+
+client = TestClient(app)
+
+
+def test_memory_lru_eviction():
+    cache = ResultCache(memory_max_entries=2)
+    cache.put("a", {"risk_score": 1.0}, {"annotated": b"A"})
+    cache.put("b", {"risk_score": 2.0}, {"annotated": b"B"})
+    assert cache.get("a") is not None  # a becomes most recently used
+    cache.put("c", {"risk_score": 3.0}, {"annotated": b"C"})
+
+    assert cache.get("b") is None
+    assert cache.get("a").images["annotated"] == b"A"
+    stats = cache.stats()
+    assert stats["memory_evictions"] == 1
+    assert stats["hits"] == 2 and stats["misses"] == 1
+
+
+def test_disk_tier_survives_new_instance(tmp_path):
+    key = ResultCache.make_key(b"image-bytes", "v1")
+    ResultCache(disk_dir=tmp_path).put(key, {"risk_score": 4.2}, {"annotated": b"\x89PNG"})
+
+    cache = ResultCache(disk_dir=tmp_path)
+    entry = cache.get(key)
+    assert entry.metrics == {"risk_score": 4.2}
+    assert entry.images == {"annotated": b"\x89PNG"}
+    assert cache.stats()["disk_hits"] == 1
+    # the version is part of the key
+    assert cache.get(ResultCache.make_key(b"image-bytes", "v2")) is None
+
+
+def test_age_and_size_eviction(tmp_path):
+    memory_only = ResultCache(max_age_seconds=60)
+    memory_only.put("old", {"x": 1}, {"annotated": b"x"})
+    memory_only._memory["old"].created_at -= 120
+    assert memory_only.get("old") is None
+    assert memory_only.stats()["expired"] == 1
+
+    cache = ResultCache(disk_dir=tmp_path, max_age_seconds=60, disk_max_bytes=3000)
+    cache.put("stale", {"x": 1}, {"annotated": b"x" * 10})
+    long_ago = time.time() - 120
+    meta = tmp_path / "st" / "stale.json"
+    os.utime(meta, (long_ago, long_ago))
+    for i in range(5):
+        cache.put(f"k{i}", {"i": i}, {"annotated": b"y" * 1000})
+        time.sleep(0.01)
+    cache.prune()
+    assert not meta.exists()
+    assert cache.stats()["disk_evictions"] >= 1
+    assert cache.stats()["disk_bytes"] <= 3000
+
+    fresh = ResultCache(disk_dir=tmp_path, max_age_seconds=60)
+    assert fresh.get("k4") is not None
+    assert fresh.get("k0") is None
+
+
+def test_repeated_upload_hits_cache():
+    client.post("/auth/register", json={"email": "cache@example.com", "password": "pass"})
+    r = client.post("/auth/login", data={"username": "cache@example.com", "password": "pass"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    from PIL import Image
+    img = Image.new("RGB", (48, 48), color=(10, 200, 30))
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    data = buf.getvalue()
+
+    records = []
+    for name in ("a.png", "b.png"):
+        r = client.post("/upload", headers=headers, files={"file": (name, io.BytesIO(data), "image/png")})
+        assert r.status_code == 202
+        drain_jobs()
+        records.append(client.get(f"/jobs/{r.json()['job_id']}", headers=headers).json()["record"])
+    assert records[1]["cache_hit"] is True
+    assert records[1]["risk_score"] == records[0]["risk_score"]
@@ -0,0 +1,92 @@
+"""Per-upload cost of the path-based engine flow vs the in-memory engine API.
+
+path:   upload saved -> cv2.imread -> analyze -> cv2.imwrite annotated -> read annotated back for the cache
+memory: upload bytes -> decode once -> analyze -> encode once -> write annotated (cache gets the same bytes)
+
+Both flows save the upload itself (it is the stored original image), so that write is left out.
+Run: python bench_engine.py [--sizes 1024,2048] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ai.engine import analyze_array, analyze_bytes, analyze_image, decode, encode  # noqa: E402
+
+
+def fundus(size: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    img = np.zeros((size * 3 // 4, size, 3), np.uint8)
+    c = (size // 2, size * 3 // 8)
+    cv2.circle(img, c, int(size * 0.36), (40, 90, 170), -1)
+    for _ in range(60):
+        p1 = tuple(int(v) for v in rng.integers(size // 4, 3 * size // 4, 2))
+        p2 = tuple(int(v) for v in rng.integers(size // 4, 3 * size // 4, 2))
+        cv2.line(img, p1, p2, (20, 40, 90), max(2, size // 300))
+    noise = rng.normal(0, 4, img.shape)
+    return np.clip(img + noise, 0, 255).astype(np.uint8)
+
+
+def path_flow(upload: str, out: str):
+    risk, annotated = analyze_image(upload, out)
+    return risk, Path(annotated).read_bytes()
+
+
+def memory_flow(data: bytes, out: str):
+    result = analyze_bytes(data)
+    annotated = encode(result.annotated, Path(out).suffix)
+    Path(out).write_bytes(annotated)
+    return result.risk_score, annotated
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Path-based vs in-memory engine per upload")
+    parser.add_argument("--sizes", default="1024,2048")
+    parser.add_argument("--ext", default=".jpg", help="Upload / annotated image format")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'size':>6} {'upload_KB':>9} {'path_ms':>8} {'memory_ms':>9} {'saved':>6} "
+          f"{'path_read_KB':>12} {'memory_read_KB':>14} {'written_KB':>10} "
+          f"{'decode_ms':>9} {'analyze_ms':>10} {'encode_ms':>9}  same_risk")
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in [int(s) for s in args.sizes.split(",") if s]:
+            data = encode(fundus(size), args.ext)
+            upload = os.path.join(tmp, "upload" + args.ext)
+            Path(upload).write_bytes(data)
+            out = os.path.join(tmp, "annotated" + args.ext)
+
+            t_path = best_of(lambda: path_flow(upload, out), args.repeat)
+            t_mem = best_of(lambda: memory_flow(data, out), args.repeat)
+            risk_path, annotated = path_flow(upload, out)
+            risk_mem, _ = memory_flow(data, out)
+            # disk bytes read per upload: path flow re-reads the upload and the annotated file
+            path_read = len(data) + len(annotated)
+            # where the in-memory flow spends its time
+            img = decode(data)
+            result = analyze_array(img)
+            t_dec = best_of(lambda: decode(data), args.repeat)
+            t_ana = best_of(lambda: analyze_array(img), args.repeat)
+            t_enc = best_of(lambda: encode(result.annotated, args.ext), args.repeat)
+            print(f"{size:>6} {len(data) / 1024:>9.0f} {t_path * 1000:>8.1f} {t_mem * 1000:>9.1f} "
+                  f"{1 - t_mem / t_path:>6.0%} {path_read / 1024:>12.0f} {0:>14} {len(annotated) / 1024:>10.0f} "
+                  f"{t_dec * 1000:>9.1f} {t_ana * 1000:>10.1f} {t_enc * 1000:>9.1f}  {risk_path == risk_mem}")
+
+
+if __name__ == "__main__":
+    main()
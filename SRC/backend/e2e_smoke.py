@@ -26,7 +26,19 @@ headers={'Authorization':f'Bearer {token_patient}'}
 r = client.post(base + '/upload', headers=headers, files=files)
 print('upload status', r.status_code)
 print('upload response', r.json())
-rec_id = r.json().get('id')
+job_url = r.json().get('status_url')
+
+# wait for the analysis job
+print('\nWaiting for analysis job...')
+for _ in range(60):
+    job = client.get(base + job_url, headers=headers).json()
+    if job.get('status') in ('done', 'failed'):
+        break
+    time.sleep(0.5)
+print('job', job)
+if job.get('status') != 'done':
+    sys.exit(1)
+rec_id = job['record']['id']
 
 # login as doctor
 print('\nLogging in as doctor...')
@@ -51,6 +51,19 @@ export default function PatientDashboard({ token }: PatientDashboardProps) {
     }
   }
 
+  async function waitForJob(statusUrl: string) {
+    for (;;) {
+      const response = await fetch(`http://localhost:8000${statusUrl}`, {
+        headers: { Authorization: `Bearer ${token}` },
+      });
+      if (!response.ok) throw new Error("Failed to check analysis status");
+      const job = await response.json();
+      if (job.status === "done") return job;
+      if (job.status === "failed") throw new Error(job.error || "Analysis failed");
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+    }
+  }
+
   async function handleUpload() {
     if (!file || !token) {
       setError("Please select an image file");
@@ -75,7 +88,9 @@ export default function PatientDashboard({ token }: PatientDashboardProps) {
         throw new Error(errorData.detail || "Upload failed");
       }
 
-      const result = await response.json();
+      // Analysis runs in the background; poll the job until it finishes
+      const { status_url } = await response.json();
+      const result = await waitForJob(status_url);
       
       // Refresh records list
       await fetchRecords();
@@ -84,7 +99,7 @@ export default function PatientDashboard({ token }: PatientDashboardProps) {
       setFile(null);
       
       // Show success message (you could add a toast notification here)
-      alert(`Analysis complete! Risk score: ${result.risk_score.toFixed(2)}`);
+      alert(`Analysis complete! Risk score: ${result.record.risk_score.toFixed(2)}`);
     } catch (err: any) {
       setError(err.message || "Failed to upload image");
     } finally {
@@ -1,18 +1,136 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import cv2
-import base64
+import asyncio
 import numpy as np
+import os
 import random # [THÊM] Để tạo chỉ số rủi ro tự nhiên hơn
+import sys
+from pathlib import Path
 
 # Import các module vệ tinh
-from preprocessing import preprocess_image
+from preprocessing import decode_image, preprocess_image, preprocess_full_resolution, IMG_SIZE
 from segmentation import segmentor
+from batching import MicroBatcher
+
+# Module dùng chung nằm trong SRC/ai (import dưới dạng package `ai`)
+SRC_DIR = Path(__file__).resolve().parents[3] / "SRC"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+from ai.result_cache import ResultCache
+from ai.prescreen import PrescreenConfig, prescreen, REJECT, SHORT_CIRCUIT
+from ai.image_response import (
+    EncoderConfig, ImageLinkStore, RESPONSE_MODES, MULTIPART, URL, data_uri, multipart_body,
+)
+from ai.ingest import IngestError, IngestLimits, ingest_upload
+from ai.near_duplicate import NearDuplicateIndex, image_hashes
+from ai.pipeline import Pipeline, Stage, StageCache
 
 app = FastAPI()
 
+# Gom các request đồng thời thành lô trước khi chạy segmentor
+batcher = MicroBatcher(
+    segmentor.predict_batch,
+    max_batch_size=int(os.getenv("SEG_MAX_BATCH", "8")),
+    max_wait_ms=float(os.getenv("SEG_MAX_WAIT_MS", "5")),
+)
+
+# Cache kết quả theo SHA-256 của ảnh + phiên bản pipeline/model
+PIPELINE_VERSION = f"clahe-{IMG_SIZE[0]}x{IMG_SIZE[1]}+{segmentor.version}"
+
+# Chế độ tiled: giữ độ phân giải gốc (giới hạn cạnh dài nhất)
+TILED_MAX_SIDE = int(os.getenv("SEG_TILED_MAX_SIDE", "4096"))
+TILED_PIPELINE_VERSION = f"tiled-{TILED_MAX_SIDE}+{segmentor.version}"
+result_cache = ResultCache(
+    disk_dir=os.getenv("RESULT_CACHE_DIR", str(Path(__file__).resolve().parent / "cache")),
+    memory_max_entries=int(os.getenv("RESULT_CACHE_MEMORY_ENTRIES", "128")),
+    disk_max_bytes=int(os.getenv("RESULT_CACHE_DISK_MB", "512")) * 1024 * 1024,
+    max_age_seconds=float(os.getenv("RESULT_CACHE_MAX_AGE_HOURS", "168")) * 3600,
+)
+
+# Kiểm tra nhanh trên thumbnail trước khi decode đầy đủ + CLAHE + segmentation
+PRESCREEN_CONFIG = PrescreenConfig(
+    selfie_white_ratio=float(os.getenv("PRESCREEN_SELFIE_WHITE_RATIO", "0.15")),
+    min_fov_fraction=float(os.getenv("PRESCREEN_MIN_FOV", "0.25")),
+    min_blur_variance=float(os.getenv("PRESCREEN_MIN_BLUR_VAR", "20")),
+)
+
+# Ảnh gần trùng (perceptual hash) với ảnh gần đây của cùng user_id: NEAR_DUP_MODE=reuse (trả kết quả cũ)
+# | flag (vẫn phân tích, chỉ báo trùng) | off
+NEAR_DUP_MODE = os.getenv("NEAR_DUP_MODE", "reuse")
+near_duplicates = NearDuplicateIndex.from_env()
+
+# Giới hạn upload: UPLOAD_MAX_MB, UPLOAD_MAX_MEGAPIXELS, UPLOAD_MAX_SIDE (chống decompression bomb)
+UPLOAD_LIMITS = IngestLimits.from_env()
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+
+# Định dạng ảnh trả về: IMAGE_FORMAT=jpeg|webp|png, IMAGE_QUALITY, IMAGE_PNG_COMPRESSION
+ENCODER = EncoderConfig.from_env(default_format="jpeg")
+
+# response=url: link tạm thời tới ảnh (GET /images/{token}), hết hạn sau IMAGE_LINK_TTL giây
+image_links = ImageLinkStore(
+    ttl_seconds=float(os.getenv("IMAGE_LINK_TTL", "300")),
+    max_bytes=int(os.getenv("IMAGE_LINK_MAX_MB", "64")) * 1024 * 1024,
+)
+
+# --- Pipeline dạng đồ thị stage (ai.pipeline) ---
+# Output của từng stage được cache theo SHA-256 ảnh + tham số của stage: đổi
+# IMAGE_FORMAT chỉ mã hoá lại, không chạy lại segmentation. Overlay / tính điểm /
+# mã hoá ảnh gốc chạy song song sau segmentation.
+
+def _preprocess(image, tiled=False, max_side=None):
+    # Đọc ảnh & Tiền xử lý (CLAHE + Resize, hoặc giữ độ phân giải gốc khi tiled)
+    if tiled:
+        return preprocess_full_resolution(image, max_side)
+    return preprocess_image(image)
+
+async def _segment(pre, tiled=False):
+    # Chạy Segmentation (Tách mạch máu): tiled chạy trong thread, còn lại gom lô qua batcher
+    if tiled:
+        return await asyncio.to_thread(segmentor.predict_tiled, pre[1])
+    return await batcher.submit(pre[1])
+
+def _overlay(pre, mask_img):
+    # Tạo ảnh kết quả đè lên ảnh gốc (Overlay)
+    original_resized = pre[0]
+    green_mask = np.zeros_like(original_resized)
+    green_mask[:, :, 1] = mask_img # Kênh G (Green)
+
+    # Trộn ảnh gốc và mask
+    return cv2.addWeighted(original_resized, 0.7, green_mask, 0.3, 0)
+
+def _score(pre, mask_img):
+    # Tính điểm rủi ro (Công thức giả định)
+    processed_img = pre[1]
+    total_pixels = processed_img.shape[0] * processed_img.shape[1]
+    vessel_density = np.sum(mask_img > 0) / total_pixels
+
+    # Tính điểm cơ bản
+    base_score = min(round(vessel_density * 400, 2), 95.0)
+
+    # Thêm chút ngẫu nhiên để demo trông "thật" hơn (dao động +/- 2%)
+    risk_score = base_score + random.uniform(-2.0, 2.0)
+
+    # Kẹp điểm số trong khoảng 0 - 99.9
+    return max(0, min(risk_score, 99.9))
+
+def _encode(image, encoder):
+    return encoder.encode(image)
+
+def _encode_original(pre, encoder):
+    return encoder.encode(pre[0])
+
+PIPELINE = Pipeline([
+    Stage("preprocess", _preprocess, ("image",), params=("tiled", "max_side")),
+    Stage("segment", _segment, ("preprocess",), params=("tiled",), version=segmentor.version),
+    Stage("overlay", _overlay, ("preprocess", "segment")),
+    Stage("score", _score, ("preprocess", "segment"), cache=False),  # có phần ngẫu nhiên
+    Stage("encode_original", _encode_original, ("preprocess",), params=("encoder",)),
+    Stage("encode_processed", _encode, ("overlay",), params=("encoder",)),
+], sources=("image",), cache=StageCache.from_env(), name="ai_core")
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -20,77 +138,142 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-def image_to_base64(img_np):
-    _, buffer = cv2.imencode('.jpg', img_np)
-    return f"data:image/jpeg;base64,{base64.b64encode(buffer).decode('utf-8')}"
+def build_response(filename, cached, mode="json", timings=None, near_duplicate=None):
+    """json: ảnh base64 data URI (như cũ); multipart: ảnh là các part nhị phân; url: link tạm thời.
+    timings: PipelineRun.to_dict() của lần chạy này (None khi lấy từ cache).
+    near_duplicate: khoảng cách tới ảnh gần trùng trước đó của cùng user (None nếu không có)."""
+    body = {
+        "filename": filename,
+        "risk_score": cached.metrics["risk_score"],
+        "message": cached.metrics["message"],
+        "prescreen": cached.metrics.get("prescreen"),
+        "timings": timings,
+        "near_duplicate": near_duplicate,
+    }
+    images = {name: (cached.images[name], ENCODER.media_type) for name in ("original", "processed")}
+    if mode == MULTIPART:
+        content, content_type = multipart_body(body, images)
+        return Response(content=content, media_type=content_type)
+    if mode == URL:
+        for name, (data, media_type) in images.items():
+            body[f"{name}_image"] = f"/images/{image_links.put(data, media_type)}"
+        body["expires_in"] = image_links.ttl_seconds
+        return JSONResponse(content=body)
+    for name, (data, media_type) in images.items():
+        body[f"{name}_image"] = data_uri(data, media_type)
+    return JSONResponse(content=body)
+
+@app.get("/images/{token}")
+def get_image(token: str):
+    item = image_links.get(token)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Image link expired or unknown")
+    data, media_type = item
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": "private, max-age=60"})
+
+@app.get("/cache/stats")
+def cache_stats():
+    stats = result_cache.stats()
+    stats["near_duplicates"] = near_duplicates.stats()
+    stats["stages"] = PIPELINE.cache.stats() if PIPELINE.cache is not None else None
+    return stats
+
+@app.get("/stats/batching")
+def batching_stats():
+    return batcher.stats()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
 
 @app.post("/analyze")
-async def analyze_retina(file: UploadFile = File(...)):
+async def analyze_retina(file: UploadFile = File(...), tiled: bool = False,
+                         response: str = Query("json", description="json | multipart | url"),
+                         user_id: str | None = Query(None)):
+    """tiled=true: phân tích ở độ phân giải gốc bằng segmentor.predict_tiled thay vì resize về 512x512.
+    response: cách trả ảnh (xem build_response).
+    user_id: ảnh gần trùng (nén lại, resize, screenshot) với ảnh gần đây của cùng user dùng lại kết quả cũ."""
     if file.content_type not in ["image/jpeg", "image/png"]:
         raise HTTPException(status_code=400, detail="Invalid image format")
+    if response not in RESPONSE_MODES:
+        raise HTTPException(status_code=400, detail=f"response must be one of {', '.join(RESPONSE_MODES)}")
     
+    # Stream upload xuống file tạm: hash SHA-256 + đọc header ảnh trong lúc nhận,
+    # vượt giới hạn dung lượng / số pixel thì dừng ngay (413)
+    try:
+        spool = await ingest_upload(file, UPLOAD_LIMITS, allowed=("png", "jpeg"), spool_dir=UPLOAD_SPOOL_DIR)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
     try:
-        # 1. Đọc ảnh & Tiền xử lý (CLAHE + Resize)
-        image_bytes = await file.read()
-        original_resized, processed_img = preprocess_image(image_bytes)
-        
-        # --- [BẮT ĐẦU ĐOẠN CODE MỚI: BỘ LỌC ẢNH MẮT THƯỜNG] ---
-        # Chuyển ảnh sang đen trắng để kiểm tra độ sáng
-        gray_check = cv2.cvtColor(original_resized, cv2.COLOR_BGR2GRAY)
-        
-        # Đếm số lượng điểm ảnh quá sáng (màu trắng > 200 trên thang 255)
-        # Mắt thường (selfie) có lòng trắng rất lớn => nhiều điểm sáng.
-        # Đáy mắt chuẩn (Retina) thường tối, màu đỏ cam => ít điểm sáng.
-        white_pixels = np.sum(gray_check > 200)
-        total_pixels = gray_check.shape[0] * gray_check.shape[1]
-        white_ratio = white_pixels / total_pixels
-
-        # Ngưỡng chặn: Nếu hơn 15% ảnh là màu trắng tinh -> Kết luận là mắt thường
-        if white_ratio > 0.15:
+        # mmap của file tạm: decoder đọc trực tiếp, không copy thành bytes
+        image_bytes = spool.buffer()
+
+        # 0. Ảnh đã phân tích trước đó (cùng nội dung + cùng phiên bản) -> trả kết quả cache
+        # ảnh trong cache đã mã hoá theo ENCODER, nên định dạng ảnh là một phần của key
+        version = TILED_PIPELINE_VERSION if tiled else PIPELINE_VERSION
+        cache_key = ResultCache.key_for_digest(spool.sha256, f"{version}+{ENCODER.tag}")
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return build_response(file.filename, cached, response)
+
+        # 0b. Ảnh gần trùng với ảnh gần đây của cùng user (khác SHA-256 nhưng cùng một ảnh mắt)
+        near, hashes, scope = None, None, f"{user_id}:{version}"
+        if user_id and NEAR_DUP_MODE != "off":
+            hashes = await asyncio.to_thread(image_hashes, image_bytes)
+            match = near_duplicates.find(scope, hashes) if hashes is not None else None
+            if match is not None:
+                near = {**match.to_dict(), "reused": False}
+                cached = result_cache.get(match.value) if NEAR_DUP_MODE == "reuse" else None
+                if cached is not None:
+                    near["reused"] = True
+                    return build_response(file.filename, cached, response, near_duplicate=near)
+
+        # 1. Pre-screen trên thumbnail: loại ảnh hỏng / mờ / sai phơi sáng trước khi xử lý nặng
+        screen = prescreen(image_bytes, PRESCREEN_CONFIG)
+        if screen.action == REJECT:
+            return JSONResponse(content={"error": screen.reason, "prescreen": screen.to_dict()}, status_code=422)
+
+        if screen.action == SHORT_CIRCUIT:
+            # Ảnh mắt thường (selfie): không cần CLAHE / segmentation, giữ nguyên ảnh gốc
+            original_resized = cv2.resize(decode_image(image_bytes), IMG_SIZE)
             risk_score = 0.0 # An toàn tuyệt đối
             processed_display = original_resized # Giữ nguyên ảnh gốc, không tô vẽ gì cả
             message = "Phát hiện ảnh mắt thường (Selfie). Không có nguy cơ bệnh lý võng mạc."
-        
+
+            images = {"original": ENCODER.encode(original_resized), "processed": ENCODER.encode(processed_display)}
+            timings = None
+
         else:
-            # --- [LOGIC CŨ: CHỈ CHẠY KHI LÀ ẢNH ĐÁY MẮT] ---
-            
-            # 2. Chạy Segmentation (Tách mạch máu)
-            mask_img = segmentor.predict(processed_img)
-            
-            # 3. Tạo ảnh kết quả đè lên ảnh gốc (Overlay)
-            green_mask = np.zeros_like(original_resized)
-            green_mask[:, :, 1] = mask_img # Kênh G (Green)
-            
-            # Trộn ảnh gốc và mask
-            processed_display = cv2.addWeighted(original_resized, 0.7, green_mask, 0.3, 0)
-
-            # 4. Tính điểm rủi ro (Công thức giả định)
-            vessel_density = np.sum(mask_img > 0) / total_pixels
-            
-            # Tính điểm cơ bản
-            base_score = min(round(vessel_density * 400, 2), 95.0)
-            
-            # Thêm chút ngẫu nhiên để demo trông "thật" hơn (dao động +/- 2%)
-            risk_score = base_score + random.uniform(-2.0, 2.0)
-            
-            # Kẹp điểm số trong khoảng 0 - 99.9
-            risk_score = max(0, min(risk_score, 99.9))
-            
+            # 2-5. Tiền xử lý -> Segmentation -> Overlay + điểm rủi ro -> mã hoá (PIPELINE)
+            run = await PIPELINE.arun(
+                {"image": image_bytes},
+                {"tiled": tiled, "max_side": TILED_MAX_SIDE if tiled else None, "encoder": ENCODER},
+                outputs=("score", "encode_original", "encode_processed"),
+                source_keys={"image": spool.sha256},
+            )
+            risk_score = run["score"]
+            images = {"original": run["encode_original"], "processed": run["encode_processed"]}
+            timings = run.to_dict()
             message = "Phân tích võng mạc hoàn tất."
 
         # --- [KẾT THÚC XỬ LÝ] ---
 
-        return JSONResponse(content={
-            "filename": file.filename,
-            "risk_score": round(risk_score, 1),
-            "original_image": image_to_base64(original_resized),
-            "processed_image": image_to_base64(processed_display),
-            "message": message
-        })
+        cached = result_cache.put(
+            cache_key,
+            {"risk_score": round(risk_score, 1), "message": message, "prescreen": screen.to_dict()},
+            images,
+        )
+        if hashes is not None:
+            near_duplicates.add(scope, hashes, cache_key)
+        # thời gian từng stage chỉ có ở lần phân tích đầu (không lưu vào cache kết quả)
+        return build_response(file.filename, cached, response, timings, near)
 
     except Exception as e:
         print(f"Lỗi Server: {e}")
         return JSONResponse(content={"error": str(e)}, status_code=500)
+    finally:
+        spool.close()
 
 if __name__ == "__main__":
     uvicorn.run(app, host="127.0.0.1", port=8000)
\ No newline at end of file
@@ -0,0 +1,136 @@
+"""
+Micro-batching cho segmentor: gom các request /analyze đồng thời thành một lô.
+
+Mỗi request gửi ảnh vào hàng đợi và chờ kết quả. Vòng lặp nền lấy tối đa
+max_batch_size ảnh (hoặc chờ tối đa max_wait_ms kể từ ảnh đầu tiên), chạy một
+lần forward trong thread riêng (không chặn event loop) rồi trả mask về cho
+từng request.
+"""
+import asyncio
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Sequence
+
+import numpy as np
+
+
+class Histogram:
+    """Histogram đơn giản với các cận trên cố định (bucket cuối là +inf)."""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.bounds, value)] += 1
+            self.total += 1
+            self.sum += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            labels = [f"<={b:g}" for b in self.bounds] + [f">{self.bounds[-1]:g}"]
+            return {
+                "buckets": dict(zip(labels, self.counts)),
+                "count": self.total,
+                "mean": self.sum / self.total if self.total else 0.0,
+            }
+
+
+class MicroBatcher:
+    def __init__(self, predict_batch: Callable[[List[np.ndarray]], np.ndarray],
+                 max_batch_size: int = 8, max_wait_ms: float = 5.0):
+        self.predict_batch = predict_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue_depth = Histogram([0, 1, 2, 4, 8, 16, 32, 64])
+        self.batch_size = Histogram([1, 2, 4, 8, 16, 32])
+        self.batches = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        # một forward tại một thời điểm; model tự song song hoá bằng intra-op threads
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="seg-batch")
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        # tạo lại vòng lặp nền nếu chưa chạy hoặc event loop đã đổi
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def submit(self, image: np.ndarray) -> np.ndarray:
+        self.start()
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((image, fut))
+        return await fut
+
+    def stats(self) -> Dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "batches": self.batches,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "queue_depth": self.queue_depth.snapshot(),
+            "batch_size": self.batch_size.snapshot(),
+        }
+
+    async def _collect(self) -> list:
+        loop = asyncio.get_running_loop()
+        first = await self._queue.get()
+        self.queue_depth.observe(self._queue.qsize() + 1)
+        batch = [first]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            # chỉ ghép được các ảnh cùng kích thước vào một tensor
+            groups: Dict[tuple, list] = {}
+            for item in batch:
+                groups.setdefault(item[0].shape, []).append(item)
+            for items in groups.values():
+                items = [(img, fut) for img, fut in items if not fut.cancelled()]
+                if not items:
+                    continue
+                self.batches += 1
+                self.batch_size.observe(len(items))
+                try:
+                    masks = await loop.run_in_executor(self._executor, self.predict_batch, [img for img, _ in items])
+                except Exception as e:
+                    for _, fut in items:
+                        if not fut.done():
+                            fut.set_exception(e)
+                    continue
+                for (_, fut), mask in zip(items, masks):
+                    if not fut.done():
+                        fut.set_result(mask)
@@ -0,0 +1,148 @@
+"""
+Benchmark VesselSegmentation trên CPU với một U-Net nhỏ khởi tạo ngẫu nhiên.
+
+Model được export ra ONNX ngay lúc chạy (không cần torch), sau đó đo độ trễ
+predict() cho một vài cấu hình số luồng intra/inter-op.
+
+    python bench_segmentation.py --size 512 --runs 20
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from segmentation import VesselSegmentation
+from batching import MicroBatcher
+
+
+def build_random_unet_onnx(path: str, base_channels: int = 8, seed: int = 0) -> str:
+    """Export một U-Net 2 tầng (conv-relu x2, maxpool, nearest upsample, skip concat) ra ONNX.
+
+    Input 'image' float32 (N, 1, H, W) với H, W chia hết cho 4; output 'logits' (N, 1, H, W).
+    """
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+
+    rng = np.random.default_rng(seed)
+    nodes, inits = [], []
+
+    def conv(x, cin, cout, name, k=3, relu=True):
+        w = (rng.standard_normal((cout, cin, k, k)) * np.sqrt(2.0 / (cin * k * k))).astype(np.float32)
+        b = np.zeros(cout, dtype=np.float32)
+        inits.append(numpy_helper.from_array(w, f"{name}_w"))
+        inits.append(numpy_helper.from_array(b, f"{name}_b"))
+        out = f"{name}_conv"
+        nodes.append(helper.make_node("Conv", [x, f"{name}_w", f"{name}_b"], [out], pads=[k // 2] * 4))
+        if relu:
+            nodes.append(helper.make_node("Relu", [out], [f"{name}_relu"]))
+            return f"{name}_relu"
+        return out
+
+    def block(x, cin, cout, name):
+        return conv(conv(x, cin, cout, f"{name}a"), cout, cout, f"{name}b")
+
+    def pool(x, name):
+        nodes.append(helper.make_node("MaxPool", [x], [name], kernel_shape=[2, 2], strides=[2, 2]))
+        return name
+
+    def up(x, name):
+        nodes.append(helper.make_node("Resize", [x, "", "up_scales"], [name], mode="nearest"))
+        return name
+
+    def concat(a, b, name):
+        nodes.append(helper.make_node("Concat", [a, b], [name], axis=1))
+        return name
+
+    inits.append(numpy_helper.from_array(np.array([1, 1, 2, 2], dtype=np.float32), "up_scales"))
+    c = base_channels
+    e1 = block("image", 1, c, "enc1")
+    e2 = block(pool(e1, "p1"), c, 2 * c, "enc2")
+    mid = block(pool(e2, "p2"), 2 * c, 4 * c, "mid")
+    d2 = block(concat(conv(up(mid, "u2"), 4 * c, 2 * c, "up2"), e2, "cat2"), 4 * c, 2 * c, "dec2")
+    d1 = block(concat(conv(up(d2, "u1"), 2 * c, c, "up1"), e1, "cat1"), 2 * c, c, "dec1")
+    logits = conv(d1, c, 1, "head", k=1, relu=False)
+    nodes.append(helper.make_node("Identity", [logits], ["logits"]))
+
+    graph = helper.make_graph(
+        nodes, "unet_vessel",
+        [helper.make_tensor_value_info("image", TensorProto.FLOAT, ["N", 1, "H", "W"])],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["N", 1, "H", "W"])],
+        initializer=inits,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 17)], ir_version=8)
+    onnx.checker.check_model(model)
+    onnx.save(model, path)
+    return path
+
+
+def sample_image(size: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (size, size), dtype=np.uint8)
+
+
+def bench(seg: VesselSegmentation, img: np.ndarray, runs: int) -> list[float]:
+    seg.predict(img)  # warm-up
+    times = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        seg.predict(img)
+        times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+
+def bench_concurrent(seg: VesselSegmentation, img: np.ndarray, requests: int, max_batch: int, max_wait_ms: float):
+    """Thông lượng khi `requests` request đồng thời đi qua MicroBatcher."""
+    async def run():
+        batcher = MicroBatcher(seg.predict_batch, max_batch_size=max_batch, max_wait_ms=max_wait_ms)
+        await batcher.submit(img)  # warm-up
+        t0 = time.perf_counter()
+        await asyncio.gather(*(batcher.submit(img) for _ in range(requests)))
+        elapsed = time.perf_counter() - t0
+        stats = batcher.stats()
+        await batcher.stop()
+        return elapsed, stats
+
+    return asyncio.run(run())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VesselSegmentation CPU inference")
+    parser.add_argument("--size", type=int, default=512)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=8, help="Số kênh tầng đầu của U-Net")
+    parser.add_argument("--threads", default=f"1,{os.cpu_count() or 1}", help="Danh sách intra-op threads")
+    parser.add_argument("--model", help="Dùng file model có sẵn thay vì U-Net ngẫu nhiên")
+    parser.add_argument("--concurrent", type=int, default=16, help="Số request đồng thời cho phép đo micro-batching")
+    parser.add_argument("--max-batch", default="1,4,8", help="Danh sách max_batch_size cần so sánh")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    img = sample_image(args.size)
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model or build_random_unet_onnx(os.path.join(tmp, "unet_random.onnx"), args.channels)
+        print(f"model: {model_path} ({os.path.getsize(model_path) / 1024:.1f} KB), image {args.size}x{args.size}")
+
+        fallback = VesselSegmentation(model_path="", backend="threshold")
+        t = bench(fallback, img, args.runs)
+        print(f"{'threshold (dummy)':<24} p50={np.percentile(t, 50):7.1f} ms  p95={np.percentile(t, 95):7.1f} ms")
+
+        for n in [int(x) for x in args.threads.split(",") if x]:
+            seg = VesselSegmentation(model_path=model_path, backend="auto", intra_op_threads=n, inter_op_threads=1)
+            mask = seg.predict(img)
+            assert mask.shape == img.shape and mask.dtype == np.uint8
+            t = bench(seg, img, args.runs)
+            print(f"{seg.model.name + f' intra={n}':<24} p50={np.percentile(t, 50):7.1f} ms  p95={np.percentile(t, 95):7.1f} ms"
+                  f"  vessel%={100 * np.count_nonzero(mask) / mask.size:.1f}")
+
+        print(f"\nmicro-batching: {args.concurrent} request đồng thời")
+        for max_batch in [int(x) for x in args.max_batch.split(",") if x]:
+            elapsed, stats = bench_concurrent(seg, img, args.concurrent, max_batch, args.max_wait_ms)
+            print(f"max_batch={max_batch:<3} total={elapsed * 1000:7.1f} ms  {args.concurrent / elapsed:6.1f} img/s"
+                  f"  batches={stats['batches'] - 1}  mean_batch={stats['batch_size']['mean']:.1f}")
+
+
+if __name__ == "__main__":
+    main()
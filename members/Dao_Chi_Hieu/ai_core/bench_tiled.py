@@ -0,0 +1,79 @@
+"""
+So sánh suy luận toàn ảnh (một forward) với chế độ tiled trên ảnh độ phân giải cao.
+
+Mỗi cấu hình chạy trong một tiến trình con riêng để đo peak RSS chính xác
+(ru_maxrss chỉ tăng, không giảm). Dùng U-Net ngẫu nhiên export ra ONNX lúc chạy.
+
+    python bench_tiled.py --sizes 1024,2048,4096
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+
+
+def _peak_rss_mb() -> float:
+    # Linux: KB, macOS: bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if os.uname().sysname == "Darwin" else rss / 1024
+
+
+def _run(model_path: str, size: int, mode: str, tile: int, overlap: int, batch: int, queue):
+    from segmentation import VesselSegmentation
+
+    seg = VesselSegmentation(model_path=model_path)
+    img = np.random.default_rng(0).integers(0, 256, (size, size), dtype=np.uint8)
+    seg.predict_tiled(np.zeros((tile, tile), np.uint8), tile, overlap, batch)  # warm-up nhỏ
+    base_rss = _peak_rss_mb()
+    t0 = time.perf_counter()
+    if mode == "full":
+        mask = seg.predict(img)
+    else:
+        mask = seg.predict_tiled(img, tile, overlap, batch)
+    elapsed = time.perf_counter() - t0
+    queue.put((elapsed * 1000, base_rss, _peak_rss_mb(), mask.shape))
+
+
+def measure(model_path: str, size: int, mode: str, tile: int, overlap: int, batch: int):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=_run, args=(model_path, size, mode, tile, overlap, batch, queue))
+    p.start()
+    p.join()
+    if p.exitcode != 0:
+        return None
+    return queue.get()
+
+
+def main():
+    from bench_segmentation import build_random_unet_onnx
+
+    parser = argparse.ArgumentParser(description="Latency + peak RSS: full-frame vs tiled segmentation")
+    parser.add_argument("--sizes", default="1024,2048,4096")
+    parser.add_argument("--tile", type=int, default=512)
+    parser.add_argument("--overlap", type=int, default=64)
+    parser.add_argument("--batch", type=int, default=4)
+    parser.add_argument("--model", help="Dùng file model có sẵn thay vì U-Net ngẫu nhiên")
+    parser.add_argument("--skip-full", action="store_true", help="Bỏ qua suy luận toàn ảnh (có thể hết RAM)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        model_path = args.model or build_random_unet_onnx(os.path.join(tmp, "unet_random.onnx"))
+        print(f"{'size':>6} {'mode':<6} {'latency_ms':>11} {'peak_rss_mb':>12} {'rss_growth_mb':>14}")
+        for size in [int(s) for s in args.sizes.split(",") if s]:
+            modes = ["tiled"] if args.skip_full else ["full", "tiled"]
+            for mode in modes:
+                res = measure(model_path, size, mode, args.tile, args.overlap, args.batch)
+                if res is None:
+                    print(f"{size:>6} {mode:<6} {'failed (OOM?)':>11}")
+                    continue
+                ms, base, peak, _ = res
+                print(f"{size:>6} {mode:<6} {ms:>11.0f} {peak:>12.0f} {peak - base:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+So sánh model fp32 và int8 trên cùng một tập ảnh: Dice của mask int8 so với mask fp32,
+độ trễ từng ảnh và kích thước file model. Dùng để quyết định khi nào bật SEG_PRECISION=int8.
+
+    python compare_quantization.py --fp32 model/unet_vessel.onnx --images samples/
+    python compare_quantization.py --demo   # U-Net ngẫu nhiên + ảnh tổng hợp, tự lượng tử hoá
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from preprocessing import preprocess_image
+from quantization import iter_images, quantize_model
+from segmentation import VesselSegmentation, default_int8_path
+
+
+def dice(a: np.ndarray, b: np.ndarray) -> float:
+    a, b = a > 0, b > 0
+    total = int(a.sum()) + int(b.sum())
+    # hai mask cùng rỗng coi như trùng khớp hoàn toàn
+    return 1.0 if total == 0 else 2.0 * int(np.logical_and(a, b).sum()) / total
+
+
+def timed_predict(seg: VesselSegmentation, img: np.ndarray):
+    t0 = time.perf_counter()
+    mask = seg.predict(img)
+    return mask, (time.perf_counter() - t0) * 1000
+
+
+def compare(fp32_path: str, int8_path: str, images):
+    """images: danh sách (tên, ảnh xám đã CLAHE). Trả về danh sách kết quả từng ảnh."""
+    fp32 = VesselSegmentation(model_path=fp32_path, backend="onnx", precision="fp32")
+    int8 = VesselSegmentation(model_path=fp32_path, backend="onnx", precision="int8", int8_model_path=int8_path)
+    if int8.precision != "int8":
+        raise SystemExit(f"Không load được model int8: {int8_path}")
+    # warm-up để không tính chi phí cấp phát lần đầu
+    fp32.predict(images[0][1])
+    int8.predict(images[0][1])
+
+    rows = []
+    for name, img in images:
+        ref, fp32_ms = timed_predict(fp32, img)
+        mask, int8_ms = timed_predict(int8, img)
+        rows.append({"image": name, "dice": dice(mask, ref), "fp32_ms": fp32_ms, "int8_ms": int8_ms})
+    return rows
+
+
+def load_images(folder: str, max_images: int):
+    images = []
+    for path in iter_images(folder, max_images):
+        try:
+            _, processed = preprocess_image(path.read_bytes())
+        except ValueError:
+            continue
+        images.append((path.name, processed))
+    return images
+
+
+def demo_images(n: int):
+    from bench_segmentation import sample_image
+    return [(f"synthetic_{i}", sample_image(512, seed=i)) for i in range(n)]
+
+
+def report(rows, fp32_path: str, int8_path: str, min_dice: float):
+    print(f"{'image':<28} {'dice':>7} {'fp32_ms':>9} {'int8_ms':>9}")
+    for r in rows:
+        print(f"{r['image'][:28]:<28} {r['dice']:>7.4f} {r['fp32_ms']:>9.1f} {r['int8_ms']:>9.1f}")
+
+    dices = np.array([r["dice"] for r in rows])
+    fp32_ms = np.array([r["fp32_ms"] for r in rows])
+    int8_ms = np.array([r["int8_ms"] for r in rows])
+    fp32_kb = os.path.getsize(fp32_path) / 1024
+    int8_kb = os.path.getsize(int8_path) / 1024
+    print()
+    print(f"dice      mean {dices.mean():.4f}  min {dices.min():.4f}")
+    print(f"latency   fp32 p50 {np.median(fp32_ms):.1f} ms  int8 p50 {np.median(int8_ms):.1f} ms  "
+          f"speedup x{np.median(fp32_ms) / max(np.median(int8_ms), 1e-9):.2f}")
+    print(f"size      fp32 {fp32_kb:.1f} KB  int8 {int8_kb:.1f} KB  (x{fp32_kb / max(int8_kb, 1e-9):.2f} smaller)")
+    safe = dices.min() >= min_dice
+    print(f"{'✅' if safe else '⚠️'} min dice {dices.min():.4f} {'>=' if safe else '<'} {min_dice} -> "
+          f"{'an toàn để bật' if safe else 'chưa nên bật'} SEG_PRECISION=int8")
+    if np.median(int8_ms) >= np.median(fp32_ms):
+        print("⚠️ int8 không nhanh hơn fp32 trên máy này (model nhỏ / CPU thiếu VNNI) - lợi ích chỉ còn kích thước")
+    return safe
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fp32 vs int8 vessel segmentation (Dice, latency, size)")
+    parser.add_argument("--fp32", help="Model fp32 (.onnx)")
+    parser.add_argument("--int8", help="Model int8 (mặc định: <fp32>.int8.onnx, tự tạo nếu chưa có)")
+    parser.add_argument("--images", help="Thư mục ảnh đáy mắt để so sánh (và hiệu chỉnh nếu cần)")
+    parser.add_argument("--mode", choices=["dynamic", "static"], default="static",
+                        help="Kiểu lượng tử hoá khi phải tạo model int8")
+    parser.add_argument("--max-images", type=int, default=50)
+    parser.add_argument("--min-dice", type=float, default=0.95, help="Ngưỡng Dice tối thiểu để coi là an toàn")
+    parser.add_argument("--demo", action="store_true", help="Dùng U-Net ngẫu nhiên và ảnh tổng hợp")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.demo:
+            from bench_segmentation import build_random_unet_onnx
+            import cv2
+
+            fp32_path = build_random_unet_onnx(os.path.join(tmp, "unet_random.onnx"))
+            images = demo_images(min(args.max_images, 8))
+            calib_dir = os.path.join(tmp, "calib")
+            os.makedirs(calib_dir)
+            for name, img in images:
+                cv2.imwrite(os.path.join(calib_dir, f"{name}.png"), cv2.cvtColor(img, cv2.COLOR_GRAY2BGR))
+        else:
+            if not args.fp32 or not args.images:
+                parser.error("--fp32 và --images là bắt buộc (hoặc dùng --demo)")
+            fp32_path = args.fp32
+            images = load_images(args.images, args.max_images)
+            calib_dir = args.images
+        if not images:
+            raise SystemExit("Không có ảnh hợp lệ để so sánh")
+
+        int8_path = args.int8 or default_int8_path(fp32_path)
+        if not os.path.exists(int8_path):
+            print(f"Tạo model int8 ({args.mode}) -> {int8_path}")
+            quantize_model(fp32_path, int8_path, args.mode, calib_dir, args.max_images)
+
+        rows = compare(fp32_path, int8_path, images)
+        report(rows, fp32_path, int8_path, args.min_dice)
+
+
+if __name__ == "__main__":
+    main()
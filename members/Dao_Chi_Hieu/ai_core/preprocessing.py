@@ -4,6 +4,20 @@ import numpy as np
 # Kích thước chuẩn cho Model AI
 IMG_SIZE = (512, 512)
 
+def decode_image(image_bytes: bytes) -> np.ndarray:
+    nparr = np.frombuffer(image_bytes, np.uint8)
+    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+
+    if img is None:
+        raise ValueError("Không thể đọc file ảnh.")
+    return img
+
+def apply_clahe(img_bgr: np.ndarray) -> np.ndarray:
+    """Grayscale + CLAHE (làm rõ mạch máu)."""
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return clahe.apply(gray)
+
 def preprocess_image(image_bytes: bytes) -> tuple[np.ndarray, np.ndarray]:
     """
     Input: Bytes ảnh gốc.
@@ -12,24 +26,34 @@ def preprocess_image(image_bytes: bytes) -> tuple[np.ndarray, np.ndarray]:
         - processed_img: Ảnh đã qua CLAHE và Resize (để đưa vào Model).
     """
     # 1. Decode ảnh
-    nparr = np.frombuffer(image_bytes, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    
-    if img is None:
-        raise ValueError("Không thể đọc file ảnh.")
+    img = decode_image(image_bytes)
 
     # 2. Resize về kích thước chuẩn (512x512)
     img_resized = cv2.resize(img, IMG_SIZE)
 
-    # 3. Chuyển sang Grayscale
-    gray = cv2.cvtColor(img_resized, cv2.COLOR_BGR2GRAY)
-    
-    # 4. Áp dụng CLAHE (Làm rõ mạch máu)
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    enhanced_img = clahe.apply(gray)
+    # 3-4. Grayscale + CLAHE
+    enhanced_img = apply_clahe(img_resized)
     
     # QUAN TRỌNG: Phải trả về 2 giá trị tại đây
     return img_resized, enhanced_img 
 
+def preprocess_full_resolution(image_bytes: bytes, max_side: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Giống preprocess_image nhưng giữ độ phân giải gốc (dùng cho chế độ tiled).
+    Nếu max_side được đặt, ảnh lớn hơn sẽ được thu nhỏ giữ nguyên tỉ lệ.
+    CLAHE dùng lưới ô tỉ lệ với kích thước ảnh để độ tương phản cục bộ tương đương ảnh 512px.
+    """
+    img = decode_image(image_bytes)
+    h, w = img.shape[:2]
+    if max_side and max(h, w) > max_side:
+        scale = max_side / max(h, w)
+        img = cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        h, w = img.shape[:2]
+
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    grid = (max(8, round(8 * w / IMG_SIZE[0])), max(8, round(8 * h / IMG_SIZE[1])))
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=grid)
+    return img, clahe.apply(gray)
+
 if __name__ == "__main__":
     print("✅ Module preprocessing đã cập nhật chuẩn 2 đầu ra!")
\ No newline at end of file
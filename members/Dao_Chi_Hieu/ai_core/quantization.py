@@ -0,0 +1,90 @@
+"""
+Lượng tử hoá int8 cho model tách mạch máu (ONNX Runtime).
+
+  - dynamic: chỉ lượng tử hoá trọng số, activation tính scale lúc chạy (không cần dữ liệu)
+  - static:  lượng tử hoá cả activation, scale lấy từ bước hiệu chỉnh (calibration)
+             trên một thư mục ảnh đáy mắt mẫu, đi qua đúng tiền xử lý của /analyze
+
+    python quantization.py --model model/unet_vessel.onnx --images samples/ --mode static
+"""
+import argparse
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+from preprocessing import preprocess_image
+from segmentation import default_int8_path, to_input_tensor
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff"}
+
+
+def iter_images(folder: str, max_images: Optional[int] = None) -> Iterator[Path]:
+    paths = sorted(p for p in Path(folder).rglob("*") if p.suffix.lower() in IMAGE_EXTS)
+    return iter(paths[:max_images] if max_images else paths)
+
+
+def _calibration_reader(model_path: str, images_dir: str, max_images: Optional[int]):
+    import onnxruntime as ort
+    from onnxruntime.quantization import CalibrationDataReader
+
+    input_name = ort.InferenceSession(model_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class FundusCalibrationReader(CalibrationDataReader):
+        """Đưa từng ảnh mẫu (CLAHE 512x512, float32) vào bộ hiệu chỉnh."""
+
+        def __init__(self):
+            self._paths = iter_images(images_dir, max_images)
+
+        def get_next(self):
+            for path in self._paths:
+                try:
+                    _, processed = preprocess_image(path.read_bytes())
+                except ValueError:
+                    continue
+                return {input_name: to_input_tensor(processed)}
+            return None
+
+    return FundusCalibrationReader()
+
+
+def quantize_model(model_path: str, out_path: Optional[str] = None, mode: str = "dynamic",
+                   images_dir: Optional[str] = None, max_images: Optional[int] = 64) -> str:
+    """Tạo bản int8 của model fp32 và trả về đường dẫn file kết quả."""
+    from onnxruntime.quantization import quantize_dynamic, quantize_static, QuantType, QuantFormat, CalibrationMethod
+
+    out_path = out_path or default_int8_path(model_path)
+    if mode == "dynamic":
+        quantize_dynamic(model_path, out_path, weight_type=QuantType.QInt8)
+    elif mode == "static":
+        if not images_dir:
+            raise ValueError("Static quantization cần thư mục ảnh hiệu chỉnh (images_dir)")
+        quantize_static(
+            model_path, out_path,
+            _calibration_reader(model_path, images_dir, max_images),
+            quant_format=QuantFormat.QDQ,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            per_channel=True,
+            calibrate_method=CalibrationMethod.MinMax,
+        )
+    else:
+        raise ValueError(f"Unknown quantization mode: {mode}")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the vessel segmentation model to int8")
+    parser.add_argument("--model", required=True, help="Model fp32 (.onnx)")
+    parser.add_argument("--out", help="File int8 đầu ra (mặc định: <model>.int8.onnx)")
+    parser.add_argument("--mode", choices=["dynamic", "static"], default="static")
+    parser.add_argument("--images", help="Thư mục ảnh đáy mắt mẫu để hiệu chỉnh (bắt buộc với static)")
+    parser.add_argument("--max-images", type=int, default=64)
+    args = parser.parse_args()
+
+    out = quantize_model(args.model, args.out, args.mode, args.images, args.max_images)
+    print(f"✅ {args.mode} int8 model: {out} ({os.path.getsize(out) / 1024:.1f} KB, "
+          f"fp32 {os.path.getsize(args.model) / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
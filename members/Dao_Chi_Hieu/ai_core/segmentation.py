@@ -1,54 +1,298 @@
 import cv2
+import hashlib
 import numpy as np
 import os
-import torch
+import sys
+from pathlib import Path
+
+# Module dùng chung nằm trong SRC/ai (import dưới dạng package `ai`)
+SRC_DIR = Path(__file__).resolve().parents[3] / "SRC"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+from ai.fov import FovROI, detect_fov
+
+# Đường dẫn đến file model: .onnx (ONNX Runtime) hoặc .pth/.pt (torch, TorchScript hoặc full model)
+MODEL_PATH = os.getenv("SEG_MODEL_PATH", "model/unet_vessel.pth")
+
+# Backend suy luận: auto (theo đuôi file) | onnx | torch | threshold (giả lập)
+SEG_BACKEND = os.getenv("SEG_BACKEND", "auto")
+
+# Số luồng CPU: intra-op (song song trong 1 phép tính), inter-op (giữa các nhánh của graph)
+INTRA_OP_THREADS = int(os.getenv("SEG_INTRA_OP_THREADS", str(os.cpu_count() or 1)))
+INTER_OP_THREADS = int(os.getenv("SEG_INTER_OP_THREADS", "1"))
+
+# Độ chính xác: fp32 | int8 (model ONNX đã lượng tử hoá bằng quantization.py)
+SEG_PRECISION = os.getenv("SEG_PRECISION", "fp32")
+SEG_INT8_MODEL_PATH = os.getenv("SEG_INT8_MODEL_PATH", "")
+
+# Chỉ suy luận trong hình chữ nhật bao vùng võng mạc (bỏ 4 góc đen);
+# cạnh ROI làm tròn lên bội số SEG_FOV_ALIGN để hợp với số tầng pooling của U-Net
+FOV_CROP = os.getenv("SEG_FOV_CROP", "1") == "1"
+FOV_ALIGN = int(os.getenv("SEG_FOV_ALIGN", "32"))
+
+# Chế độ tiled cho ảnh độ phân giải cao: kích thước ô, phần chồng lấn, số ô mỗi lô
+TILE_SIZE = int(os.getenv("SEG_TILE_SIZE", "512"))
+TILE_OVERLAP = int(os.getenv("SEG_TILE_OVERLAP", "64"))
+TILE_BATCH = int(os.getenv("SEG_TILE_BATCH", "4"))
+
+
+def to_input_tensor(images: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    """Ảnh xám uint8 (H, W) hoặc lô (N, H, W) -> tensor float32 (N, 1, H, W) trong [0, 1].
+
+    Chuẩn hoá ghi thẳng vào buffer đích (không tạo bản sao trung gian).
+    """
+    images = np.asarray(images)
+    if images.ndim == 2:
+        images = images[None]
+    if out is None:
+        out = np.empty((images.shape[0], 1) + images.shape[1:], dtype=np.float32)
+    np.multiply(images, np.float32(1.0 / 255.0), out=out[:, 0], casting="unsafe")
+    return out
+
+
+def default_int8_path(fp32_path: str) -> str:
+    root, _ = os.path.splitext(fp32_path)
+    return f"{root}.int8.onnx"
+
+
+class OnnxBackend:
+    """U-Net chạy bằng ONNX Runtime trên CPU. Đầu ra model: logits (N, 1, H, W)."""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str, intra_op_threads: int, inter_op_threads: int):
+        import onnxruntime as ort
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = intra_op_threads
+        opts.inter_op_num_threads = inter_op_threads
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        # H, W cố định trong graph => không cắt ROI được
+        self.dynamic_shape = not all(isinstance(d, int) for d in self.session.get_inputs()[0].shape[2:])
+        self.output_name = self.session.get_outputs()[0].name
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run([self.output_name], {self.input_name: batch})[0]
+
+
+class TorchBackend:
+    """U-Net chạy bằng torch trên CPU (chỉ import torch khi backend này được chọn)."""
+
+    name = "torch"
+    dynamic_shape = True
+
+    def __init__(self, model_path: str, intra_op_threads: int, inter_op_threads: int):
+        import torch
+
+        torch.set_num_threads(intra_op_threads)
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError:
+            # chỉ đặt được một lần cho mỗi tiến trình
+            pass
+        try:
+            model = torch.jit.load(model_path, map_location="cpu")
+        except RuntimeError:
+            model = torch.load(model_path, map_location="cpu", weights_only=False)
+        model.eval()
+        self.torch = torch
+        self.model = model
+
+    def __call__(self, batch: np.ndarray) -> np.ndarray:
+        with self.torch.inference_mode():
+            # from_numpy dùng chung bộ nhớ với mảng numpy, không copy
+            return self.model(self.torch.from_numpy(batch)).numpy()
+
+
+BACKENDS = {"onnx": OnnxBackend, "torch": TorchBackend}
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> list[int]:
+    """Vị trí bắt đầu các ô dọc một trục; ô cuối căn sát mép ảnh."""
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def blend_ramp(tile: int, overlap: int) -> np.ndarray:
+    """Trọng số 1D của một ô: tăng tuyến tính trong vùng chồng lấn, bằng 1 ở giữa (luôn > 0)."""
+    if overlap <= 0:
+        return np.ones(tile, dtype=np.float32)
+    i = np.arange(tile, dtype=np.float32) + 0.5
+    return np.minimum(1.0, np.minimum(i, tile - i) / overlap).astype(np.float32)
 
-# Đường dẫn đến file model (Sau này bạn copy file .pth vào thư mục model/)
-MODEL_PATH = "model/unet_vessel.pth"
 
 class VesselSegmentation:
-    def __init__(self):
-        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    def __init__(self, model_path: str = MODEL_PATH, backend: str = SEG_BACKEND,
+                 intra_op_threads: int = INTRA_OP_THREADS, inter_op_threads: int = INTER_OP_THREADS,
+                 precision: str = SEG_PRECISION, int8_model_path: str = SEG_INT8_MODEL_PATH,
+                 crop_fov: bool = FOV_CROP):
+        self.model_path = model_path
+        self.crop_fov = crop_fov
+        self.backend_name = backend
+        self.precision = self.select_precision(precision, int8_model_path)
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
         self.model = self.load_model()
+        # Phiên bản model (dùng làm khoá cache kết quả)
+        self.version = self.model_version()
+
+    def select_precision(self, precision: str, int8_model_path: str) -> str:
+        """int8 chỉ dùng được với model ONNX đã lượng tử hoá; thiếu file thì quay về fp32."""
+        if precision != "int8":
+            return "fp32"
+        int8_path = int8_model_path or default_int8_path(self.model_path)
+        if self.backend_name == "torch" or not os.path.exists(int8_path):
+            print(f"⚠️ Không dùng được model int8 ({int8_path}), chạy fp32.")
+            return "fp32"
+        self.model_path = int8_path
+        return "int8"
 
     def load_model(self):
-        # Kiểm tra nếu có file model thì load, không thì báo warning
-        if os.path.exists(MODEL_PATH):
-            print(f"✅ Đang load model từ {MODEL_PATH}...")
-            # model = torch.load(MODEL_PATH) 
-            # model.eval()
-            # return model
-            return None # Placeholder
-        else:
+        # Kiểm tra nếu có file model thì load (một lần), không thì báo warning
+        if self.backend_name == "threshold":
+            return None
+        if not os.path.exists(self.model_path):
             print("⚠️ Chưa tìm thấy file model trọng số! Đang chạy chế độ giả lập (Dummy).")
             return None
 
+        name = self.backend_name
+        if name == "auto":
+            name = "onnx" if self.model_path.endswith(".onnx") else "torch"
+        print(f"✅ Đang load model từ {self.model_path} (backend={name})...")
+        return BACKENDS[name](self.model_path, self.intra_op_threads, self.inter_op_threads)
+
+    def model_version(self) -> str:
+        roi = "-fov" if self.crop_fov else ""
+        if self.model is None:
+            return "adaptive-threshold-1" + roi
+        with open(self.model_path, "rb") as f:
+            return f"unet-{self.model.name}-{self.precision}{roi}-" + hashlib.sha256(f.read()).hexdigest()[:12]
+
+    def fov_window(self, images, align: int = FOV_ALIGN) -> FovROI:
+        """ROI chung cho cả lô (bao vùng võng mạc của mọi ảnh) để vẫn ghép được thành một tensor."""
+        h, w = images[0].shape
+        if not self.crop_fov or (self.model is not None and not self.model.dynamic_shape):
+            return FovROI.full(h, w)
+        union = images[0] if len(images) == 1 else np.maximum.reduce(list(images))
+        return detect_fov(union, align=align if self.model is not None else 1)
+
+    def predict_batch(self, images) -> np.ndarray:
+        """
+        Input: Danh sách / mảng (N, H, W) ảnh xám đã qua CLAHE, cùng kích thước
+        Output: Mask nhị phân (N, H, W) uint8, một lần forward cho cả lô
+        """
+        if not self.model:
+            return np.stack([self.predict(img) for img in images])
+        roi = self.fov_window(images)
+        batch = np.empty((len(images), 1) + roi.shape, dtype=np.float32)
+        for i, img in enumerate(images):
+            to_input_tensor(img[roi.slices], out=batch[i:i + 1])
+        logits = self.model(batch)
+        masks = np.zeros((len(images), roi.height, roi.width), dtype=np.uint8)
+        masks[(slice(None),) + roi.slices] = np.where(logits[:, 0] > 0, np.uint8(255), np.uint8(0))
+        return masks
+
+    def predict_proba_batch(self, images) -> np.ndarray:
+        """Xác suất mạch máu float32 (N, H, W) cho một lô ảnh cùng kích thước."""
+        if not self.model:
+            probs = np.stack([self.predict(img) for img in images]).astype(np.float32)
+            probs *= np.float32(1.0 / 255.0)
+            return probs
+        h, w = images[0].shape
+        batch = np.empty((len(images), 1, h, w), dtype=np.float32)
+        for i, img in enumerate(images):
+            to_input_tensor(img, out=batch[i:i + 1])
+        logits = self.model(batch)[:, 0]
+        # sigmoid tại chỗ trên buffer đầu ra
+        np.negative(logits, out=logits)
+        np.exp(logits, out=logits)
+        logits += 1.0
+        np.reciprocal(logits, out=logits)
+        return logits
+
+    def predict_tiled(self, processed_image: np.ndarray, tile_size: int = TILE_SIZE,
+                      overlap: int = TILE_OVERLAP, batch_size: int = TILE_BATCH) -> np.ndarray:
+        """
+        Input: Ảnh xám đã qua CLAHE ở độ phân giải gốc (ví dụ 3000-4000px)
+        Output: Mask nhị phân uint8 cùng kích thước
+
+        Ảnh được chia thành các ô tile_size x tile_size chồng lấn nhau `overlap` px,
+        chạy theo lô batch_size ô, rồi ghép bằng trọng số tuyến tính vào buffer cấp
+        phát sẵn. Bộ nhớ trung gian phụ thuộc vào số ô mỗi lô, không phụ thuộc diện tích ảnh.
+        Chỉ chia ô trong vùng võng mạc (ROI), các góc đen không được suy luận.
+        """
+        roi = self.fov_window([processed_image], align=1)
+        return roi.paste(self._predict_tiles(processed_image[roi.slices], tile_size, overlap, batch_size))
+
+    def _predict_tiles(self, image: np.ndarray, tile_size: int, overlap: int, batch_size: int) -> np.ndarray:
+        h, w = image.shape
+        if h < tile_size or w < tile_size:
+            # ảnh nhỏ hơn một ô: pad phản chiếu cho đủ kích thước ô
+            image = cv2.copyMakeBorder(image, 0, max(0, tile_size - h), 0, max(0, tile_size - w), cv2.BORDER_REFLECT_101)
+        H, W = image.shape
+        ys, xs = tile_starts(H, tile_size, overlap), tile_starts(W, tile_size, overlap)
+
+        # cửa sổ 2D = outer(ramp, ramp) và lưới ô là tích Descartes
+        # => tổng trọng số tại mỗi pixel = outer(wy, wx), chỉ cần 2 mảng 1D
+        ramp = blend_ramp(tile_size, overlap)
+        window = np.outer(ramp, ramp)
+        wy = np.zeros(H, dtype=np.float32)
+        wx = np.zeros(W, dtype=np.float32)
+        for y in ys:
+            wy[y:y + tile_size] += ramp
+        for x in xs:
+            wx[x:x + tile_size] += ramp
+
+        acc = np.zeros((H, W), dtype=np.float32)
+        coords = [(y, x) for y in ys for x in xs]
+        for i in range(0, len(coords), batch_size):
+            chunk = coords[i:i + batch_size]
+            probs = self.predict_proba_batch([image[y:y + tile_size, x:x + tile_size] for y, x in chunk])
+            for (y, x), p in zip(chunk, probs):
+                p *= window
+                acc[y:y + tile_size, x:x + tile_size] += p
+
+        # ngưỡng 0.5 trên xác suất đã chuẩn hoá, xử lý theo dải hàng để không tạo mảng tạm cỡ ảnh
+        mask = np.empty((h, w), dtype=np.uint8)
+        half_wx = 0.5 * wx[:w]
+        for r in range(0, h, tile_size):
+            r1 = min(h, r + tile_size)
+            np.greater(acc[r:r1, :w], wy[r:r1, None] * half_wx, out=mask[r:r1].view(bool))
+        mask *= 255
+        return mask
+
     def predict(self, processed_image: np.ndarray) -> np.ndarray:
         """
         Input: Ảnh xám đã qua CLAHE (512x512)
         Output: Ảnh nhị phân (Mask) tách mạch máu
         """
-        
+
         # --- LOGIC CHẠY AI THẬT (Khi có model) ---
+        roi = self.fov_window([processed_image])
+        crop = processed_image[roi.slices]
         if self.model:
-            # Chuyển ảnh sang Tensor -> Đưa vào Model -> Lấy output -> Chuyển về ảnh
-            # tensor_img = torch.from_numpy(processed_image).unsqueeze(0).float()
-            # with torch.no_grad():
-            #     output = self.model(tensor_img)
-            # return output_mask
-            pass
+            logits = self.model(to_input_tensor(crop))
+            # logit > 0 <=> sigmoid(logit) > 0.5, không cần tính sigmoid
+            return roi.paste(np.where(logits[0, 0] > 0, np.uint8(255), np.uint8(0)))
 
         # --- LOGIC GIẢ LẬP (Dùng thuật toán Thresholding đơn giản để demo) ---
         # Tạm thời dùng Adaptive Threshold để tách mạch máu thay cho AI
         mask = cv2.adaptiveThreshold(
-            processed_image, 
-            255, 
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-            cv2.THRESH_BINARY_INV, 
-            11, 
+            np.ascontiguousarray(crop),
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV,
+            11,
             2
         )
-        return mask
+        return roi.paste(mask)
 
 # Khởi tạo object để dùng bên api
-segmentor = VesselSegmentation()
\ No newline at end of file
+segmentor = VesselSegmentation()
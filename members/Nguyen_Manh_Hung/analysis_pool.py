@@ -0,0 +1,192 @@
+"""Bounded process pool for the CPU-bound analysis of app.py.
+
+The FastAPI handlers are async: running Frangi/topology on the event loop would
+stall every other connection (health checks included) for the duration of an
+analysis. AnalysisPool runs analyze_file in worker processes that import the
+pipeline (skimage/scipy, OpenCV) once at start-up and warm it on a small
+synthetic image, so the first request does not pay for the imports.
+
+Admission is bounded: at most max_pending analyses are running or queued.
+try_acquire / acquire reserve a slot; when the pool is full, try_acquire raises
+PoolBusy with a Retry-After estimate from the recent analysis times, which the
+service turns into a 503 instead of letting the queue (and latency) grow.
+
+processes=0 runs analyses on a thread instead (no worker processes; for
+development and platforms where spawning is unwanted).
+"""
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Optional
+
+
+class PoolBusy(Exception):
+    """All analysis slots are taken; retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Analysis queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _init_worker(threads: int, stage_cache_bytes: Optional[int]):
+    import cv2
+    import numpy as np
+    import processing
+    import vesselness
+    from ai.pipeline import StageCache
+
+    # several processes share the cores: keep each single threaded unless told otherwise
+    vesselness.THREADS = threads
+    cv2.setNumThreads(threads)
+    # the stage cache is per process; split its budget between the workers
+    if stage_cache_bytes is not None:
+        processing.PIPELINE.cache = StageCache(stage_cache_bytes) if stage_cache_bytes > 0 else None
+    # warm-up: lazy imports, allocator and OpenCV paths on a small synthetic fundus
+    yy, xx = np.mgrid[:96, :96]
+    img = np.where((yy - 48) ** 2 + (xx - 48) ** 2 < 40 ** 2, 120, 0).astype(np.uint8)
+    ok, png = cv2.imencode('.png', np.dstack([img // 3, img // 2, img]))
+    if ok:
+        processing.run_pipeline(png.tobytes(), use_cache=False, annotated=False)
+
+
+def analyze_file(path: str, sha256: str, encoder, prescreen_config, quality=None) -> Dict[str, Any]:
+    """Pre-screen + analysis pipeline of an image file (runs in a worker).
+
+    quality: processing.QUALITY_LEVELS entry (resolution / Frangi scales), default full.
+
+    Returns {'rejected': prescreen dict} or {'annotated', 'metrics', 'graph', 'timings'}
+    (graph as VesselGraph.to_bytes() or None).
+    """
+    from ai.ingest import map_file
+    from ai.prescreen import prescreen
+    from processing import run_pipeline, unpack_run
+
+    with map_file(path) as content:
+        screen = prescreen(content, prescreen_config)
+        if not screen.ok:
+            return {'rejected': screen.to_dict()}
+        run = run_pipeline(content, with_graph=True, encoder=encoder, image_sha256=sha256, quality=quality)
+    annotated_bytes, metrics, graph = unpack_run(run, with_graph=True)
+    metrics['prescreen'] = screen.to_dict()
+    return {
+        'annotated': annotated_bytes,
+        'metrics': metrics,
+        'graph': graph.to_bytes() if graph is not None else None,
+        'timings': run.to_dict(),
+    }
+
+
+class AnalysisPool:
+    def __init__(self, processes: int, max_pending: Optional[int] = None, threads_per_process: int = 1,
+                 stage_cache_bytes: Optional[int] = None, start_method: str = 'spawn'):
+        self.processes = processes
+        self.max_pending = max_pending or 2 * max(processes, 1)
+        self.threads_per_process = threads_per_process
+        self.stage_cache_bytes = stage_cache_bytes
+        self.start_method = start_method
+        self._executor = None
+        self._pending = 0
+        self._slot_freed: Optional[asyncio.Event] = None
+        # moving average of recent analysis times, for Retry-After
+        self._avg_seconds = 1.0
+        self._completed = 0
+        self._rejected = 0
+
+    @classmethod
+    def from_env(cls, prefix: str = 'ANALYZE_') -> 'AnalysisPool':
+        """ANALYZE_WORKERS (default cpu count; 0 = thread), ANALYZE_MAX_PENDING (default 2 x workers),
+        ANALYZE_THREADS_PER_WORKER (1); STAGE_CACHE_MB is split between the workers."""
+        processes = int(os.getenv(f'{prefix}WORKERS', str(os.cpu_count() or 1)))
+        stage_cache_mb = float(os.getenv('STAGE_CACHE_MB', '256'))
+        return cls(
+            processes=processes,
+            max_pending=int(os.getenv(f'{prefix}MAX_PENDING', '0')) or None,
+            threads_per_process=int(os.getenv(f'{prefix}THREADS_PER_WORKER', '1')),
+            stage_cache_bytes=int(stage_cache_mb * 1024 * 1024 / max(processes, 1)),
+        )
+
+    def start(self):
+        """Start (and warm) the workers; called at app start-up, otherwise on first use."""
+        if self._executor is not None:
+            return
+        if self.processes <= 0:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='analysis')
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context(self.start_method),
+            initializer=_init_worker, initargs=(self.threads_per_process, self.stage_cache_bytes))
+        # spawn all workers now, so their imports/warm-up do not land on the first requests
+        for f in [self._executor.submit(time.sleep, 0) for _ in range(self.processes)]:
+            f.result()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    @property
+    def pending(self) -> int:
+        """Analyses running or queued."""
+        return self._pending
+
+    @property
+    def full(self) -> bool:
+        return self._pending >= self.max_pending
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free: queued work / workers x average analysis time."""
+        waves = (self._pending + 1) / max(self.processes, 1)
+        return max(1, math.ceil(waves * self._avg_seconds))
+
+    def try_acquire(self):
+        """Reserve a slot or raise PoolBusy (single requests: fail fast with 503)."""
+        if self.full:
+            self._rejected += 1
+            raise PoolBusy(self.retry_after())
+        self._pending += 1
+
+    async def acquire(self):
+        """Reserve a slot, waiting for one to free up (images of an admitted batch)."""
+        while self.full:
+            if self._slot_freed is None:
+                self._slot_freed = asyncio.Event()
+            await self._slot_freed.wait()
+        self._pending += 1
+
+    def release(self):
+        self._pending -= 1
+        if self._slot_freed is not None:
+            self._slot_freed.set()
+            self._slot_freed = None
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) on the pool; the caller holds a slot (try_acquire / acquire)."""
+        self.start()
+        loop = asyncio.get_running_loop()
+        t0 = time.perf_counter()
+        try:
+            result = await loop.run_in_executor(self._executor, fn, *args)
+        except BrokenProcessPool:
+            # a worker died (e.g. killed by the OOM killer): replace the pool for later requests
+            self.shutdown()
+            raise
+        elapsed = time.perf_counter() - t0
+        self._avg_seconds = 0.8 * self._avg_seconds + 0.2 * elapsed if self._completed else elapsed
+        self._completed += 1
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.processes,
+            'mode': 'process' if self.processes > 0 else 'thread',
+            'started': self._executor is not None,
+            'pending': self._pending,
+            'max_pending': self.max_pending,
+            'completed': self._completed,
+            'rejected': self._rejected,
+            'avg_ms': round(self._avg_seconds * 1000.0, 1) if self._completed else None,
+        }
@@ -3,17 +3,95 @@ import io
 import base64
 import uuid
 import glob
+import mimetypes
 import requests
 import sqlite3
 import datetime
+import sys
+import json
+import time
+import asyncio
+import hashlib
+import shutil
+from pathlib import Path
+from typing import List
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query
-from fastapi.responses import JSONResponse, FileResponse
-from processing import analyze_image
-from storage import upload_if_configured, SUPABASE_PY_AVAILABLE, cloudinary
+from fastapi.responses import JSONResponse, FileResponse, Response, StreamingResponse
+from processing import PIPELINE, PIPELINE_VERSION, QUALITY_LEVELS
+from vessel_graph import VesselGraph
+from storage import upload_if_configured, upload_many, SUPABASE_PY_AVAILABLE, cloudinary
+from analysis_pool import AnalysisPool, PoolBusy, analyze_file
+
+# Shared AI modules live in SRC/ai (imported as the `ai` package)
+SRC_DIR = Path(__file__).resolve().parent.parent.parent / "SRC"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+from ai.result_cache import ResultCache
+from ai.prescreen import PrescreenConfig
+from ai.image_response import (
+    EncoderConfig, ImageLinkStore, RESPONSE_MODES, JSON, MULTIPART, URL, data_uri, multipart_body,
+)
+from ai.ingest import IngestError, IngestLimits, ingest_upload
+from ai.near_duplicate import NearDuplicateIndex, image_hashes
+from ai.adaptive import AdaptiveQuality
 
 app = FastAPI(title="AI Specialist - Nguyen_Manh_Hung")
 
 DB_PATH = os.path.join(os.path.dirname(__file__), 'storage.db')
+OUTPUT_DIR = os.path.join(os.path.dirname(__file__), 'output')
+
+# Cache of analyze_image results keyed by upload SHA-256 + PIPELINE_VERSION
+result_cache = ResultCache(
+    disk_dir=os.getenv('RESULT_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache')),
+    memory_max_entries=int(os.getenv('RESULT_CACHE_MEMORY_ENTRIES', '128')),
+    disk_max_bytes=int(os.getenv('RESULT_CACHE_DISK_MB', '512')) * 1024 * 1024,
+    max_age_seconds=float(os.getenv('RESULT_CACHE_MAX_AGE_HOURS', '168')) * 3600,
+)
+
+# Cheap thumbnail checks (exposure, selfie, field of view, blur) run before Frangi
+PRESCREEN_CONFIG = PrescreenConfig(
+    selfie_white_ratio=float(os.getenv('PRESCREEN_SELFIE_WHITE_RATIO', '0.15')),
+    min_fov_fraction=float(os.getenv('PRESCREEN_MIN_FOV', '0.25')),
+    min_blur_variance=float(os.getenv('PRESCREEN_MIN_BLUR_VAR', '20')),
+)
+
+
+# Near-duplicates (perceptual hash) of a user's recent uploads: NEAR_DUP_MODE=reuse (return the earlier
+# result) | flag (analyze anyway, report the match) | off; only for requests with user_id
+NEAR_DUP_MODE = os.getenv('NEAR_DUP_MODE', 'reuse')
+near_duplicates = NearDuplicateIndex.from_env()
+
+
+# Upload limits: UPLOAD_MAX_MB, UPLOAD_MAX_MEGAPIXELS, UPLOAD_MAX_SIDE (decompression-bomb guard)
+UPLOAD_LIMITS = IngestLimits.from_env()
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR') or None
+
+
+# Analysis runs in ANALYZE_WORKERS processes (never on the event loop); at most ANALYZE_MAX_PENDING
+# analyses are queued, further requests get 503 + Retry-After
+analysis_pool = AnalysisPool.from_env()
+
+# Latency SLA: with ADAPTIVE_TARGET_P95_MS set, requests are processed at a lower resolution / fewer
+# Frangi scales (QUALITY_LEVELS) when the queue would make full quality miss the target; degraded
+# results keep their original for POST /reanalyze/{id}
+adaptive = AdaptiveQuality.from_env(QUALITY_LEVELS)
+# background full-quality re-analyses: id -> status dict (tasks referenced until done)
+reanalyses: dict = {}
+_background_tasks: set = set()
+
+# POST /analyze/batch: at most ANALYZE_BATCH_MAX_FILES files per request
+BATCH_MAX_FILES = int(os.getenv('ANALYZE_BATCH_MAX_FILES', '64'))
+STORAGE_UPLOAD_CONCURRENCY = int(os.getenv('STORAGE_UPLOAD_CONCURRENCY', '4'))
+
+
+# Annotated image format: IMAGE_FORMAT=png|jpeg|webp, IMAGE_QUALITY, IMAGE_PNG_COMPRESSION
+ENCODER = EncoderConfig.from_env(default_format='png')
+
+# response=url: short-lived links to images (GET /images/{token})
+image_links = ImageLinkStore(
+    ttl_seconds=float(os.getenv('IMAGE_LINK_TTL', '300')),
+    max_bytes=int(os.getenv('IMAGE_LINK_MAX_MB', '64')) * 1024 * 1024,
+)
 
 
 def ensure_db(path: str = DB_PATH):
@@ -36,40 +114,141 @@ def ensure_db(path: str = DB_PATH):
 
 def save_image_record(id: str, filename: str, annotated_url: str | None, original_url: str | None, saved_path: str | None, path: str = DB_PATH):
     """Insert or update an image record into SQLite DB."""
+    save_image_records([(id, filename, annotated_url, original_url, saved_path)], path)
+
+
+def save_image_records(rows, path: str = DB_PATH):
+    """Insert or update many (id, filename, annotated_url, original_url, saved_path) rows in one transaction."""
+    now = datetime.datetime.utcnow().isoformat()
     conn = sqlite3.connect(path)
     try:
-        cur = conn.cursor()
-        cur.execute(
+        conn.executemany(
             'INSERT OR REPLACE INTO images (id, filename, annotated_url, original_url, saved_path, created_at) VALUES (?,?,?,?,?,?)',
-            (id, filename, annotated_url, original_url, saved_path, datetime.datetime.utcnow().isoformat())
+            [(*row, now) for row in rows]
         )
         conn.commit()
     finally:
         conn.close()
 
 
+@app.on_event("startup")
+async def start_analysis_pool():
+    # spawn + warm the workers before the first request
+    await asyncio.to_thread(analysis_pool.start)
+
+
+@app.on_event("shutdown")
+def stop_analysis_pool():
+    analysis_pool.shutdown()
+
+
 @app.get("/health")
-def health():
-    return {"status": "ok", "service": "ai_specialist", "version": "1.0"}
+async def health():
+    # async and free of I/O: answered on the event loop even when every worker is busy
+    return {"status": "ok", "service": "ai_specialist", "version": "1.0", "analysis": analysis_pool.stats(),
+            "adaptive": adaptive.stats()}
 
 
-@app.post("/analyze")
-async def analyze(file: UploadFile = File(...), upload: bool = False, callback_url: str | None = Query(None)):
-    """Nhận một file ảnh, chạy segmentation, trả về ảnh annotated và JSON kết quả.
+def busy_response(e: PoolBusy) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
 
-    Query params:
-      - upload=true|false: nếu true sẽ cố gắng upload ảnh annotated lên một storage (Cloudinary/Supabase)
-      - callback_url: nếu set, service sẽ POST kết quả JSON tới URL này sau khi phân tích xong
+
+async def analyze_spool(spool, wait: bool = False, user_id: str | None = None):
+    """Analysis of an ingested upload, from the result cache when possible.
+
+    With user_id, a near-duplicate (recompressed / resized / screenshot) of one of that
+    user's recent uploads is looked up by perceptual hash; in NEAR_DUP_MODE=reuse its
+    cached result is returned instead of running segmentation again.
+
+    Cache misses run in analysis_pool (pre-screen + stage graph in a worker process that
+    maps the spool file). Without wait a full pool raises PoolBusy; with wait (batch
+    images) the call queues for a slot. The quality level is chosen by `adaptive` from the
+    queue depth and recorded in metrics['quality'] (degraded=True below full quality).
+
+    Returns (annotated_bytes, metrics, graph_bytes, cache_hit, timings, near_duplicate);
+    raises HTTPException(422) when the pre-screen rejects the image.
     """
-    if file.content_type.split("/")[0] != "image":
-        raise HTTPException(status_code=400, detail="File phải là ảnh")
+    cache_key = full_cache_key(spool.sha256)
+    cached = await asyncio.to_thread(result_cache.get, cache_key)
+    if cached is not None:
+        return cached.images['annotated'], dict(cached.metrics), cached.images.get('graph'), True, None, None
+
+    near, hashes = None, None
+    if user_id and NEAR_DUP_MODE != 'off':
+        hashes = await asyncio.to_thread(image_hashes, spool.buffer())
+        match = near_duplicates.find(user_id, hashes) if hashes is not None else None
+        if match is not None:
+            near = {**match.to_dict(), 'reused': False}
+            cached = await asyncio.to_thread(result_cache.get, match.value) if NEAR_DUP_MODE == 'reuse' else None
+            if cached is not None:
+                near['reused'] = True
+                return (cached.images['annotated'], dict(cached.metrics), cached.images.get('graph'), True,
+                        None, near)
+
+    level = adaptive.choose(analysis_pool.pending, max(analysis_pool.processes, 1))
+    if level != adaptive.full:
+        # degraded results are cached apart: the full-quality key only ever holds full results
+        cache_key = f"{cache_key}+{level.name}"
+        cached = await asyncio.to_thread(result_cache.get, cache_key)
+        if cached is not None:
+            return cached.images['annotated'], dict(cached.metrics), cached.images.get('graph'), True, None, near
+
+    if wait:
+        await analysis_pool.acquire()
+    else:
+        analysis_pool.try_acquire()
+    try:
+        # rejects unusable images (incl. non-fundus selfies) before the expensive pipeline;
+        # stage graph timings are reported per stage
+        out = await analysis_pool.run(analyze_file, str(spool.path), spool.sha256, ENCODER, PRESCREEN_CONFIG,
+                                      level)
+    finally:
+        analysis_pool.release()
+    if 'rejected' in out:
+        raise HTTPException(status_code=422, detail=out['rejected'])
+    record_quality(out, level)
+    images = {'annotated': out['annotated']}
+    if out['graph'] is not None:
+        images['graph'] = out['graph']
+    await asyncio.to_thread(result_cache.put, cache_key, out['metrics'], images)
+    if hashes is not None:
+        near_duplicates.add(user_id, hashes, cache_key)
+    return out['annotated'], out['metrics'], out['graph'], False, out['timings'], near
+
+
+def full_cache_key(sha256: str) -> str:
+    # cached images are encoded with ENCODER, so the format is part of the key
+    return ResultCache.key_for_digest(sha256, f"{PIPELINE_VERSION}+{ENCODER.tag}")
+
+
+def record_quality(out: dict, level):
+    """Feed the service time of a finished analysis to `adaptive`; tag its metrics with the level."""
+    timings = out['timings']
+    adaptive.record(level, timings['total_ms'],
+                    {name: t['ms'] for name, t in timings['stages'].items() if not t['cached']})
+    out['metrics']['quality'] = {**level.to_dict(), 'degraded': level != adaptive.full}
 
-    content = await file.read()
 
-    annotated_bytes, metrics = analyze_image(content)
+def is_degraded(metrics) -> bool:
+    return bool(isinstance(metrics, dict) and (metrics.get('quality') or {}).get('degraded'))
+
+
+def original_path(analysis_id: str) -> str:
+    return os.path.join(OUTPUT_DIR, f"{os.path.basename(analysis_id)}.orig")
+
+
+def keep_original(spool, result: dict):
+    """Keep the upload of a degraded result for a later full-quality re-analysis (blocking)."""
+    try:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        shutil.copyfile(spool.path, original_path(result['id']))
+        result["reanalyze_url"] = f"/reanalyze/{result['id']}"
+    except Exception as e:
+        result["reanalyze_error"] = str(e)
+
 
-    # compute a simple risk score from metrics (fallback) if not provided
-    # use vessel density or skeleton length as a heuristic
+def risk_score_from(metrics) -> float:
+    """Simple risk score from the metrics (vessel density or skeleton length heuristic)."""
     risk_score = None
     try:
         if isinstance(metrics, dict):
@@ -85,114 +264,434 @@ async def analyze(file: UploadFile = File(...), upload: bool = False, callback_u
     if risk_score is None:
         # fallback random-ish small score
         risk_score = round(0.5, 2)
+    return float(risk_score)
 
-    result = {
-        "id": str(uuid.uuid4()),
-        "filename": file.filename,
-        "metrics": metrics,
-        "risk_score": float(risk_score),
-        "status": "done"
-    }
-
-    # attach annotated image as base64 for backward compatibility
-    result["annotated_image_base64"] = base64.b64encode(annotated_bytes).decode("ascii")
 
-    # save annotated image on server for inspection
+def save_outputs(result: dict, annotated_bytes: bytes, graph_bytes: bytes | None) -> str:
+    """Save the annotated image (and vessel graph) in OUTPUT_DIR; records paths in result."""
+    saved_filename = f"{result['id']}{ENCODER.ext}"
     try:
-        base_dir = os.path.dirname(__file__)
-        out_dir = os.path.join(base_dir, "output")
-        os.makedirs(out_dir, exist_ok=True)
-        saved_filename = f"{result['id']}.png"
-        saved_path = os.path.join(out_dir, saved_filename)
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        saved_path = os.path.join(OUTPUT_DIR, saved_filename)
         with open(saved_path, "wb") as f:
             f.write(annotated_bytes)
+        # vessel graph stored next to the annotated image, queried via GET /graph/{id}
+        if graph_bytes is not None:
+            with open(os.path.join(OUTPUT_DIR, f"{result['id']}.graph.npz"), "wb") as f:
+                f.write(graph_bytes)
+            result["graph_url"] = f"/graph/{result['id']}"
         # return path relative to project root for readability
         result["saved_path"] = os.path.relpath(saved_path, start=os.getcwd())
         # also include absolute path for debugging
         result["saved_path_abs"] = os.path.abspath(saved_path)
     except Exception as e:
         result["saved_path_error"] = str(e)
+    return saved_filename
 
-    # Diagnostics: which storage providers are configured/available in this environment
-    providers_available = []
+
+def providers_available() -> list:
+    """Diagnostics: which storage providers are configured/available in this environment."""
+    providers = []
     try:
         # Supabase detection
         if SUPABASE_PY_AVAILABLE and os.getenv('SUPABASE_URL') and os.getenv('SUPABASE_KEY'):
-            providers_available.append('supabase')
+            providers.append('supabase')
     except Exception:
         pass
     try:
         # Cloudinary detection
         if cloudinary is not None and (os.getenv('CLOUDINARY_URL') or (os.getenv('CLOUDINARY_CLOUD_NAME') and os.getenv('CLOUDINARY_API_KEY') and os.getenv('CLOUDINARY_API_SECRET'))):
-            providers_available.append('cloudinary')
+            providers.append('cloudinary')
     except Exception:
         pass
+    return providers
 
-    result["upload_providers_available"] = providers_available
 
-    # optional upload to configured storage (cloudinary/supabase)
-    annotated_url = None
-    original_url = None
-    if upload:
-        # record that we attempted upload
-        result["upload_attempted"] = True
-        try:
-            # upload annotated image
-            print(f"Attempting upload of annotated image. Providers available: {providers_available}")
-            annotated_url = upload_if_configured(annotated_bytes, public_id=f"aura_{uuid.uuid4()}", filename=saved_filename)
-            result["annotated_image"] = annotated_url
-            result["annotated_image_url"] = annotated_url
-            result["annotated_upload_error"] = None
-            print(f"Annotated upload succeeded: {annotated_url}")
-        except Exception as e:
-            result["annotated_upload_error"] = str(e)
-            print(f"Annotated upload failed: {e}")
+def upload_and_record(result: dict, annotated_bytes: bytes, original_bytes: bytes, saved_filename: str, providers: list):
+    """Upload annotated + original image to storage and persist the URLs (blocking; run on a thread)."""
+    # record that we attempted upload
+    result["upload_attempted"] = True
+    try:
+        # upload annotated image
+        print(f"Attempting upload of annotated image. Providers available: {providers}")
+        annotated_url = upload_if_configured(annotated_bytes, public_id=f"aura_{uuid.uuid4()}", filename=saved_filename)
+        result["annotated_image"] = annotated_url
+        result["annotated_image_url"] = annotated_url
+        result["annotated_upload_error"] = None
+        print(f"Annotated upload succeeded: {annotated_url}")
+    except Exception as e:
+        result["annotated_upload_error"] = str(e)
+        print(f"Annotated upload failed: {e}")
 
-        try:
-            # attempt to upload original image as well
-            print("Attempting upload of original image")
-            original_url = upload_if_configured(content, public_id=f"orig_{uuid.uuid4()}", filename=f"orig_{result['id']}.png")
-            result["original_image"] = original_url
-            result["original_upload_error"] = None
-            print(f"Original upload succeeded: {original_url}")
-        except Exception as e:
-            result["original_upload_error"] = str(e)
-            print(f"Original upload failed: {e}")
+    try:
+        # attempt to upload original image as well
+        print("Attempting upload of original image")
+        original_url = upload_if_configured(original_bytes, public_id=f"orig_{uuid.uuid4()}", filename=f"orig_{result['id']}.png")
+        result["original_image"] = original_url
+        result["original_upload_error"] = None
+        print(f"Original upload succeeded: {original_url}")
+    except Exception as e:
+        result["original_upload_error"] = str(e)
+        print(f"Original upload failed: {e}")
 
-        # persist URLs into local sqlite DB if any upload succeeded
-        try:
-            ensure_db()
-            save_image_record(result['id'], result.get('filename'), result.get('annotated_image') if result.get('annotated_image') and not result.get('annotated_image', '').startswith('data:') else None, result.get('original_image'), result.get('saved_path'))
-            result['db_saved'] = True
-        except Exception as e:
-            result['db_saved'] = False
-            result['db_error'] = str(e)
+    # persist URLs into local sqlite DB if any upload succeeded
+    try:
+        ensure_db()
+        save_image_record(result['id'], result.get('filename'), result.get('annotated_image') if result.get('annotated_image') and not result.get('annotated_image', '').startswith('data:') else None, result.get('original_image'), result.get('saved_path'))
+        result['db_saved'] = True
+    except Exception as e:
+        result['db_saved'] = False
+        result['db_error'] = str(e)
+
+
+@app.post("/analyze")
+async def analyze(file: UploadFile = File(...), upload: bool = False, callback_url: str | None = Query(None),
+                  response: str = Query(JSON, description="json | multipart | url"),
+                  user_id: str | None = Query(None)):
+    """Nhận một file ảnh, chạy segmentation, trả về ảnh annotated và JSON kết quả.
+
+    Query params:
+      - upload=true|false: nếu true sẽ cố gắng upload ảnh annotated lên một storage (Cloudinary/Supabase)
+      - callback_url: nếu set, service sẽ POST kết quả JSON tới URL này sau khi phân tích xong
+      - response: json (ảnh base64 trong annotated_image_base64), multipart (JSON + ảnh nhị phân
+        trong multipart/form-data) hoặc url (link tạm thời GET /images/{token})
+      - user_id: bệnh nhân/người dùng; ảnh gần trùng (nén lại, resize, screenshot) với ảnh gần đây
+        của cùng user_id dùng lại kết quả cũ (near_duplicate trong response, xem NEAR_DUP_MODE)
+    """
+    if file.content_type.split("/")[0] != "image":
+        raise HTTPException(status_code=400, detail="File phải là ảnh")
+    if response not in RESPONSE_MODES:
+        raise HTTPException(status_code=400, detail=f"response must be one of {', '.join(RESPONSE_MODES)}")
 
+    # stream the upload to a spool file: SHA-256 and header checks happen while receiving,
+    # oversized files / pixel counts are rejected before the rest is read (413)
+    try:
+        spool = await ingest_upload(file, UPLOAD_LIMITS, allowed=('png', 'jpeg', 'webp'), spool_dir=UPLOAD_SPOOL_DIR)
+    except IngestError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    result = {"id": str(uuid.uuid4())}
+    try:
+        annotated_bytes, metrics, graph_bytes, cache_hit, timings, near = await analyze_spool(spool, user_id=user_id)
+        # the original is only needed again for the optional storage upload
+        original_bytes = await asyncio.to_thread(spool.read_bytes) if upload else None
+        if is_degraded(metrics):
+            await asyncio.to_thread(keep_original, spool, result)
+    except PoolBusy as e:
+        raise busy_response(e)
+    finally:
+        spool.close()
+
+    result.update({
+        "filename": file.filename,
+        "metrics": metrics,
+        "risk_score": risk_score_from(metrics),
+        "status": "done",
+        "cache_hit": cache_hit,
+        "timings": timings,
+        "near_duplicate": near,
+    })
+
+    # attach annotated image as base64 for backward compatibility (json mode only)
+    if response == JSON:
+        result["annotated_image_base64"] = base64.b64encode(annotated_bytes).decode("ascii")
+
+    # save annotated image on server for inspection (file I/O off the event loop)
+    saved_filename = await asyncio.to_thread(save_outputs, result, annotated_bytes, graph_bytes)
+
+    providers = providers_available()
+    result["upload_providers_available"] = providers
+
+    # optional upload to configured storage (cloudinary/supabase); blocking SDK calls run on a thread
+    if upload:
+        await asyncio.to_thread(upload_and_record, result, annotated_bytes, original_bytes, saved_filename, providers)
     else:
         result["upload_attempted"] = False
 
-    # if not uploaded, provide annotated_image as data URI so backend/tests expecting 'annotated_image' see it
+    # if not uploaded, annotated_image is a link to the image (never a second inline copy of it)
     if not result.get("annotated_image"):
-        data_uri = "data:image/png;base64," + result.get("annotated_image_base64")
-        result["annotated_image"] = data_uri
+        if response == URL:
+            result["annotated_image"] = f"/images/{image_links.put(annotated_bytes, ENCODER.media_type)}"
+            result["annotated_image_expires_in"] = image_links.ttl_seconds
+        elif result.get("saved_path"):
+            result["annotated_image"] = f"/output/{saved_filename}"
+        elif response == JSON:
+            result["annotated_image"] = data_uri(annotated_bytes, ENCODER.media_type)
 
     # remove ambiguous cloudinary_* keys; keep legacy key if present
     if result.get("annotated_image") and 'cloudinary_url' in result:
         result.pop('cloudinary_url', None)
 
-    # send callback if provided (fire-and-forget)
+    # send callback if provided (best-effort POST, on a thread)
     if callback_url:
         try:
-            # best-effort POST
             headers = {"Content-Type": "application/json"}
-            requests.post(callback_url, json=result, headers=headers, timeout=5)
+            await asyncio.to_thread(requests.post, callback_url, json=result, headers=headers, timeout=5)
             result["callback_posted"] = True
         except Exception as e:
             result["callback_error"] = str(e)
 
+    if response == MULTIPART:
+        body, content_type = multipart_body(result, {"annotated": (annotated_bytes, ENCODER.media_type)})
+        return Response(content=body, media_type=content_type)
     return JSONResponse(content=result)
 
 
+async def _analyze_batch_item(index: int, filename: str, spool, keep_bytes: bool, include_image: bool,
+                              user_id: str | None = None):
+    """One image of a batch: analysis (queued for a pool slot) + saved outputs; closes the spool.
+
+    Returns (ndjson line dict, annotated_bytes, original_bytes); the bytes are only kept
+    when the batch uploads to storage afterwards.
+    """
+    result = {"index": index, "id": str(uuid.uuid4())}
+    try:
+        try:
+            annotated_bytes, metrics, graph_bytes, cache_hit, timings, near = await analyze_spool(
+                spool, wait=True, user_id=user_id)
+        except HTTPException as e:
+            return {"index": index, "filename": filename, "status": "error", "status_code": e.status_code,
+                    "detail": e.detail}, None, None
+        except Exception as e:
+            return {"index": index, "filename": filename, "status": "error", "status_code": 500,
+                    "detail": str(e)}, None, None
+        original_bytes = await asyncio.to_thread(spool.read_bytes) if keep_bytes else None
+        if is_degraded(metrics):
+            await asyncio.to_thread(keep_original, spool, result)
+    finally:
+        spool.close()
+
+    result.update({
+        "filename": filename,
+        "metrics": metrics,
+        "risk_score": risk_score_from(metrics),
+        "status": "done",
+        "cache_hit": cache_hit,
+        "timings": timings,
+        "near_duplicate": near,
+    })
+    if include_image:
+        result["annotated_image_base64"] = base64.b64encode(annotated_bytes).decode("ascii")
+    saved_filename = await asyncio.to_thread(save_outputs, result, annotated_bytes, graph_bytes)
+    if result.get("saved_path"):
+        result["annotated_image"] = f"/output/{saved_filename}"
+    return result, (annotated_bytes if keep_bytes else None), original_bytes
+
+
+def _store_batch(done: list) -> dict:
+    """Storage uploads and DB rows of a whole batch: one upload_many call and one executemany."""
+    items = []
+    for result, annotated_bytes, original_bytes in done:
+        items.append((annotated_bytes, f"aura_{uuid.uuid4()}", f"{result['id']}{ENCODER.ext}"))
+        items.append((original_bytes, f"orig_{uuid.uuid4()}", f"orig_{result['id']}.png"))
+    urls = upload_many(items, max_workers=STORAGE_UPLOAD_CONCURRENCY)
+
+    uploads, rows = [], []
+    for i, (result, _, _) in enumerate(done):
+        (annotated_url, annotated_error), (original_url, original_error) = urls[2 * i], urls[2 * i + 1]
+        uploads.append({"index": result["index"], "id": result["id"], "annotated_image": annotated_url,
+                        "original_image": original_url, "annotated_upload_error": annotated_error,
+                        "original_upload_error": original_error})
+        rows.append((result["id"], result["filename"], annotated_url, original_url, result.get("saved_path")))
+    summary = {"uploads": uploads}
+    try:
+        ensure_db()
+        save_image_records(rows)
+        summary["db_saved"] = True
+    except Exception as e:
+        summary["db_saved"] = False
+        summary["db_error"] = str(e)
+    return summary
+
+
+@app.post("/analyze/batch")
+async def analyze_batch(files: List[UploadFile] = File(...), upload: bool = False,
+                        callback_url: str | None = Query(None), include_image: bool = False,
+                        user_id: str | None = Query(None)):
+    """Phân tích nhiều ảnh trong một request (ví dụ 20-50 ảnh của một lần khám).
+
+    Các ảnh được phân tích song song trên analysis_pool; kết quả từng ảnh được stream về dạng
+    NDJSON (application/x-ndjson, mỗi dòng một JSON) ngay khi ảnh đó xong, nên thứ tự các dòng
+    là thứ tự hoàn thành; "index" là vị trí của file trong request. Ảnh lỗi cho một dòng
+    status=error (status_code/detail như POST /analyze) mà không làm hỏng cả batch.
+    Batch chỉ được nhận khi pool còn chỗ (nếu không: 503 + Retry-After); các ảnh của batch
+    sau đó xếp hàng chờ slot thay vì bị từ chối.
+
+    Dòng cuối cùng có status=batch_done: số ảnh thành công/lỗi và, với upload=true, kết quả
+    upload của cả batch (một lần upload_many) và một lần ghi DB (executemany).
+
+    Query params:
+      - upload=true|false: upload ảnh annotated + ảnh gốc lên storage, ghi record vào SQLite
+      - callback_url: nếu set, POST một lần {"results": [...], "summary": {...}} khi cả batch xong
+      - include_image=true: thêm annotated_image_base64 vào từng dòng (mặc định chỉ link /output/...)
+      - user_id: như POST /analyze (dùng lại kết quả của ảnh gần trùng của cùng user)
+    """
+    if len(files) > BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_FILES} files per batch")
+    if analysis_pool.full:
+        raise busy_response(PoolBusy(analysis_pool.retry_after()))
+
+    started = time.perf_counter()
+    lines, tasks = [], []
+    for index, file in enumerate(files):
+        if (file.content_type or "").split("/")[0] != "image":
+            lines.append({"index": index, "filename": file.filename, "status": "error", "status_code": 400,
+                          "detail": "File phải là ảnh"})
+            continue
+        try:
+            spool = await ingest_upload(file, UPLOAD_LIMITS, allowed=('png', 'jpeg', 'webp'),
+                                        spool_dir=UPLOAD_SPOOL_DIR)
+        except IngestError as e:
+            lines.append({"index": index, "filename": file.filename, "status": "error",
+                          "status_code": e.status_code, "detail": str(e)})
+            continue
+        # scheduled right away: analysis starts while the response is being set up
+        tasks.append(asyncio.create_task(_analyze_batch_item(index, file.filename, spool, upload, include_image,
+                                                             user_id)))
+
+    async def stream():
+        results, done = [], []
+        for line in lines:
+            yield json.dumps(line) + "\n"
+        for next_done in asyncio.as_completed(tasks):
+            line, annotated_bytes, original_bytes = await next_done
+            if line["status"] == "done":
+                results.append(line)
+                if upload:
+                    done.append((line, annotated_bytes, original_bytes))
+            else:
+                lines.append(line)
+            yield json.dumps(line) + "\n"
+
+        summary = {"status": "batch_done", "count": len(files), "succeeded": len(results),
+                   "failed": len(files) - len(results)}
+        if upload:
+            summary.update(await asyncio.to_thread(_store_batch, done))
+        summary["elapsed_ms"] = (time.perf_counter() - started) * 1000.0
+        if callback_url:
+            try:
+                await asyncio.to_thread(requests.post, callback_url,
+                                        json={"results": results + lines, "summary": summary}, timeout=5)
+                summary["callback_posted"] = True
+            except Exception as e:
+                summary["callback_error"] = str(e)
+        yield json.dumps(summary) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def _sha256_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+async def _reanalyze(analysis_id: str):
+    """Full-quality analysis of a kept original; replaces the outputs and cache entry of the degraded one."""
+    status = reanalyses[analysis_id]
+    path = original_path(analysis_id)
+    try:
+        # queued behind (not instead of) interactive requests: waits for a free slot
+        await analysis_pool.acquire()
+        status["status"] = "running"
+        try:
+            sha256 = await asyncio.to_thread(_sha256_file, path)
+            out = await analysis_pool.run(analyze_file, path, sha256, ENCODER, PRESCREEN_CONFIG, adaptive.full)
+        finally:
+            analysis_pool.release()
+        if 'rejected' in out:
+            status.update(status="error", detail=out['rejected'])
+            return
+        record_quality(out, adaptive.full)
+        images = {'annotated': out['annotated']}
+        if out['graph'] is not None:
+            images['graph'] = out['graph']
+        await asyncio.to_thread(result_cache.put, full_cache_key(sha256), out['metrics'], images)
+        result = {"id": analysis_id}
+        saved_filename = await asyncio.to_thread(save_outputs, result, out['annotated'], out['graph'])
+        status.update(status="done", metrics=out['metrics'], risk_score=risk_score_from(out['metrics']),
+                      timings=out['timings'], annotated_image=f"/output/{saved_filename}",
+                      graph_url=result.get("graph_url"))
+        await asyncio.to_thread(os.remove, path)
+    except Exception as e:
+        status.update(status="error", detail=str(e))
+
+
+@app.post("/reanalyze/{analysis_id}", status_code=202)
+async def reanalyze(analysis_id: str):
+    """Phân tích lại ở chất lượng đầy đủ một kết quả bị giảm chất lượng (metrics.quality.degraded).
+
+    Chạy nền trên analysis_pool; ảnh annotated / vessel graph của analysis_id được ghi đè khi xong.
+    Theo dõi bằng GET /reanalyze/{analysis_id} (status: queued | running | done | error).
+    """
+    analysis_id = os.path.basename(analysis_id)
+    status = reanalyses.get(analysis_id)
+    if status is not None and status["status"] != "error":
+        return status
+    if not os.path.isfile(original_path(analysis_id)):
+        raise HTTPException(status_code=404, detail="No degraded analysis with this id")
+    status = reanalyses[analysis_id] = {"id": analysis_id, "status": "queued",
+                                        "status_url": f"/reanalyze/{analysis_id}"}
+    task = asyncio.create_task(_reanalyze(analysis_id))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return status
+
+
+@app.get("/reanalyze/{analysis_id}")
+def reanalyze_status(analysis_id: str):
+    """Trạng thái phân tích lại của analysis_id (degraded: chưa yêu cầu)."""
+    analysis_id = os.path.basename(analysis_id)
+    status = reanalyses.get(analysis_id)
+    if status is not None:
+        return status
+    if os.path.isfile(original_path(analysis_id)):
+        return {"id": analysis_id, "status": "degraded"}
+    raise HTTPException(status_code=404, detail="Not found")
+
+
+@app.get("/images/{token}")
+def get_image(token: str):
+    """Ảnh của response=url; link hết hạn sau IMAGE_LINK_TTL giây."""
+    item = image_links.get(token)
+    if item is None:
+        raise HTTPException(status_code=404, detail="Image link expired or unknown")
+    data, media_type = item
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": "private, max-age=60"})
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    """Hit/miss counters and size of the analysis result cache (and of the per-stage cache)."""
+    stats = result_cache.stats()
+    stats["near_duplicates"] = near_duplicates.stats()
+    # stage caches live in the analysis workers; only the in-process (ANALYZE_WORKERS=0) one is visible here
+    stats["stages"] = PIPELINE.cache.stats() if PIPELINE.cache is not None and analysis_pool.processes <= 0 else None
+    return stats
+
+
+@app.get("/graph/{analysis_id}")
+def get_graph(analysis_id: str, segments: bool = False):
+    """Vessel graph của một lần phân tích: summary, node, và (segments=true) bảng từng đoạn mạch."""
+    path = os.path.join(OUTPUT_DIR, f"{os.path.basename(analysis_id)}.graph.npz")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    with open(path, "rb") as f:
+        graph = VesselGraph.from_bytes(f.read())
+    body = {
+        "id": analysis_id,
+        "shape": graph.shape.tolist(),
+        "summary": graph.summary(),
+        "nodes": {"yx": graph.node_yx.tolist(), "degree": graph.node_degree.tolist()},
+    }
+    if segments:
+        body["segments"] = graph.segments()
+        body["branching_angles"] = graph.branching_angles()
+    return body
+
+
 @app.get("/outputs")
 def list_outputs():
     """Liệt kê các file ảnh đã được lưu trong thư mục output."""
@@ -200,7 +699,7 @@ def list_outputs():
     out_dir = os.path.join(base_dir, "output")
     if not os.path.isdir(out_dir):
         return {"files": []}
-    files = [os.path.basename(p) for p in glob.glob(os.path.join(out_dir, "*.png"))]
+    files = [os.path.basename(p) for ext in ("*.png", "*.jpg", "*.webp") for p in glob.glob(os.path.join(out_dir, ext))]
     return {"files": files}
 
 
@@ -211,4 +710,4 @@ def get_output(filename: str):
     path = os.path.join(base_dir, "output", filename)
     if not os.path.isfile(path):
         raise HTTPException(status_code=404, detail="Not found")
-    return FileResponse(path, media_type="image/png")
+    return FileResponse(path, media_type=mimetypes.guess_type(path)[0] or "application/octet-stream")
@@ -0,0 +1,76 @@
+import argparse
+import io
+import os
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from processing import analyze_image, run_pipeline
+from ai.fov import detect_fov
+from ai.engine import analyze_image as engine_analyze_image
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def camera_frame(path: str, width: int = 1024) -> bytes:
+    """Sample fundus placed as a circular disc on a 4:3 black frame, like a fundus camera output."""
+    img = Image.open(path).convert('RGB')
+    height = width * 3 // 4
+    diameter = int(height * 0.95)
+    disc = img.resize((diameter, diameter))
+    circle = Image.new('L', disc.size, 0)
+    ImageDraw.Draw(circle).ellipse((0, 0, diameter - 1, diameter - 1), fill=255)
+    frame = Image.new('RGB', (width, height), (0, 0, 0))
+    frame.paste(disc, ((width - diameter) // 2, (height - diameter) // 2), circle)
+    out = io.BytesIO()
+    frame.save(out, format='PNG')
+    return out.getvalue()
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pixel and latency savings of field-of-view ROI cropping')
+    parser.add_argument('images', nargs='*', help='Extra fundus images (default: bundled sample)')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    inputs = [(os.path.basename(SAMPLE), open(SAMPLE, 'rb').read()),
+              ('sample on 1024x768 frame', camera_frame(SAMPLE))]
+    inputs += [(os.path.basename(p), open(p, 'rb').read()) for p in args.images]
+
+    print(f"{'image':<26} {'size':>10} {'roi':>10} {'saved':>6} "
+          f"{'frangi_full':>11} {'frangi_roi':>10} {'canny_full':>10} {'canny_roi':>9}  metrics")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, data in inputs:
+            rgb = np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+            roi = detect_fov(rgb)
+            # use_cache=False: every repeat runs all stages instead of hitting the stage cache
+            full_s = best_of(lambda: run_pipeline(data, crop_fov=False, use_cache=False), args.repeat)
+            roi_s = best_of(lambda: run_pipeline(data, crop_fov=True, use_cache=False), args.repeat)
+            full_m = analyze_image(data, crop_fov=False)[1]
+            roi_m = analyze_image(data, crop_fov=True)[1]
+            same = all(full_m[k] == roi_m[k] for k in full_m if k != 'fov')
+
+            path = os.path.join(tmp, 'input.png')
+            Image.fromarray(rgb).save(path)
+            out = os.path.join(tmp, 'annotated.png')
+            canny_full = best_of(lambda: engine_analyze_image(path, out, crop_fov=False), args.repeat)
+            canny_roi = best_of(lambda: engine_analyze_image(path, out, crop_fov=True), args.repeat)
+
+            print(f"{name[:26]:<26} {rgb.shape[1]:>4}x{rgb.shape[0]:<5} {roi.shape[1]:>4}x{roi.shape[0]:<5} "
+                  f"{roi.saved_fraction:>6.1%} {full_s * 1000:>9.0f}ms {roi_s * 1000:>8.0f}ms "
+                  f"{canny_full * 1000:>8.1f}ms {canny_roi * 1000:>7.1f}ms  {'identical' if same else 'changed'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+import argparse
+import time
+
+import numpy as np
+from PIL import Image
+
+from processing import render_overlay, DEFAULT_OVERLAY_STYLE
+
+
+def legacy_overlay(img: Image.Image, vessel_mask: np.ndarray, skeleton: np.ndarray) -> Image.Image:
+    """Per-pixel overlay loop used by analyze_image before vectorization."""
+    width, height = img.size
+    overlay = Image.new('RGBA', img.size, (0, 0, 0, 0))
+    ov_pixels = overlay.load()
+    for y in range(height):
+        for x in range(width):
+            if vessel_mask[y, x]:
+                ov_pixels[x, y] = (255, 0, 0, 120)
+            if skeleton[y, x]:
+                ov_pixels[x, y] = (0, 255, 0, 200)
+    return Image.alpha_composite(img.convert('RGBA'), overlay)
+
+
+def synthetic_inputs(size: int, seed: int = 0):
+    """Random fundus-like RGB image with ~12% vessel mask and ~2% skeleton."""
+    rng = np.random.default_rng(seed)
+    rgb = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    vessel_mask = rng.random((size, size)) < 0.12
+    skeleton = vessel_mask & (rng.random((size, size)) < 0.15)
+    return Image.fromarray(rgb, 'RGB'), vessel_mask, skeleton
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark overlay rendering: per-pixel loop vs vectorized")
+    parser.add_argument("--sizes", default="512,1024,2048", help="Comma-separated square image sizes")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is reported)")
+    args = parser.parse_args()
+
+    style = DEFAULT_OVERLAY_STYLE
+    print(f"{'size':>6} {'loop_ms':>10} {'vector_ms':>10} {'speedup':>8}  identical")
+    for size in [int(s) for s in args.sizes.split(",") if s]:
+        img, vm, sk = synthetic_inputs(size)
+        base = np.asarray(img)
+        layers = [(vm, style['mask_color'], style['mask_alpha']),
+                  (sk, style['skeleton_color'], style['skeleton_alpha'])]
+
+        t_loop = best_of(lambda: legacy_overlay(img, vm, sk), max(1, args.repeat if size <= 1024 else 1))
+        t_vec = best_of(lambda: render_overlay(base, layers), args.repeat)
+
+        same = np.array_equal(np.asarray(legacy_overlay(img, vm, sk).convert('RGB')),
+                              np.asarray(render_overlay(base, layers)))
+        print(f"{size:>6} {t_loop * 1000:>10.1f} {t_vec * 1000:>10.1f} {t_loop / t_vec:>7.0f}x  {same}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+from skimage.filters import threshold_otsu
+
+from test_topology import legacy_topology
+from topology import analyze_topology
+from vesselness import vesselness
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def best_of(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Skeleton/topology metrics: skimage+scipy chain vs topology.py')
+    parser.add_argument('--sizes', default='512,1024,2048')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    base = Image.open(SAMPLE).convert('L')
+    print(f"{'size':>6} {'vessel_px':>10} {'legacy_ms':>10} {'ours_ms':>8} {'speedup':>8}  metrics")
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        fr = vesselness(np.asarray(base.resize((size, size)), dtype=np.float32) / 255.0)
+        mask = fr > threshold_otsu(fr)
+        t_ref = best_of(lambda: legacy_topology(mask), args.repeat)
+        t_new = best_of(lambda: analyze_topology(mask), args.repeat)
+        ref, topo = legacy_topology(mask), analyze_topology(mask)
+        same = np.array_equal(ref['skeleton'], topo.skeleton) and all(
+            getattr(topo, k) == ref[k]
+            for k in ('skeleton_length', 'mean_width', 'branch_points', 'end_points', 'component_count'))
+        print(f"{size:>6} {int(mask.sum()):>10} {t_ref * 1000:>10.1f} {t_new * 1000:>8.1f} "
+              f"{t_ref / t_new:>7.1f}x  {'identical' if same else 'changed'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import time
+import tracemalloc
+
+import numpy as np
+from PIL import Image
+from skimage.filters import frangi, threshold_otsu
+
+from vesselness import vesselness
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def measure(fn, image: np.ndarray, repeat: int):
+    """Best-of-`repeat` wall time and peak traced allocation (numpy + OpenCV outputs) of fn(image)."""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(image)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    result = fn(image)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, min(times), peak
+
+
+def dice(a: np.ndarray, b: np.ndarray) -> float:
+    total = a.sum() + b.sum()
+    return 1.0 if total == 0 else 2.0 * np.logical_and(a, b).sum() / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='skimage frangi vs float32 cascaded vesselness')
+    parser.add_argument('--sizes', default='512,1024,2048')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None, help='Threads across scales (default: CPU count)')
+    args = parser.parse_args()
+
+    base = Image.open(SAMPLE).convert('L')
+    print(f"{'size':>6} {'frangi_s':>9} {'ours_s':>8} {'speedup':>8} {'frangi_MB':>10} {'ours_MB':>8} "
+          f"{'mem_ratio':>9} {'max_abs':>8} {'otsu_dice':>9}")
+    for size in [int(s) for s in args.sizes.split(',') if s]:
+        gray = np.asarray(base.resize((size, size)), dtype=np.float32) / 255.0
+        ref, t_ref, m_ref = measure(frangi, gray, args.repeat)
+        out, t_out, m_out = measure(lambda g: vesselness(g, workers=args.workers), gray, args.repeat)
+        d = dice(ref > threshold_otsu(ref), out > threshold_otsu(out))
+        print(f"{size:>6} {t_ref:>9.3f} {t_out:>8.3f} {t_ref / t_out:>7.1f}x {m_ref / 2**20:>10.1f} "
+              f"{m_out / 2**20:>8.1f} {m_ref / m_out:>8.1f}x {np.abs(ref - out).max():>8.4f} {d:>9.4f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,336 @@
+"""Offline bulk screening: run the analysis pipeline over a folder or ZIP of fundus images.
+
+    python bulk_screen.py ARCHIVE_OR_DIR -o results.parquet [--annotated-dir annotated/]
+
+- images (.png .jpg .jpeg .webp) are processed on a process pool sized to the
+  cores; each worker reads its own inputs (the ZIP is opened once per worker)
+  and writes its own annotated image, so only one small result row per image
+  crosses process boundaries
+- at most 2 x workers images are in flight and rows are flushed every
+  --flush-every images, so memory stays bounded for any archive size
+- rows are written as atomically renamed part files in RESULTS.parts/; they
+  double as the checkpoint: an interrupted run (Ctrl-C, crash, reboot)
+  continues with the images that have no row yet. When everything is done the
+  parts are compacted into RESULTS (Parquet via pyarrow, or JSON lines for a
+  .jsonl output). Re-running on a grown archive only screens the new images.
+- headers are checked before decoding (ai.ingest: size and pixel limits), and
+  images the pre-screen rejects get status 'rejected' instead of metrics
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import signal
+import sys
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path, PurePosixPath
+
+import processing
+import vesselness
+from processing import PIPELINE_VERSION, run_pipeline
+from ai.image_response import EncoderConfig
+from ai.ingest import IngestError, IngestLimits, map_file, sniff
+from ai.prescreen import PrescreenConfig, prescreen
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+GRAPH_COLUMNS = ('node_count', 'branch_node_count', 'end_node_count', 'segment_count', 'total_length_pixels',
+                 'mean_segment_length_pixels', 'mean_tortuosity', 'mean_calibre_pixels',
+                 'mean_branching_angle_degrees')
+
+# (column, arrow type name); metrics missing on the fallback pipeline / failed images are null
+COLUMNS = [
+    ('path', 'string'), ('sha256', 'string'), ('status', 'string'), ('error', 'string'),
+    ('prescreen_check', 'string'), ('width', 'int64'), ('height', 'int64'),
+    ('vessel_pixel_count', 'int64'), ('vessel_density', 'float64'), ('skeleton_length_pixels', 'int64'),
+    ('mean_vessel_width_pixels', 'float64'), ('branch_point_count', 'int64'), ('end_point_count', 'int64'),
+    ('component_count', 'int64'), ('fov_saved_fraction', 'float64'),
+] + [(f'graph_{k}', 'int64' if k.endswith('_count') else 'float64') for k in GRAPH_COLUMNS] + [
+    ('annotated_path', 'string'), ('elapsed_ms', 'float64'), ('pipeline_version', 'string'),
+]
+
+
+# ---- inputs
+
+class DirSource:
+    def __init__(self, root: Path):
+        self.root = root
+
+    def names(self):
+        return sorted(p.relative_to(self.root).as_posix() for p in self.root.rglob('*')
+                      if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS)
+
+    def open(self):
+        return self
+
+    def read(self, name: str):
+        """Context manager yielding the file contents (memory-mapped)."""
+        return map_file(self.root / name)
+
+
+class ZipSource:
+    def __init__(self, path: Path):
+        self.path = path
+        self._zip = None
+
+    def names(self):
+        with zipfile.ZipFile(self.path) as zf:
+            return sorted(i.filename for i in zf.infolist()
+                          if not i.is_dir() and PurePosixPath(i.filename).suffix.lower() in IMAGE_EXTENSIONS)
+
+    def open(self):
+        self._zip = zipfile.ZipFile(self.path)
+        return self
+
+    def read(self, name: str):
+        return _Bytes(self._zip.read(name))
+
+
+class _Bytes:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def __enter__(self):
+        return self.data
+
+    def __exit__(self, *exc):
+        self.data = None
+
+
+def open_source(path: Path):
+    if path.is_dir():
+        return DirSource(path)
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    raise SystemExit(f'{path} is neither a directory nor a ZIP archive')
+
+
+# ---- worker processes
+
+_worker = {}
+
+
+def _init_worker(source, annotated_dir, encoder, crop_fov, with_graph, use_prescreen, limits):
+    # Ctrl-C is handled by the parent, which flushes finished rows before exiting
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # one image per process; no nested thread pools competing for the same cores
+    vesselness.THREADS = 1
+    if cv2 is not None:
+        cv2.setNumThreads(1)
+    _worker.update(source=source.open(), annotated_dir=annotated_dir, encoder=encoder, crop_fov=crop_fov,
+                   with_graph=with_graph, prescreen=PrescreenConfig() if use_prescreen else None, limits=limits)
+
+
+def _annotated_path(name: str, annotated_dir: Path, ext: str) -> Path:
+    # archive member names are untrusted: keep them below annotated_dir
+    parts = [p for p in PurePosixPath(name).parts if p not in ('', '.', '..', '/')]
+    return annotated_dir.joinpath(*parts).with_suffix(ext)
+
+
+def screen_one(name: str) -> dict:
+    """Result row of one image (never raises: failures become status 'error')."""
+    w = _worker
+    row = {'path': name, 'status': 'ok', 'pipeline_version': PIPELINE_VERSION}
+    start = time.perf_counter()
+    try:
+        with w['source'].read(name) as data:
+            row['sha256'] = hashlib.sha256(data).hexdigest()
+            sniffed = sniff(data)
+            if sniffed is None or sniffed[0] == 'svg':
+                raise IngestError('Unsupported or truncated image')
+            w['limits'].check_dimensions(*sniffed[1])
+
+            if w['prescreen'] is not None:
+                screen = prescreen(data, w['prescreen'])
+                if not screen.ok:
+                    row.update(status='rejected', prescreen_check=screen.check, error=screen.reason)
+                    return row
+
+            run = run_pipeline(data, crop_fov=w['crop_fov'], with_graph=w['with_graph'], encoder=w['encoder'],
+                               image_sha256=row['sha256'], use_cache=False,
+                               annotated=w['annotated_dir'] is not None)
+        metrics = run['metrics']
+        row.update({k: metrics.get(k) for k, _ in COLUMNS if k in metrics})
+        row['fov_saved_fraction'] = metrics.get('fov', {}).get('saved_fraction')
+        graph = run.values.get('graph')
+        if graph is not None:
+            row.update({f'graph_{k}': v for k, v in graph.summary().items() if k in GRAPH_COLUMNS})
+        if w['annotated_dir'] is not None:
+            out = _annotated_path(name, w['annotated_dir'], w['encoder'].ext)
+            out.parent.mkdir(parents=True, exist_ok=True)
+            tmp = out.with_name(out.name + '.tmp')
+            tmp.write_bytes(run['encode'])
+            os.replace(tmp, out)
+            row['annotated_path'] = str(out)
+    except Exception as e:
+        row.update(status='error', error=f'{type(e).__name__}: {e}')
+    finally:
+        row['elapsed_ms'] = (time.perf_counter() - start) * 1000.0
+    return row
+
+
+# ---- results / checkpoint
+
+class ResultStore:
+    """Part files in OUTPUT.parts/ (the checkpoint), compacted into OUTPUT at the end."""
+
+    def __init__(self, output: Path):
+        self.output = output
+        self.parquet = output.suffix.lower() != '.jsonl'
+        if self.parquet and pa is None:
+            raise SystemExit('Parquet output needs pyarrow (pip install pyarrow); or use a .jsonl output')
+        self.ext = '.parquet' if self.parquet else '.jsonl'
+        self.parts_dir = output.with_name(output.name + '.parts')
+        if self.parquet:
+            self.schema = pa.schema([(name, getattr(pa, kind)()) for name, kind in COLUMNS])
+
+    def _parts(self):
+        return sorted(self.parts_dir.glob(f'part-*{self.ext}'))
+
+    def done(self) -> set:
+        """Paths that already have a row (from a previous, possibly interrupted, run)."""
+        if self.output.exists() and not self.parts_dir.exists():
+            # completed earlier run: its rows become the first part, new images are appended
+            self.parts_dir.mkdir(parents=True)
+            shutil.copyfile(self.output, self.parts_dir / f'part-00000{self.ext}')
+        done = set()
+        for part in self._parts():
+            if self.parquet:
+                done.update(pq.read_table(part, columns=['path']).column('path').to_pylist())
+            else:
+                with open(part, encoding='utf-8') as f:
+                    done.update(json.loads(line)['path'] for line in f if line.strip())
+        return done
+
+    def write(self, rows):
+        if not rows:
+            return
+        self.parts_dir.mkdir(parents=True, exist_ok=True)
+        parts = self._parts()
+        index = int(parts[-1].stem.split('-')[1]) + 1 if parts else 0
+        path = self.parts_dir / f'part-{index:05d}{self.ext}'
+        tmp = path.with_name(path.name + '.tmp')
+        if self.parquet:
+            pq.write_table(pa.Table.from_pylist(rows, schema=self.schema), tmp)
+        else:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+        os.replace(tmp, path)
+
+    def finalize(self) -> int:
+        """Compact the parts into OUTPUT one part at a time; returns the row count."""
+        parts = self._parts()
+        tmp = self.output.with_name(self.output.name + '.tmp')
+        rows = 0
+        if self.parquet:
+            with pq.ParquetWriter(tmp, self.schema) as writer:
+                for part in parts:
+                    table = pq.read_table(part, schema=self.schema)
+                    writer.write_table(table)
+                    rows += table.num_rows
+        else:
+            with open(tmp, 'wb') as out:
+                for part in parts:
+                    with open(part, 'rb') as f:
+                        data = f.read()
+                    out.write(data)
+                    rows += data.count(b'\n')
+        os.replace(tmp, self.output)
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        return rows
+
+
+# ---- driver
+
+def run(args) -> int:
+    source = open_source(Path(args.input))
+    store = ResultStore(Path(args.output))
+    names = source.names()
+    done = store.done()
+    todo = [n for n in names if n not in done]
+    print(f'{len(names)} images, {len(names) - len(todo)} already screened, {len(todo)} to go '
+          f'({args.workers} workers)')
+
+    annotated_dir = Path(args.annotated_dir) if args.annotated_dir else None
+    encoder = EncoderConfig(format=args.format, quality=args.quality)
+    limits = IngestLimits(max_pixels=int(args.max_megapixels * 1_000_000))
+    initargs = (source, annotated_dir, encoder, not args.no_crop_fov, args.with_graph, not args.no_prescreen, limits)
+
+    buffer, counts = [], {'ok': 0, 'rejected': 0, 'error': 0}
+    start = last_report = time.time()
+    pool = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=initargs)
+    try:
+        queue, pending = iter(todo), set()
+        while True:
+            # bounded window: a few images per worker in flight, never the whole archive
+            for name in queue:
+                pending.add(pool.submit(screen_one, name))
+                if len(pending) >= 2 * args.workers:
+                    break
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                row = fut.result()
+                counts[row['status']] += 1
+                buffer.append(row)
+            if len(buffer) >= args.flush_every:
+                store.write(buffer)
+                buffer = []
+            if time.time() - last_report >= args.report_every:
+                n = sum(counts.values())
+                print(f'  {n}/{len(todo)}  {n / (time.time() - start):.1f} img/s  {counts}')
+                last_report = time.time()
+    except (KeyboardInterrupt, BrokenProcessPool) as e:
+        pool.shutdown(wait=False, cancel_futures=True)
+        store.write(buffer)
+        reason = 'interrupted' if isinstance(e, KeyboardInterrupt) else f'worker crashed ({e})'
+        print(f'{reason}: {sum(counts.values())} new rows saved in {store.parts_dir}; run again to resume')
+        return 130 if isinstance(e, KeyboardInterrupt) else 1
+    pool.shutdown()
+    store.write(buffer)
+
+    total = store.finalize()
+    elapsed = time.time() - start
+    print(f'done: {sum(counts.values())} screened in {elapsed:.1f}s {counts}; {total} rows in {store.output}')
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Screen a folder or ZIP of fundus images offline')
+    parser.add_argument('input', help='Directory (searched recursively) or ZIP archive')
+    parser.add_argument('-o', '--output', default='screening.parquet',
+                        help='Result table: .parquet (pyarrow) or .jsonl')
+    parser.add_argument('--annotated-dir', help='Write annotated images here (mirrors the input layout)')
+    parser.add_argument('--format', default='png', choices=['png', 'jpeg', 'webp'], help='Annotated image format')
+    parser.add_argument('--quality', type=int, default=90, help='JPEG/WebP quality')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--flush-every', type=int, default=256, help='Rows per checkpoint part file')
+    parser.add_argument('--report-every', type=float, default=10.0, help='Seconds between progress lines')
+    parser.add_argument('--with-graph', action='store_true', help='Add vessel graph summary columns')
+    parser.add_argument('--no-crop-fov', action='store_true', help='Analyze the whole frame')
+    parser.add_argument('--no-prescreen', action='store_true', help='Skip the quality pre-screen')
+    parser.add_argument('--max-megapixels', type=float, default=50.0, help='Skip larger images (decompression bombs)')
+    args = parser.parse_args(argv)
+    args.workers = max(1, args.workers)
+    return run(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,173 +1,298 @@
 import numpy as np
-from PIL import Image, ImageFilter, ImageDraw
+from PIL import Image, ImageFilter
 import io
+import sys
+from pathlib import Path
+
+# Shared AI modules live in SRC/ai (imported as the `ai` package)
+SRC_DIR = Path(__file__).resolve().parent.parent.parent / "SRC"
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+from ai.fov import FovROI, detect_fov
+from ai.pipeline import Pipeline, PipelineRun, Stage, StageCache
+from ai.adaptive import QualityLevel
 
 # Try to import more advanced libs; if unavailable we'll fallback to simple method
 try:
-    from skimage.filters import frangi, threshold_otsu
-    from skimage.morphology import skeletonize
-    from scipy.ndimage import distance_transform_edt, convolve
-    from skimage.measure import label as sk_label
+    from skimage.filters import threshold_otsu
+    from vesselness import DEFAULT_SIGMAS, vesselness
+    from topology import analyze_topology
+    from vessel_graph import build_graph
     SKIMAGE_AVAILABLE = True
 except Exception:
     SKIMAGE_AVAILABLE = False
 
 
-def analyze_image(image_bytes: bytes):
-    """Retinal vessel segmentation and metrics.
+# Bump whenever analyze_image output changes (used to key cached results)
+PIPELINE_VERSION = "frangi-4"
 
-    If scikit-image + scipy are available this function will run a better
-    Frangi-based vessel enhancement -> threshold -> skeletonize pipeline and
-    return additional metrics:
-      - skeleton_length_pixels
-      - mean_vessel_width_pixels
-      - branch_point_count
-      - component_count
 
-    If the libraries are not available it falls back to a lightweight PIL
-    FIND_EDGES pipeline (previous implementation).
+# Default overlay colors (RGB) and alpha (0-255) for the annotated image
+DEFAULT_OVERLAY_STYLE = {
+    'mask_color': (255, 0, 0),
+    'mask_alpha': 120,
+    'skeleton_color': (0, 255, 0),
+    'skeleton_alpha': 200,
+    'edge_color': (255, 0, 0),
+    'edge_alpha': 180,
+}
 
-    Returns: (annotated_image_bytes, metrics_dict)
+
+def _blend_lut(color, alpha: int) -> np.ndarray:
+    """Per-channel lookup table for compositing a flat color over an opaque base.
+
+    Row c maps a base value to the blended value for channel c, using the same
+    rounding as PIL's Image.alpha_composite so results are pixel-identical.
     """
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    base = np.arange(256, dtype=np.uint32)
+    col = np.asarray(color, dtype=np.uint32).reshape(3, 1)
+    return ((col * alpha + base * (255 - alpha) + 127) // 255).astype(np.uint8)
+
+
+def render_overlay(base_rgb: np.ndarray, layers) -> Image.Image:
+    """Composite flat-colored mask layers over an RGB image as whole arrays.
+
+    layers: sequence of (bool_mask, (r, g, b), alpha). Later layers overwrite
+    earlier ones where they overlap, like drawing them onto one RGBA overlay
+    before a single alpha_composite.
+
+    Returns an RGB PIL image.
+    """
+    base = np.asarray(base_rgb, dtype=np.uint8)
+    # index of the topmost layer at each pixel (0 = none); later layers win
+    top = np.zeros(base.shape[:2], dtype=np.uint8)
+    tables = [np.tile(np.arange(256, dtype=np.uint8), (3, 1))]
+    for i, (mask, color, alpha) in enumerate(layers, start=1):
+        np.maximum(top, np.multiply(np.asarray(mask, dtype=bool), i, dtype=np.uint8), out=top)
+        tables.append(_blend_lut(color, int(alpha)))
+    # one table gather per channel: table[layer * 256 + base_value]
+    table = np.concatenate(tables, axis=1)
+    idx = top.astype(np.uint16) << 8
+    out = np.empty_like(base)
+    for c in range(3):
+        out[..., c] = np.take(table[c], idx | base[..., c])
+    return Image.fromarray(out, 'RGB')
+
+
+def encode_annotated(annotated: Image.Image, encoder=None) -> bytes:
+    """Encoded annotated image: PNG via PIL, or the format of an ai.image_response.EncoderConfig."""
+    if encoder is not None:
+        return encoder.encode(np.asarray(annotated), rgb=True)
+    out = io.BytesIO()
+    annotated.save(out, format='PNG')
+    return out.getvalue()
+
+
+# ---- pipeline stages (see ai.pipeline); each is cached by input hash + its parameters
+
+MAX_SIDE = 1024
+
+# Processing quality, best first (ai.adaptive picks one per request under load); fewer Frangi
+# scales drop the largest sigmas, which matter least once the image is downscaled
+QUALITY_LEVELS = (
+    QualityLevel('full', MAX_SIDE),
+    QualityLevel('reduced', 768, scales=4),
+    QualityLevel('fast', 512, scales=3),
+)
+
+
+def decode_rgb(image_bytes, max_side: int = MAX_SIDE) -> np.ndarray:
+    """RGB uint8 array of the upload, downscaled so the longest side is at most max_side."""
+    # file-like buffers (e.g. the mmap of a spooled upload) are read in place, bytes via BytesIO
+    img = Image.open(image_bytes if hasattr(image_bytes, 'read') else io.BytesIO(image_bytes)).convert("RGB")
 
     # resize for speed if large
-    max_side = 1024
     if max(img.size) > max_side:
         img = img.resize((int(img.width * max_side / max(img.size)), int(img.height * max_side / max(img.size))))
+    return np.asarray(img)
+
+
+def _fov(rgb: np.ndarray, crop_fov: bool = True) -> FovROI:
+    # region of interest: bounding box of the retina disc (whole frame if disabled)
+    return detect_fov(rgb) if crop_fov else FovROI.full(*rgb.shape[:2])
+
+
+def _vesselness(rgb: np.ndarray, roi: FovROI, scales: int | None = None) -> np.ndarray:
+    # convert to grayscale numpy array, normalized (ROI only)
+    gray = np.array(Image.fromarray(rgb).convert('L'), dtype=np.float32)[roi.slices] / 255.0
+    # vessel enhancement (float32 multi-scale Frangi, see vesselness.py); scales: smallest N sigmas
+    return vesselness(gray, sigmas=DEFAULT_SIGMAS[:scales] if scales else DEFAULT_SIGMAS)
+
+
+def _threshold(fr: np.ndarray) -> np.ndarray:
+    # threshold Frangi response with Otsu (works on floats)
+    try:
+        thr = threshold_otsu(fr)
+        vessel_mask = fr > thr
+    except Exception:
+        # fallback threshold
+        vessel_mask = fr > (np.mean(fr) * 0.5)
+    return vessel_mask.astype(bool)
+
+
+def _topology(vessel_mask: np.ndarray, min_component_size: int = 30):
+    # cleanup (drop small components), skeleton and topology metrics in one pass
+    return analyze_topology(vessel_mask, min_component_size=min_component_size)
+
+
+def _metrics(rgb: np.ndarray, roi: FovROI, topo) -> dict:
+    height, width = rgb.shape[:2]
+    vessel_pixels = int(np.sum(topo.mask))
+    return {
+        'width': width,
+        'height': height,
+        'vessel_pixel_count': vessel_pixels,
+        'vessel_density': float(vessel_pixels / (width*height)) if width*height>0 else 0.0,
+        'skeleton_length_pixels': topo.skeleton_length,
+        'mean_vessel_width_pixels': topo.mean_width,
+        'branch_point_count': topo.branch_points,
+        'end_point_count': topo.end_points,
+        'component_count': topo.component_count,
+        'fov': roi.to_dict(),
+    }
 
-    width, height = img.size
-
-    if SKIMAGE_AVAILABLE:
-        # convert to grayscale numpy array, normalized
-        gray = np.array(img.convert('L'), dtype=np.float32) / 255.0
-
-        # vessel enhancement (Frangi) - returns float image
-        try:
-            fr = frangi(gray)
-        except Exception:
-            fr = frangi(gray, scale_range=(1,8), scale_step=2)
-
-        # threshold Frangi response with Otsu (works on floats)
-        try:
-            thr = threshold_otsu(fr)
-            vessel_mask = fr > thr
-        except Exception:
-            # fallback threshold
-            vessel_mask = fr > (np.mean(fr) * 0.5)
-
-        vessel_mask = vessel_mask.astype(bool)
-
-        # cleanup small objects by simple labeling (remove very small components)
-        try:
-            comps = sk_label(vessel_mask)
-            counts = np.bincount(comps.ravel())
-            # keep components larger than small_thresh pixels
-            small_thresh = 30
-            keep = np.zeros_like(counts, dtype=bool)
-            keep_size = counts > small_thresh
-            keep[keep_size] = True
-            keep[0] = False
-            nice = keep[comps]
-            vessel_mask = nice
-        except Exception:
-            pass
-
-        # skeletonize
-        skeleton = skeletonize(vessel_mask)
-
-        # skeleton length (in pixels)
-        skeleton_length = int(np.sum(skeleton))
-
-        # distance transform on vessel mask to get radius at each vessel pixel
-        dist = distance_transform_edt(vessel_mask)
-        # measure radius at skeleton points
-        radii_on_skel = dist[skeleton]
-        if radii_on_skel.size > 0:
-            mean_width = float(np.mean(radii_on_skel) * 2.0)
-        else:
-            mean_width = 0.0
-
-        # branch points: count skeleton pixels with >=3 neighbors
-        kernel = np.array([[1,1,1],[1,0,1],[1,1,1]], dtype=np.int32)
-        neigh = convolve(skeleton.astype(np.int32), kernel, mode='constant', cval=0)
-        branch_points = int(np.sum((skeleton) & (neigh >= 3)))
-        end_points = int(np.sum((skeleton) & (neigh == 1)))
-
-        # component count
-        try:
-            comp_count = int(np.max(sk_label(vessel_mask)))
-        except Exception:
-            comp_count = int(np.sum(vessel_mask))
-
-        # create annotated overlay: mask in red, skeleton in green
-        overlay = Image.new('RGBA', img.size, (0,0,0,0))
-        ov_pixels = overlay.load()
-        vm = vessel_mask
-        sk = skeleton
-        for y in range(height):
-            for x in range(width):
-                if vm[y, x] if vm.shape[0]==height else vm[x,y]:
-                    # vessel mask -> red with alpha
-                    ov_pixels[x,y] = (255,0,0,120)
-                if sk[y, x] if sk.shape[0]==height else sk[x,y]:
-                    # skeleton -> bright green (overwrite)
-                    ov_pixels[x,y] = (0,255,0,200)
-
-        annotated = Image.alpha_composite(img.convert('RGBA'), overlay)
-
-        # prepare bytes
-        out = io.BytesIO()
-        annotated.save(out, format='PNG')
-        annotated_bytes = out.getvalue()
-
-        metrics = {
-            'width': width,
-            'height': height,
-            'vessel_pixel_count': int(np.sum(vessel_mask)),
-            'vessel_density': float(np.sum(vessel_mask) / (width*height)) if width*height>0 else 0.0,
-            'skeleton_length_pixels': skeleton_length,
-            'mean_vessel_width_pixels': mean_width,
-            'branch_point_count': branch_points,
-            'end_point_count': end_points,
-            'component_count': comp_count
-        }
-
-        return annotated_bytes, metrics
 
+def _render(rgb: np.ndarray, roi: FovROI, topo, overlay_style: dict | None = None) -> np.ndarray:
+    # annotated overlay: mask in red, skeleton in green (skeleton wins)
+    style = {**DEFAULT_OVERLAY_STYLE, **(overlay_style or {})}
+    return np.asarray(render_overlay(rgb, [
+        (roi.paste(topo.mask), style['mask_color'], style['mask_alpha']),
+        (roi.paste(topo.skeleton), style['skeleton_color'], style['skeleton_alpha']),
+    ]))
+
+
+def _graph(rgb: np.ndarray, roi: FovROI, topo):
+    return build_graph(topo, origin=(roi.y0, roi.x0), shape=rgb.shape[:2])
+
+
+def _edges(rgb: np.ndarray, roi: FovROI) -> np.ndarray:
     # Fallback: original simple method
-    gray = img.convert("L")
+    gray = Image.fromarray(rgb).convert("L").crop((roi.x0, roi.y0, roi.x1, roi.y1))
 
     # simple edge detection: use PIL's FIND_EDGES and a median filter
     edges = gray.filter(ImageFilter.FIND_EDGES)
     edges = edges.filter(ImageFilter.MedianFilter(size=3))
 
     # threshold
-    bw = edges.point(lambda p: 255 if p > 30 else 0)
-
-    # create annotated overlay (red) where edges found
-    overlay = Image.new("RGBA", img.size, (0,0,0,0))
-    draw = ImageDraw.Draw(overlay)
-    pixels = bw.load()
-    vessel_pixels = 0
-    for y in range(height):
-        for x in range(width):
-            if pixels[x,y] > 0:
-                draw.point((x,y), fill=(255,0,0,180))
-                vessel_pixels += 1
-
-    annotated = Image.alpha_composite(img.convert("RGBA"), overlay)
-
-    # prepare bytes
-    out = io.BytesIO()
-    annotated.save(out, format="PNG")
-    annotated_bytes = out.getvalue()
+    return np.asarray(edges) > 30
 
-    metrics = {
+
+def _edge_metrics(rgb: np.ndarray, roi: FovROI, bw: np.ndarray) -> dict:
+    height, width = rgb.shape[:2]
+    vessel_pixels = int(np.count_nonzero(bw))
+    return {
         "width": width,
         "height": height,
         "vessel_pixel_count": vessel_pixels,
-        "vessel_density": vessel_pixels / (width*height)
+        "vessel_density": vessel_pixels / (width*height),
+        "fov": roi.to_dict(),
     }
 
-    return annotated_bytes, metrics
+
+def _edge_render(rgb: np.ndarray, roi: FovROI, bw: np.ndarray, overlay_style: dict | None = None) -> np.ndarray:
+    # annotated overlay (red) where edges found
+    style = {**DEFAULT_OVERLAY_STYLE, **(overlay_style or {})}
+    return np.asarray(render_overlay(rgb, [(roi.paste(bw), style['edge_color'], style['edge_alpha'])]))
+
+
+def _encode(annotated: np.ndarray, encoder=None) -> bytes:
+    return encode_annotated(Image.fromarray(annotated), encoder)
+
+
+if SKIMAGE_AVAILABLE:
+    STAGES = [
+        Stage('decode', decode_rgb, ('image',), params=('max_side',)),
+        Stage('fov', _fov, ('decode',), params=('crop_fov',)),
+        Stage('vesselness', _vesselness, ('decode', 'fov'), params=('scales',)),
+        Stage('threshold', _threshold, ('vesselness',)),
+        Stage('topology', _topology, ('threshold',), params=('min_component_size',)),
+        Stage('metrics', _metrics, ('decode', 'fov', 'topology')),
+        Stage('render', _render, ('decode', 'fov', 'topology'), params=('overlay_style',)),
+        Stage('encode', _encode, ('render',), params=('encoder',)),
+        Stage('graph', _graph, ('decode', 'fov', 'topology')),
+    ]
+else:
+    STAGES = [
+        Stage('decode', decode_rgb, ('image',), params=('max_side',)),
+        Stage('fov', _fov, ('decode',), params=('crop_fov',)),
+        Stage('edges', _edges, ('decode', 'fov')),
+        Stage('metrics', _edge_metrics, ('decode', 'fov', 'edges')),
+        Stage('render', _edge_render, ('decode', 'fov', 'edges'), params=('overlay_style',)),
+        Stage('encode', _encode, ('render',), params=('encoder',)),
+    ]
+
+# Stage outputs of recent images (STAGE_CACHE_MB, default 256; 0 disables)
+PIPELINE = Pipeline(STAGES, sources=('image',), cache=StageCache.from_env(), name=PIPELINE_VERSION)
+
+
+def run_pipeline(image_bytes, overlay_style: dict | None = None, crop_fov: bool = True,
+                 with_graph: bool = False, encoder=None, image_sha256: str | None = None,
+                 use_cache: bool = True, annotated: bool = True, quality: QualityLevel | None = None) -> PipelineRun:
+    """Run the analysis stage graph; the PipelineRun holds 'encode', 'metrics' (and 'graph')
+    plus per-stage timings. image_sha256 skips re-hashing an upload hashed while streaming.
+    annotated=False skips rendering and encoding (metrics only, no 'encode').
+    quality (one of QUALITY_LEVELS) sets the processing resolution and Frangi scales
+    (metrics width/height are the resolution actually processed). Default: full quality."""
+    outputs = ['encode', 'metrics'] if annotated else ['metrics']
+    if with_graph and SKIMAGE_AVAILABLE:
+        outputs.append('graph')
+    params = {'crop_fov': crop_fov, 'overlay_style': overlay_style, 'encoder': encoder}
+    if quality is not None:
+        params.update(max_side=quality.max_side, scales=quality.scales)
+    return PIPELINE.run({'image': image_bytes}, params, outputs=outputs,
+                        source_keys={'image': image_sha256} if image_sha256 else None, use_cache=use_cache)
+
+
+def unpack_run(run: PipelineRun, with_graph: bool = False):
+    """analyze_image's return value from a run_pipeline result."""
+    # the stage cache keeps the metrics dict; callers get their own copy to extend
+    metrics = dict(run['metrics'])
+    if not with_graph:
+        return run['encode'], metrics
+    graph = run.values.get('graph')
+    if graph is not None:
+        metrics['vessel_graph'] = graph.summary()
+    return run['encode'], metrics, graph
+
+
+def analyze_image(image_bytes: bytes, overlay_style: dict | None = None, crop_fov: bool = True,
+                  with_graph: bool = False, encoder=None):
+    """Retinal vessel segmentation and metrics.
+
+    If scikit-image + scipy are available this function will run a better
+    Frangi-based vessel enhancement (vesselness.py) -> threshold -> skeleton/topology
+    (topology.py) pipeline and return additional metrics:
+      - skeleton_length_pixels
+      - mean_vessel_width_pixels
+      - branch_point_count
+      - component_count
+
+    If the libraries are not available it falls back to a lightweight PIL
+    FIND_EDGES pipeline (previous implementation).
+
+    The steps are stages of PIPELINE (ai.pipeline): stage outputs are cached
+    per image, so a call that only changes overlay_style or encoder re-runs
+    rendering/encoding and reuses the segmentation; metrics and rendering run
+    in parallel. run_pipeline + unpack_run also give per-stage timings.
+
+    overlay_style overrides entries of DEFAULT_OVERLAY_STYLE (colors/alpha of
+    the annotated overlay).
+
+    With crop_fov (default) segmentation and metrics run only inside the
+    bounding box of the retina disc (ai.fov.detect_fov); masks are pasted back
+    into the full frame for the overlay. metrics['fov'] reports the box and the
+    share of pixels skipped.
+
+    With with_graph the skeleton is also converted to a vessel graph
+    (vessel_graph.build_graph, full-frame coordinates); metrics['vessel_graph']
+    holds its summary and the graph is returned as a third element (None on
+    the fallback pipeline).
+
+    encoder (ai.image_response.EncoderConfig) sets the annotated image format;
+    default PNG via PIL.
+
+    image_bytes may be bytes or a file-like buffer such as an mmap.
+
+    Returns: (annotated_image_bytes, metrics_dict[, VesselGraph])
+    """
+    return unpack_run(run_pipeline(image_bytes, overlay_style, crop_fov, with_graph, encoder), with_graph)
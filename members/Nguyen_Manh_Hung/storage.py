@@ -1,6 +1,7 @@
 import os
 import io
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 import uuid
 
 try:
@@ -51,11 +52,12 @@ def upload_to_cloudinary(image_bytes: bytes, public_id: Optional[str] = None) ->
     return url
 
 
-def upload_to_supabase(image_bytes: bytes, path: str, bucket: Optional[str] = None) -> str:
+def upload_to_supabase(image_bytes: bytes, path: str, bucket: Optional[str] = None, client=None) -> str:
     """Upload bytes to Supabase Storage using supabase-py.
 
     Requires environment variables SUPABASE_URL and SUPABASE_KEY and a bucket name.
     Returns a public URL (if bucket is public) or the object path.
+    client: an existing supabase client (upload_many creates one per batch).
     """
     if not SUPABASE_PY_AVAILABLE:
         raise RuntimeError("supabase package not available; install with 'pip install supabase'")
@@ -67,7 +69,8 @@ def upload_to_supabase(image_bytes: bytes, path: str, bucket: Optional[str] = No
     if not supabase_url or not supabase_key or not supabase_bucket:
         raise RuntimeError("Missing SUPABASE_URL, SUPABASE_KEY or SUPABASE_BUCKET environment variables")
 
-    client = create_client(supabase_url, supabase_key)
+    if client is None:
+        client = create_client(supabase_url, supabase_key)
 
     try:
         # if path includes folders ensure normalized
@@ -92,6 +95,26 @@ def upload_to_supabase(image_bytes: bytes, path: str, bucket: Optional[str] = No
         return path
 
 
+def _provider_order() -> List[str]:
+    """Providers to try, in order: Supabase first when configured, then Cloudinary."""
+    supabase_configured = SUPABASE_PY_AVAILABLE and os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY") and (os.getenv("SUPABASE_BUCKET") is not None)
+    cloudinary_configured = cloudinary is not None and (os.getenv("CLOUDINARY_URL") or (os.getenv("CLOUDINARY_CLOUD_NAME") and os.getenv("CLOUDINARY_API_KEY") and os.getenv("CLOUDINARY_API_SECRET")))
+
+    providers = []
+    if supabase_configured:
+        providers.append('supabase')
+    if cloudinary_configured:
+        providers.append('cloudinary')
+
+    # If none configured, still try whichever client is installed (to give clear errors)
+    if not providers:
+        if SUPABASE_PY_AVAILABLE:
+            providers.append('supabase')
+        if cloudinary is not None:
+            providers.append('cloudinary')
+    return providers
+
+
 def upload_if_configured(image_bytes: bytes, public_id: str = None, filename: str = None) -> str:
     """Upload image bytes to a configured provider and return a public URL.
 
@@ -109,22 +132,7 @@ def upload_if_configured(image_bytes: bytes, public_id: str = None, filename: st
         filename = public_id or f"aura_{uuid.uuid4()}.png"
     path = filename.lstrip("/")
 
-    # Decide preferred order: prefer Supabase when env configured
-    supabase_configured = SUPABASE_PY_AVAILABLE and os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY") and (os.getenv("SUPABASE_BUCKET") is not None)
-    cloudinary_configured = cloudinary is not None and (os.getenv("CLOUDINARY_URL") or (os.getenv("CLOUDINARY_CLOUD_NAME") and os.getenv("CLOUDINARY_API_KEY") and os.getenv("CLOUDINARY_API_SECRET")))
-
-    providers = []
-    if supabase_configured:
-        providers.append('supabase')
-    if cloudinary_configured:
-        providers.append('cloudinary')
-
-    # If none configured, still try whichever client is installed (to give clear errors)
-    if not providers:
-        if SUPABASE_PY_AVAILABLE:
-            providers.append('supabase')
-        if cloudinary is not None:
-            providers.append('cloudinary')
+    providers = _provider_order()
 
     # Attempt providers in order
     for p in providers:
@@ -139,3 +147,43 @@ def upload_if_configured(image_bytes: bytes, public_id: str = None, filename: st
 
     # If we reached here, all attempts failed
     raise RuntimeError("All storage upload attempts failed: " + "; ".join(errors))
+
+
+def upload_many(items: List[Tuple[bytes, Optional[str], Optional[str]]], max_workers: int = 4) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Upload a batch of (image_bytes, public_id, filename); returns (url, error) per item, in order.
+
+    Provider selection and client setup (Supabase client, Cloudinary config) happen once
+    for the whole batch instead of once per image; the uploads then run concurrently on
+    max_workers threads. Each item falls back to the next provider like upload_if_configured.
+    """
+    if not items:
+        return []
+    providers = _provider_order()
+    supabase_client = None
+    if 'supabase' in providers and os.getenv("SUPABASE_URL") and os.getenv("SUPABASE_KEY"):
+        try:
+            supabase_client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+        except Exception:
+            supabase_client = None
+    if 'cloudinary' in providers:
+        try:
+            cloudinary.config(secure=True)
+        except Exception:
+            pass
+
+    def one(item):
+        image_bytes, public_id, filename = item
+        path = (filename or public_id or f"aura_{uuid.uuid4()}.png").lstrip("/")
+        errors = []
+        for p in providers:
+            try:
+                if p == 'supabase':
+                    return upload_to_supabase(image_bytes, path, client=supabase_client), None
+                elif p == 'cloudinary':
+                    return upload_to_cloudinary(image_bytes, public_id=public_id), None
+            except Exception as e:
+                errors.append(f"{p} error: {e}")
+        return None, "All storage upload attempts failed: " + "; ".join(errors)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        return list(pool.map(one, items))
@@ -0,0 +1,71 @@
+"""Tests for latency-SLA adaptive quality: level choice under load, degraded results, re-analysis.
+
+Run with: python -m pytest -q test_adaptive.py
+"""
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as service
+from ai.adaptive import AdaptiveQuality
+from analysis_pool import AnalysisPool
+from processing import QUALITY_LEVELS
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def test_choice_follows_queue_depth():
+    full, reduced, fast = QUALITY_LEVELS
+    controller = AdaptiveQuality(QUALITY_LEVELS, target_p95_ms=1000)
+    # nothing observed yet: full quality
+    assert controller.choose(queue_depth=10) == full
+    controller.record(full, 800.0)
+    assert controller.choose(queue_depth=0) == full
+    # one analysis ahead: full would take ~1600 ms, reduced (extrapolated by cost) ~720 ms
+    assert controller.choose(queue_depth=1) == reduced
+    assert controller.choose(queue_depth=2) == fast
+    # nothing meets the target: the cheapest level
+    assert controller.choose(queue_depth=50) == fast
+    # more workers drain the queue faster
+    assert controller.choose(queue_depth=2, workers=2) == reduced
+    assert AdaptiveQuality(QUALITY_LEVELS).choose(queue_depth=50) == full
+
+
+@pytest.fixture
+def degraded(monkeypatch):
+    pool = AnalysisPool(processes=0, max_pending=2, stage_cache_bytes=0)
+    controller = AdaptiveQuality(QUALITY_LEVELS, target_p95_ms=1)
+    # a slow full-quality history makes every request take the cheapest level
+    controller.record(QUALITY_LEVELS[0], 10000.0)
+    monkeypatch.setattr(service, 'analysis_pool', pool)
+    monkeypatch.setattr(service, 'adaptive', controller)
+    monkeypatch.setattr(service, 'result_cache', service.ResultCache(memory_max_entries=8))
+    yield controller
+    pool.shutdown()
+
+
+def test_degraded_result_is_reanalyzed_at_full_quality(degraded):
+    with TestClient(service.app) as client, open(SAMPLE, 'rb') as f:
+        data = f.read()
+        body = client.post('/analyze', files={'file': ('a.png', data, 'image/png')}).json()
+        quality = body['metrics']['quality']
+        assert (quality['name'], quality['degraded']) == ('fast', True)
+        assert client.get(body['reanalyze_url']).json()['status'] == 'degraded'
+
+        r = client.post(body['reanalyze_url'])
+        assert r.status_code == 202
+        deadline = time.time() + 60
+        while (status := client.get(body['reanalyze_url']).json())['status'] in ('queued', 'running'):
+            assert time.time() < deadline
+            time.sleep(0.05)
+        assert status['status'] == 'done'
+        assert status['metrics']['quality'] == {'name': 'full', 'max_side': 1024, 'scales': None, 'degraded': False}
+        assert not os.path.exists(service.original_path(body['id']))
+
+        # the full-quality result now answers the same upload, whatever the load
+        again = client.post('/analyze', files={'file': ('a.png', data, 'image/png')}).json()
+        assert again['cache_hit'] and not again['metrics']['quality']['degraded']
+        assert 'reanalyze_url' not in again
+        assert client.get('/health').json()['adaptive']['levels']['full']['samples'] == 2
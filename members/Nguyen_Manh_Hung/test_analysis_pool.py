@@ -0,0 +1,57 @@
+"""Tests for the analysis process pool: results from worker processes, 503 when full.
+
+Run with: python -m pytest -q test_analysis_pool.py
+"""
+import os
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app as service
+from analysis_pool import AnalysisPool, PoolBusy
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = AnalysisPool(processes=1, max_pending=1, stage_cache_bytes=0)
+    monkeypatch.setattr(service, 'analysis_pool', pool)
+    monkeypatch.setattr(service, 'result_cache', service.ResultCache(memory_max_entries=8))
+    yield pool
+    pool.shutdown()
+
+
+def test_analysis_runs_in_worker_process(pool):
+    client = TestClient(service.app)
+    with open(SAMPLE, 'rb') as f:
+        r = client.post('/analyze', files={'file': ('a.png', f.read(), 'image/png')})
+    assert r.status_code == 200
+    body = r.json()
+    assert body['metrics']['vessel_pixel_count'] > 0
+    assert body['timings']['stages']
+    stats = client.get('/health').json()['analysis']
+    assert (stats['mode'], stats['completed'], stats['pending']) == ('process', 1, 0)
+
+
+def test_full_pool_returns_503_and_health_stays_fast(pool):
+    client = TestClient(service.app)
+    pool.try_acquire()
+    try:
+        with pytest.raises(PoolBusy):
+            pool.try_acquire()
+        with open(SAMPLE, 'rb') as f:
+            r = client.post('/analyze', files={'file': ('a.png', f.read(), 'image/png')})
+        assert r.status_code == 503
+        assert int(r.headers['Retry-After']) >= 1
+        r = client.post('/analyze/batch', files=[('files', ('a.png', b'x', 'image/png'))])
+        assert r.status_code == 503
+
+        t0 = time.perf_counter()
+        health = client.get('/health').json()
+        assert time.perf_counter() - t0 < 0.5
+        assert health['analysis']['pending'] == 1
+        assert health['analysis']['rejected'] >= 2
+    finally:
+        pool.release()
@@ -0,0 +1,60 @@
+"""Tests for POST /analyze/batch (NDJSON streaming) and the batched DB write.
+
+Run with: python -m pytest -q test_analyze_batch.py
+"""
+import json
+import os
+import sqlite3
+
+from fastapi.testclient import TestClient
+
+import app as service
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+client = TestClient(service.app)
+
+
+def test_batch_streams_one_line_per_file():
+    with open(SAMPLE, 'rb') as f:
+        sample = f.read()
+    files = [
+        ('files', ('a.png', sample, 'image/png')),
+        ('files', ('notes.txt', b'hello', 'text/plain')),
+        ('files', ('b.png', sample, 'image/png')),
+        ('files', ('broken.png', b'\x89PNG\r\n\x1a\n' + b'\0' * 64, 'image/png')),
+    ]
+    r = client.post('/analyze/batch', files=files)
+    assert r.status_code == 200
+    assert r.headers['content-type'].startswith('application/x-ndjson')
+    lines = [json.loads(line) for line in r.text.splitlines()]
+
+    summary = lines.pop()
+    assert summary['status'] == 'batch_done'
+    assert (summary['count'], summary['succeeded'], summary['failed']) == (4, 2, 2)
+    by_index = {line['index']: line for line in lines}
+    assert sorted(by_index) == [0, 1, 2, 3]
+    assert by_index[1]['status_code'] == 400
+    assert by_index[3]['status'] == 'error'
+    a, b = by_index[0], by_index[2]
+    assert a['status'] == b['status'] == 'done'
+    assert a['metrics']['vessel_pixel_count'] == b['metrics']['vessel_pixel_count']
+    assert a['annotated_image'].startswith('/output/') and 'annotated_image_base64' not in a
+    assert client.get(a['annotated_image']).status_code == 200
+
+
+def test_batch_file_limit(monkeypatch):
+    monkeypatch.setattr(service, 'BATCH_MAX_FILES', 1)
+    files = [('files', (f'{i}.png', b'x', 'image/png')) for i in range(2)]
+    assert client.post('/analyze/batch', files=files).status_code == 413
+
+
+def test_save_image_records_in_one_transaction(tmp_path):
+    db = str(tmp_path / 'storage.db')
+    service.ensure_db(db)
+    rows = [(f'id{i}', f'{i}.png', None, f'https://x/{i}', None) for i in range(3)]
+    service.save_image_records(rows, db)
+    service.save_image_record('id1', '1.png', 'https://x/a1', None, 'out/1.png', db)
+    with sqlite3.connect(db) as conn:
+        stored = dict(conn.execute('SELECT id, annotated_url FROM images').fetchall())
+    assert stored == {'id0': None, 'id1': 'https://x/a1', 'id2': None}
@@ -0,0 +1,81 @@
+"""Tests for the offline bulk screening CLI (bulk_screen.py).
+
+Run with: python -m pytest -q test_bulk_screen.py
+"""
+import json
+import os
+import shutil
+import zipfile
+
+import pyarrow.parquet as pq
+
+import bulk_screen
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def make_input(root):
+    (root / 'sub').mkdir(parents=True)
+    shutil.copy(SAMPLE, root / 'a.png')
+    shutil.copy(SAMPLE, root / 'sub' / 'b.png')
+    (root / 'broken.jpg').write_bytes(b'\xff\xd8\xff\xe0 not really a jpeg')
+    (root / 'notes.txt').write_text('ignored')
+
+
+def screen(input_path, output, *extra):
+    return bulk_screen.main([str(input_path), '-o', str(output), '--workers', '2', '--no-prescreen', *extra])
+
+
+def rows(output):
+    return {r['path']: r for r in pq.read_table(output).to_pylist()}
+
+
+def test_directory_rows_and_annotated(tmp_path):
+    make_input(tmp_path / 'in')
+    out = tmp_path / 'res.parquet'
+    assert screen(tmp_path / 'in', out, '--annotated-dir', str(tmp_path / 'ann'), '--format', 'jpeg') == 0
+    result = rows(out)
+    assert sorted(result) == ['a.png', 'broken.jpg', 'sub/b.png']
+    assert result['broken.jpg']['status'] == 'error'
+    a, b = result['a.png'], result['sub/b.png']
+    assert a['status'] == b['status'] == 'ok'
+    assert a['sha256'] == b['sha256']
+    assert a['vessel_pixel_count'] == b['vessel_pixel_count'] > 0
+    assert (a['width'], a['height']) == (300, 284)
+    assert (tmp_path / 'ann' / 'sub' / 'b.jpg').read_bytes()[:2] == b'\xff\xd8'
+    assert not (tmp_path / 'res.parquet.parts').exists()
+
+
+def test_resume_screens_only_new_images(tmp_path):
+    make_input(tmp_path / 'in')
+    out = tmp_path / 'res.parquet'
+    assert screen(tmp_path / 'in', out) == 0
+    first = rows(out)
+
+    # nothing new: rows are kept as they were
+    assert screen(tmp_path / 'in', out) == 0
+    assert rows(out) == first
+
+    # an interrupted run left part files behind; only the missing images are screened
+    shutil.copy(SAMPLE, tmp_path / 'in' / 'c.png')
+    store = bulk_screen.ResultStore(out)
+    store.done()
+    os.remove(out)
+    assert screen(tmp_path / 'in', out) == 0
+    result = rows(out)
+    assert sorted(result) == ['a.png', 'broken.jpg', 'c.png', 'sub/b.png']
+    assert result['a.png']['elapsed_ms'] == first['a.png']['elapsed_ms']
+
+
+def test_zip_input_and_jsonl(tmp_path):
+    make_input(tmp_path / 'in')
+    archive = tmp_path / 'in.zip'
+    with zipfile.ZipFile(archive, 'w') as zf:
+        for p in (tmp_path / 'in').rglob('*'):
+            zf.write(p, p.relative_to(tmp_path / 'in').as_posix())
+    out = tmp_path / 'res.jsonl'
+    assert screen(archive, out) == 0
+    result = {r['path']: r for r in map(json.loads, out.read_text(encoding='utf-8').splitlines())}
+    assert sorted(result) == ['a.png', 'broken.jpg', 'sub/b.png']
+    assert result['a.png']['status'] == result['sub/b.png']['status'] == 'ok'
+    assert result['broken.jpg']['status'] == 'error'
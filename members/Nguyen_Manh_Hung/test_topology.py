@@ -0,0 +1,77 @@
+"""Regression tests: topology.analyze_topology vs the previous skimage/scipy metric chain.
+
+Run with: python -m pytest -q test_topology.py
+"""
+import os
+
+import numpy as np
+import pytest
+from scipy.ndimage import convolve, distance_transform_edt, gaussian_filter
+from skimage.measure import label as sk_label
+from skimage.morphology import skeletonize
+
+import topology
+from processing import analyze_image
+from topology import analyze_topology
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def legacy_topology(vessel_mask, small_thresh=30):
+    """The metric chain processing.analyze_image used before topology.py."""
+    comps = sk_label(vessel_mask)
+    keep = np.bincount(comps.ravel()) > small_thresh
+    keep[0] = False
+    mask = keep[comps]
+    skeleton = skeletonize(mask)
+    radii = distance_transform_edt(mask)[skeleton]
+    kernel = np.array([[1, 1, 1], [1, 0, 1], [1, 1, 1]], dtype=np.int32)
+    neigh = convolve(skeleton.astype(np.int32), kernel, mode='constant', cval=0)
+    return {
+        'mask': mask,
+        'skeleton': skeleton,
+        'skeleton_length': int(np.sum(skeleton)),
+        'mean_width': float(np.mean(radii) * 2.0) if radii.size > 0 else 0.0,
+        'branch_points': int(np.sum(skeleton & (neigh >= 3))),
+        'end_points': int(np.sum(skeleton & (neigh == 1))),
+        'component_count': int(np.max(sk_label(mask))),
+    }
+
+
+def random_masks(count=40, seed=0):
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        shape = tuple(int(v) for v in rng.integers(20, 160, 2))
+        field = gaussian_filter(rng.random(shape), rng.uniform(0.7, 4))
+        yield field > np.quantile(field, rng.uniform(0.3, 0.9))
+
+
+def assert_same(topo, ref):
+    assert np.array_equal(topo.mask, ref['mask'])
+    assert np.array_equal(topo.skeleton, ref['skeleton'])
+    for key in ('skeleton_length', 'mean_width', 'branch_points', 'end_points', 'component_count'):
+        assert getattr(topo, key) == ref[key], key
+
+
+@pytest.mark.parametrize('backend', ['cv2', 'scipy'])
+def test_matches_legacy_on_random_masks(backend, monkeypatch):
+    if backend == 'scipy':
+        # exercise the fallback used when OpenCV is not installed
+        monkeypatch.setattr(topology, 'cv2', None)
+    for mask in random_masks():
+        assert_same(analyze_topology(mask), legacy_topology(mask))
+
+
+def test_edge_cases():
+    for mask in (np.zeros((8, 8), bool), np.ones((8, 8), bool), np.ones((1, 40), bool), np.eye(50, dtype=bool)):
+        assert_same(analyze_topology(mask), legacy_topology(mask))
+
+
+def test_sample_metrics_unchanged():
+    metrics = analyze_image(open(SAMPLE, 'rb').read())[1]
+    assert metrics['vessel_pixel_count'] == 3490
+    assert metrics['skeleton_length_pixels'] == 1763
+    assert metrics['mean_vessel_width_pixels'] == 2.1564616255943516
+    assert metrics['branch_point_count'] == 24
+    assert metrics['end_point_count'] == 47
+    assert metrics['component_count'] == 20
@@ -0,0 +1,73 @@
+"""Tests for vessel_graph.build_graph and its serialised form.
+
+Run with: python -m pytest -q test_vessel_graph.py
+"""
+import os
+
+import cv2
+import numpy as np
+
+from processing import analyze_image
+from topology import analyze_topology
+from vessel_graph import VesselGraph, build_graph
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vong_mac1-300x284.png')
+
+
+def y_shape(size=200):
+    """Three straight 3 px vessels meeting at the centre: up, down-left and down-right."""
+    img = np.zeros((size, size), np.uint8)
+    c = size // 2
+    for end in ((c, 10), (20, size - 20), (size - 20, size - 20)):
+        cv2.line(img, (c, c), end, 1, 3)
+    return img.astype(bool)
+
+
+def test_y_shape():
+    graph = build_graph(analyze_topology(y_shape()))
+    summary = graph.summary()
+    assert summary['branch_node_count'] == 1
+    assert summary['end_node_count'] == 3
+    assert summary['segment_count'] == 3
+    branch = int(np.flatnonzero(graph.node_degree == 3)[0])
+    assert (graph.edge_nodes == branch).any(axis=1).all()
+    # straight vessels: tortuosity ~1, calibre ~ drawn thickness, angles 135 / 135 / 90 degrees
+    assert np.all(np.abs(graph.edge_tortuosity - 1.0) < 0.01)
+    assert np.all(np.abs(graph.edge_calibre - 5.0) < 1.5)
+    assert graph.angles.size == 3
+    assert np.all(np.abs(np.sort(graph.angles) - [90.0, 135.0, 135.0]) < 4.0)
+    assert (graph.edge_length >= graph.edge_chord).all()
+
+
+def test_ring_has_one_edge_without_nodes():
+    img = np.zeros((60, 60), np.uint8)
+    cv2.circle(img, (30, 30), 20, 1, 2)
+    graph = build_graph(analyze_topology(img.astype(bool)))
+    assert graph.node_count == 0 and graph.edge_count == 1
+    assert (graph.edge_nodes == -1).all()
+    assert np.isnan(graph.edge_tortuosity[0])
+    assert 2 * np.pi * 20 < graph.edge_length[0] < 2 * np.pi * 20 * 1.1
+
+
+def test_crop_origin_and_round_trip():
+    mask = y_shape()
+    full = build_graph(analyze_topology(np.pad(mask, ((30, 0), (50, 0)))))
+    crop = build_graph(analyze_topology(mask), origin=(30, 50), shape=(230, 250))
+    loaded = VesselGraph.from_bytes(crop.to_bytes())
+    for name in ('node_yx', 'edge_nodes', 'edge_ptr', 'edge_pixels', 'edge_length', 'angles'):
+        assert np.array_equal(getattr(loaded, name), getattr(full, name)), name
+    assert loaded.summary() == full.summary()
+    rows, cols = loaded.edge_pixel_coords(0).T
+    assert np.pad(mask, ((30, 0), (50, 0)))[rows, cols].all()
+
+
+def test_analyze_image_with_graph():
+    data = open(SAMPLE, 'rb').read()
+    annotated, metrics, graph = analyze_image(data, with_graph=True)
+    assert metrics['vessel_graph'] == graph.summary()
+    # the graph covers exactly the skeleton pixels that are not nodes
+    assert graph.edge_pixels.size <= metrics['skeleton_length_pixels']
+    assert tuple(graph.shape) == (metrics['height'], metrics['width'])
+    # metrics without the graph are unchanged
+    plain = analyze_image(data)[1]
+    assert {k: v for k, v in metrics.items() if k != 'vessel_graph'} == plain
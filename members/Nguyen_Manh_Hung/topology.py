@@ -0,0 +1,200 @@
+"""Skeleton and topology metrics of a binary vessel mask in one pass over the data.
+
+Replaces the chain used by processing.analyze_image (skimage label twice,
+skimage skeletonize, scipy distance_transform_edt on the whole mask, a 3x3
+convolve for neighbour counts) with:
+
+  - one 8-connected components-with-stats pass (cv2.connectedComponentsWithStats,
+    scipy.ndimage.label + bincount without OpenCV); the component areas drive
+    both the small-object cleanup (a label -> keep lookup table) and
+    component_count, so the mask is never labelled a second time
+  - LUT thinning on a zero-padded uint8 array: each foreground pixel's 8
+    neighbours are packed into one byte and looked up in THINNING_LUT, the same
+    Zhang-Suen table skimage.morphology.skeletonize uses, so the skeleton is
+    identical; only still-set pixels are revisited on each sub-iteration
+  - neighbour counts of skeleton pixels from the same packed bytes (popcount
+    table), and exact Euclidean radii computed only at skeleton pixels instead
+    of a distance transform of the whole mask
+
+All metrics are bit-identical to the previous implementation.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.ndimage import distance_transform_edt, label as nd_label
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# (dy, dx) of neighbour bit 0..7: NW, N, NE, E, SE, S, SW, W
+NEIGHBOUR_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1))
+
+# Zhang-Suen deletion table indexed by the packed neighbourhood (bit order above):
+# 1 = delete in the first sub-iteration, 2 = in the second, 3 = in both
+THINNING_LUT = np.array([
+    0, 0, 0, 1, 0, 0, 1, 3, 0, 0, 3, 1, 1, 0, 1, 3,
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 0, 2, 0, 3, 0, 3, 3,
+    0, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 0, 3, 0, 2, 2,
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    2, 0, 0, 0, 0, 0, 0, 0, 2, 0, 0, 0, 2, 0, 0, 0,
+    3, 0, 0, 0, 0, 0, 0, 0, 3, 0, 0, 0, 3, 0, 2, 0,
+    0, 0, 3, 1, 0, 0, 1, 3, 0, 0, 0, 0, 0, 0, 0, 1,
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 1,
+    3, 1, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    2, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    2, 3, 1, 3, 0, 0, 1, 3, 0, 0, 0, 0, 0, 0, 0, 1,
+    0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    2, 3, 0, 1, 0, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0,
+    3, 3, 0, 1, 0, 0, 0, 0, 2, 2, 0, 0, 2, 0, 0, 0,
+], dtype=np.uint8)
+
+# number of set neighbours for each packed neighbourhood
+POPCOUNT_LUT = np.array([bin(n).count('1') for n in range(256)], dtype=np.uint8)
+
+
+@dataclass
+class Topology:
+    mask: np.ndarray            # cleaned vessel mask (bool)
+    skeleton: np.ndarray        # one-pixel-wide centre lines (bool)
+    skeleton_index: np.ndarray  # flat indices of skeleton pixels, row-major
+    neighbours: np.ndarray      # set 8-neighbours of each skeleton pixel
+    radii: np.ndarray           # distance to background at each skeleton pixel
+    component_count: int
+
+    @property
+    def skeleton_length(self) -> int:
+        return int(self.skeleton_index.size)
+
+    @property
+    def branch_points(self) -> int:
+        return int(np.count_nonzero(self.neighbours >= 3))
+
+    @property
+    def end_points(self) -> int:
+        return int(np.count_nonzero(self.neighbours == 1))
+
+    @property
+    def mean_width(self) -> float:
+        return float(np.mean(self.radii) * 2.0) if self.radii.size > 0 else 0.0
+
+
+def label_components(mask: np.ndarray):
+    """8-connected labels (int32) and pixel count per label (index 0 = background)."""
+    if cv2 is not None:
+        n, labels, stats, _ = cv2.connectedComponentsWithStats(mask.view(np.uint8), connectivity=8)
+        return labels, stats[:, cv2.CC_STAT_AREA]
+    labels, n = nd_label(mask, structure=np.ones((3, 3), dtype=bool))
+    return labels, np.bincount(labels.ravel(), minlength=n + 1)
+
+
+def _neighbour_codes(flat: np.ndarray, idx: np.ndarray, offsets) -> np.ndarray:
+    """Packed 8-neighbourhood byte of each flat index of a zero-padded uint8 image."""
+    code = np.zeros(idx.size, dtype=np.uint8)
+    for bit, off in enumerate(offsets):
+        code |= flat[idx + off] << bit
+    return code
+
+
+def thin(padded: np.ndarray) -> np.ndarray:
+    """Zhang-Suen thinning in place on a uint8 0/1 image with a one-pixel zero border.
+
+    Returns the flat indices of the remaining (skeleton) pixels, row-major.
+    """
+    flat = padded.ravel()
+    w = padded.shape[1]
+    offsets = [dy * w + dx for dy, dx in NEIGHBOUR_OFFSETS]
+    idx = np.flatnonzero(flat)
+    changed = True
+    while changed:
+        changed = False
+        for step in (1, 2):
+            # both sub-iterations decide on the image as it was before the sub-iteration
+            action = THINNING_LUT[_neighbour_codes(flat, idx, offsets)]
+            delete = (action == 3) | (action == step)
+            if delete.any():
+                flat[idx[delete]] = 0
+                idx = idx[~delete]
+                changed = True
+    return idx
+
+
+def _radii(mask: np.ndarray, index: np.ndarray) -> np.ndarray:
+    """Exact Euclidean distance to the nearest background pixel at flat indices `index` (float64).
+
+    Vessels are thin, so instead of a full-image exact distance transform each
+    skeleton pixel probes window offsets in order of increasing distance until
+    one lands on background. The window radius comes from OpenCV's fast
+    approximate L2 transform (within a few percent of the true distance).
+    """
+    if cv2 is None or mask.all() or index.size == 0:
+        # OpenCV has no defined distance without background pixels; keep scipy's result
+        return distance_transform_edt(mask).ravel()[index]
+    h, w = mask.shape
+    approx = cv2.distanceTransform(mask.view(np.uint8), cv2.DIST_L2, 3).ravel()[index]
+    r = int(np.ceil(float(approx.max()) * 1.1)) + 1
+
+    # background inside the image only (outside the frame is not background, as in scipy)
+    pw = w + 2 * r
+    background = np.zeros((h + 2 * r, pw), dtype=bool)
+    background[r:r + h, r:r + w] = ~mask
+    background = background.ravel()
+    rows, cols = np.divmod(index, w)
+    pos = (rows + r) * pw + (cols + r)
+
+    ys, xs = np.mgrid[-r:r + 1, -r:r + 1]
+    d2 = (ys * ys + xs * xs).ravel()
+    order = np.argsort(d2, kind='stable')[1:]  # skip the centre
+    offsets, d2 = (ys.ravel() * pw + xs.ravel())[order], d2[order]
+
+    out = np.empty(index.size, dtype=np.float64)
+    pending = np.arange(index.size)
+    for off, dist2 in zip(offsets, d2):
+        hit = background[pos[pending] + off]
+        if hit.any():
+            out[pending[hit]] = dist2
+            pending = pending[~hit]
+            if pending.size == 0:
+                return np.sqrt(out, out=out)
+    # not reached for a valid bound; stay exact regardless
+    out[pending] = distance_transform_edt(mask).ravel()[index[pending]] ** 2
+    return np.sqrt(out, out=out)
+
+
+def analyze_topology(vessel_mask: np.ndarray, min_component_size: int = 30) -> Topology:
+    """Drop components of at most `min_component_size` pixels, skeletonize and measure."""
+    mask = np.ascontiguousarray(vessel_mask, dtype=bool)
+    h, w = mask.shape
+
+    labels, areas = label_components(mask)
+    keep = areas > min_component_size
+    keep[0] = False
+    mask = keep[labels]
+
+    padded = np.zeros((h + 2, w + 2), dtype=np.uint8)
+    padded[1:-1, 1:-1] = mask
+    pidx = thin(padded)
+
+    # padded flat index -> (row, col) of the unpadded image
+    rows, cols = np.divmod(pidx, w + 2)
+    rows -= 1
+    cols -= 1
+    skeleton_index = rows * w + cols
+    skeleton = np.zeros(h * w, dtype=bool)
+    skeleton[skeleton_index] = True
+
+    offsets = [dy * (w + 2) + dx for dy, dx in NEIGHBOUR_OFFSETS]
+    neighbours = POPCOUNT_LUT[_neighbour_codes(padded.ravel(), pidx, offsets)]
+    radii = _radii(mask, skeleton_index)
+
+    return Topology(
+        mask=mask,
+        skeleton=skeleton.reshape(h, w),
+        skeleton_index=skeleton_index,
+        neighbours=neighbours,
+        radii=radii,
+        component_count=int(np.count_nonzero(keep)),
+    )
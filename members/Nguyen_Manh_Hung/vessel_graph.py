@@ -0,0 +1,283 @@
+"""Vessel graph: the skeleton as nodes (branch and end points) and edges (vessel segments).
+
+Built from topology.analyze_topology without walking pixels in Python:
+
+  - nodes are 8-connected clusters of skeleton pixels whose neighbour count is
+    not 2 (ends, branch points, and the small blobs of branch pixels thinning
+    leaves at crossings); the node position is the cluster centroid
+  - edges are 8-connected runs of the remaining (neighbour count 2) pixels;
+    the node clusters touching a run are its end nodes (one node twice for a
+    loop, none for a closed ring)
+  - per-edge length sums the pixel-to-pixel steps (1 or sqrt 2) inside the run
+    and to its end nodes; tortuosity is length / straight distance between the
+    two node pixels the run touches; calibre is the mean of 2 x the
+    distance-transform radius over the run
+  - branching angles: at every node with 3 or more incident edges, the angle
+    between each pair of edge directions, a direction being the principal axis
+    of the edge pixels within `angle_radius` of the edge's first pixel next to
+    the node
+
+Everything is stored in flat arrays (edge pixels in CSR form: edge_ptr /
+edge_pixels), so a graph serialises to one compressed .npz blob that can be
+kept next to the analysis record and queried later without re-running
+segmentation.
+"""
+import io
+import math
+from dataclasses import dataclass, fields
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from topology import Topology, label_components
+
+# Bump when the serialised layout changes
+GRAPH_FORMAT = 1
+
+# forward half of the 8-neighbourhood (E, SE, S, SW): each pixel link is seen once
+_FORWARD = ((0, 1), (1, 1), (1, 0), (1, -1))
+
+
+@dataclass
+class VesselGraph:
+    shape: np.ndarray            # (2,) height, width of the full frame
+    node_yx: np.ndarray          # (N, 2) float32 centroid row, column
+    node_degree: np.ndarray      # (N,) int32 incident edge ends (a loop counts twice)
+    edge_nodes: np.ndarray       # (E, 2) int32 end nodes, -1 where the edge has no node
+    edge_ptr: np.ndarray         # (E + 1,) int64 offsets into edge_pixels
+    edge_pixels: np.ndarray      # flat full-frame indices of each edge's pixels, row-major per edge
+    edge_length: np.ndarray      # (E,) float32 pixels
+    edge_chord: np.ndarray       # (E,) float32 straight distance between the edge's end points
+    edge_tortuosity: np.ndarray  # (E,) float32 length / chord, NaN when chord is 0 or undefined
+    edge_calibre: np.ndarray     # (E,) float32 mean vessel width (pixels)
+    angle_node: np.ndarray       # (A,) int32 node of each branching angle
+    angle_edges: np.ndarray      # (A, 2) int32 pair of edges forming the angle
+    angles: np.ndarray           # (A,) float32 degrees, NaN next to a one-pixel edge
+
+    @property
+    def node_count(self) -> int:
+        return int(self.node_yx.shape[0])
+
+    @property
+    def edge_count(self) -> int:
+        return int(self.edge_nodes.shape[0])
+
+    def edge_pixel_coords(self, edge: int) -> np.ndarray:
+        """(K, 2) row, column of one edge's pixels."""
+        flat = self.edge_pixels[self.edge_ptr[edge]:self.edge_ptr[edge + 1]]
+        return np.stack(np.divmod(flat, int(self.shape[1])), axis=1)
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregate, JSON-serialisable graph metrics."""
+        def mean(a: np.ndarray) -> Optional[float]:
+            a = a[np.isfinite(a)]
+            return float(a.mean()) if a.size else None
+
+        return {
+            'node_count': self.node_count,
+            'branch_node_count': int(np.count_nonzero(self.node_degree >= 3)),
+            'end_node_count': int(np.count_nonzero(self.node_degree == 1)),
+            'segment_count': self.edge_count,
+            'total_length_pixels': float(self.edge_length.sum(dtype=np.float64)),
+            'mean_segment_length_pixels': mean(self.edge_length),
+            'mean_tortuosity': mean(self.edge_tortuosity),
+            'mean_calibre_pixels': mean(self.edge_calibre),
+            'mean_branching_angle_degrees': mean(self.angles),
+        }
+
+    def segments(self) -> Dict[str, list]:
+        """Per-segment table as JSON columns (NaN -> None)."""
+        return {
+            'start_node': self.edge_nodes[:, 0].tolist(),
+            'end_node': self.edge_nodes[:, 1].tolist(),
+            'pixel_count': np.diff(self.edge_ptr).tolist(),
+            'length_pixels': _column(self.edge_length),
+            'chord_pixels': _column(self.edge_chord),
+            'tortuosity': _column(self.edge_tortuosity),
+            'calibre_pixels': _column(self.edge_calibre),
+        }
+
+    def branching_angles(self) -> Dict[str, list]:
+        """Branching angles as JSON columns (NaN -> None)."""
+        return {
+            'node': self.angle_node.tolist(),
+            'edges': self.angle_edges.tolist(),
+            'degrees': _column(self.angles),
+        }
+
+    def to_bytes(self) -> bytes:
+        out = io.BytesIO()
+        arrays = {f.name: getattr(self, f.name) for f in fields(self)}
+        np.savez_compressed(out, format=np.array(GRAPH_FORMAT), **arrays)
+        return out.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VesselGraph":
+        with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+            if int(npz['format']) != GRAPH_FORMAT:
+                raise ValueError(f"unsupported vessel graph format {int(npz['format'])}")
+            return cls(**{f.name: npz[f.name] for f in fields(cls)})
+
+
+def _column(a: np.ndarray) -> list:
+    return [None if math.isnan(v) else v for v in a.tolist()]
+
+
+def build_graph(topo: Topology, origin: Tuple[int, int] = (0, 0), shape: Optional[Tuple[int, int]] = None,
+                angle_radius: float = 10.0) -> VesselGraph:
+    """Vessel graph of a topology computed on an image (or a crop at `origin` of a `shape` frame)."""
+    h, w = topo.skeleton.shape
+    shape = tuple(shape or (h, w))
+    oy, ox = origin
+    idx = topo.skeleton_index
+    ys, xs = np.divmod(idx, w)
+    is_node = topo.neighbours != 2
+
+    # node clusters and edge runs, both 8-connected; label 0 = not in the class
+    def components(select: np.ndarray) -> Tuple[np.ndarray, int]:
+        img = np.zeros(h * w, dtype=bool)
+        img[idx[select]] = True
+        labels, areas = label_components(img.reshape(h, w))
+        return labels.ravel()[idx], len(areas) - 1
+
+    node_of, n_nodes = components(is_node)
+    node_of = node_of - 1                    # -1 for run pixels
+    edge_of, n_edges = components(~is_node)
+    edge_of = edge_of - 1                    # -1 for node pixels
+
+    cnt = np.bincount(node_of[is_node], minlength=n_nodes).astype(np.float64)
+    node_yx = np.stack([np.bincount(node_of[is_node], ys[is_node], n_nodes),
+                        np.bincount(node_of[is_node], xs[is_node], n_nodes)], axis=1) / np.maximum(cnt, 1)[:, None]
+
+    # pixel links (a -> b, each pair once) with step lengths
+    skel = topo.skeleton.ravel()
+    links_a, links_b, links_w = [], [], []
+    for dy, dx in _FORWARD:
+        ny, nx = ys + dy, xs + dx
+        inside = (ny < h) & (nx >= 0) & (nx < w)
+        a = np.flatnonzero(inside)
+        a = a[skel[ny[a] * w + nx[a]]]
+        links_a.append(a)
+        links_b.append(np.searchsorted(idx, ny[a] * w + nx[a]))
+        links_w.append(np.full(a.size, math.sqrt(2.0) if dy and dx else 1.0))
+    la, lb, lw = (np.concatenate(v) for v in (links_a, links_b, links_w))
+
+    # run-run links lie inside one edge; run-node links attach an edge end to a node
+    inner = ~is_node[la] & ~is_node[lb]
+    length = np.bincount(edge_of[la[inner]], lw[inner], n_edges)
+    mixed = is_node[la] != is_node[lb]
+    run_px = np.where(is_node[la[mixed]], lb[mixed], la[mixed])
+    node_px = np.where(is_node[la[mixed]], la[mixed], lb[mixed])
+    # one attachment per (run pixel, node): a pixel touching a cluster twice counts its shortest step
+    att_w = lw[mixed]
+    order = np.lexsort((att_w, node_of[node_px], run_px))
+    run_px, node_px, att_w = run_px[order], node_px[order], att_w[order]
+    first = np.ones(run_px.size, dtype=bool)
+    first[1:] = (run_px[1:] != run_px[:-1]) | (node_of[node_px[1:]] != node_of[node_px[:-1]])
+    att_px, att_node_px, att_w = run_px[first], node_px[first], att_w[first]
+    att_node = node_of[att_node_px]
+    att_edge = edge_of[att_px]
+    length += np.bincount(att_edge, att_w, n_edges)
+
+    # end nodes: a run has at most two attachments (its two end pixels)
+    order = np.argsort(att_edge, kind='stable')
+    att_px, att_node_px, att_node, att_edge = att_px[order], att_node_px[order], att_node[order], att_edge[order]
+    n_att = np.bincount(att_edge, minlength=n_edges)
+    start = np.concatenate([[0], np.cumsum(n_att)[:-1]])
+    edge_nodes = np.full((n_edges, 2), -1, dtype=np.int32)
+    has = n_att > 0
+    edge_nodes[has, 0] = att_node[start[has]]
+    two = n_att > 1
+    last = start[two] + n_att[two] - 1
+    edge_nodes[two, 1] = att_node[last]
+    node_degree = np.bincount(att_node, minlength=n_nodes).astype(np.int32)
+
+    # chord between the node pixels the edge touches (not the cluster centroids), so length >= chord
+    chord = np.full(n_edges, np.nan)
+    a, b = att_node_px[start[two]], att_node_px[last]
+    chord[two] = np.hypot(ys[a] - ys[b], xs[a] - xs[b])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tortuosity = np.where(chord > 0, length / chord, np.nan)
+
+    run = np.flatnonzero(~is_node)
+    run_count = np.bincount(edge_of[run], minlength=n_edges)
+    calibre = 2.0 * np.bincount(edge_of[run], topo.radii[run], n_edges) / np.maximum(run_count, 1)
+
+    # edge pixels in CSR order (by edge, row-major within an edge), as full-frame flat indices
+    run = run[np.argsort(edge_of[run], kind='stable')]
+    edge_ptr = np.concatenate([[0], np.cumsum(run_count)]).astype(np.int64)
+    edge_pixels = ((ys[run] + oy) * shape[1] + xs[run] + ox).astype(np.int32)
+
+    angle_node, angle_edges, angles = _branching_angles(
+        ys, xs, edge_of, att_px, att_node, att_edge, node_degree, angle_radius)
+
+    origin_yx = np.array([oy, ox], dtype=np.float64)
+    return VesselGraph(
+        shape=np.asarray(shape, dtype=np.int32),
+        node_yx=(node_yx + origin_yx).astype(np.float32),
+        node_degree=node_degree,
+        edge_nodes=edge_nodes,
+        edge_ptr=edge_ptr,
+        edge_pixels=edge_pixels,
+        edge_length=length.astype(np.float32),
+        edge_chord=chord.astype(np.float32),
+        edge_tortuosity=tortuosity.astype(np.float32),
+        edge_calibre=calibre.astype(np.float32),
+        angle_node=angle_node,
+        angle_edges=angle_edges,
+        angles=angles,
+    )
+
+
+def _branching_angles(ys, xs, edge_of, att_px, att_node, att_edge, node_degree, radius):
+    """Pairwise angles between the directions of edges leaving each node of degree >= 3."""
+    branch = node_degree[att_node] >= 3
+    inc_px, inc_node, inc_edge = att_px[branch], att_node[branch], att_edge[branch]
+    n_inc = inc_px.size
+    if n_inc == 0:
+        return np.zeros(0, np.int32), np.zeros((0, 2), np.int32), np.zeros(0, np.float32)
+
+    # pair every run pixel with the incidences of its edge (at most two per edge)
+    order = np.argsort(inc_edge, kind='stable')
+    run = np.flatnonzero(edge_of >= 0)
+    lo = np.searchsorted(inc_edge[order], edge_of[run], side='left')
+    hi = np.searchsorted(inc_edge[order], edge_of[run], side='right')
+    # per incidence: sums of offsets (from the edge's first pixel) and their products
+    sums = np.zeros((6, n_inc))
+    for slot in range(2):
+        sel = lo + slot < hi
+        inc = order[lo[sel] + slot]
+        px = run[sel]
+        oy, ox = ys[px] - ys[inc_px[inc]], xs[px] - xs[inc_px[inc]]
+        # edge pixels near where the edge leaves the node
+        near = np.hypot(oy, ox) <= radius
+        inc, oy, ox = inc[near], oy[near].astype(np.float64), ox[near].astype(np.float64)
+        for row, v in enumerate((np.ones_like(oy), oy, ox, oy * oy, ox * ox, oy * ox)):
+            sums[row] += np.bincount(inc, v, n_inc)
+
+    # direction = principal axis of those pixels (robust to the stair steps thinning leaves
+    # next to junctions), oriented away from the node like the mean offset
+    n, sy, sx, syy, sxx, syx = sums
+    n = np.maximum(n, 1)
+    cyy, cxx, cyx = syy / n - (sy / n) ** 2, sxx / n - (sx / n) ** 2, syx / n - (sy / n) * (sx / n)
+    theta = 0.5 * np.arctan2(2 * cyx, cxx - cyy)
+    dy, dx = np.sin(theta), np.cos(theta)
+    flip = dy * sy + dx * sx < 0
+    dy[flip], dx[flip] = -dy[flip], -dx[flip]
+    # a single pixel has no direction; its angles are NaN
+    dy[sums[0] < 2] = np.nan
+
+    # incidences grouped by node; pair i with i + k inside each group
+    order = np.argsort(inc_node, kind='stable')
+    node, edge, vy, vx = inc_node[order], inc_edge[order], dy[order], dx[order]
+    out_node, out_edges, out_angle = [], [], []
+    for k in range(1, int(node_degree.max())):
+        i = np.flatnonzero(node[:-k] == node[k:])
+        j = i + k
+        cos = (vy[i] * vy[j] + vx[i] * vx[j]) / np.maximum(np.hypot(vy[i], vx[i]) * np.hypot(vy[j], vx[j]), 1e-12)
+        out_node.append(node[i])
+        out_edges.append(np.stack([edge[i], edge[j]], axis=1))
+        out_angle.append(np.degrees(np.arccos(np.clip(cos, -1.0, 1.0))))
+    return (np.concatenate(out_node).astype(np.int32),
+            np.concatenate(out_edges).astype(np.int32).reshape(-1, 2),
+            np.concatenate(out_angle).astype(np.float32))
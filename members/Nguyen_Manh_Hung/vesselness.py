@@ -0,0 +1,202 @@
+"""Multi-scale Hessian vesselness (Frangi) filter in float32.
+
+Drop-in replacement for ``skimage.filters.frangi`` on 2D images with the
+default parameters used by processing.analyze_image (sigmas 1, 3, 5, 7, 9,
+alpha = beta = 0.5, gamma = half the max Hessian norm at the first scale,
+dark ridges, reflect borders). Differences from the skimage implementation:
+
+  - all arrays stay float32 and intermediate results are computed in place
+  - the Hessian at scale sigma uses small Gaussian-derivative kernels
+    (sigma_d = min(sigma, 2)) on a scale-space level smoothed to
+    sqrt(sigma**2 - sigma_d**2); levels are built by cascading incremental
+    blurs from the previous level instead of filtering the input from scratch
+    with ever wider kernels (skimage uses up to 143-tap kernels at sigma 1)
+  - eigenvalues are ordered by magnitude analytically instead of argsort
+  - filtering is separable (cv2.sepFilter2D, or scipy.ndimage.correlate1d
+    without OpenCV) and the per-scale work runs on a thread pool; both release
+    the GIL, so scales are processed in parallel on multi-core machines
+
+The response is numerically close to skimage, not bit-identical: the first
+scale uses the same kernels (shorter truncation), larger scales differ by
+Gaussian sampling error and within a few sigma of the image border, where
+skimage's reflect-padding of intermediate derivatives is not reproduced exactly.
+"""
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Sequence
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+    from scipy.ndimage import correlate1d
+
+DEFAULT_SIGMAS = (1, 3, 5, 7, 9)
+
+# smallest supported scale
+MIN_SIGMA = 1.0
+
+# default thread count across scales (None: one per scale up to the cpu count);
+# bulk_screen sets 1 in its worker processes, which already use every core
+THREADS: Optional[int] = None
+
+
+def _gaussian_kernel(sigma: float, order: int, truncate: float = 4.0) -> np.ndarray:
+    """Sampled 1D Gaussian (order 0) or first derivative (order 1), normalised like scipy.ndimage."""
+    radius = max(1, int(math.ceil(truncate * sigma)))
+    x = np.arange(-radius, radius + 1, dtype=np.float64)
+    phi = np.exp(-0.5 * x * x / (sigma * sigma))
+    phi /= phi.sum()
+    return phi if order == 0 else -x / (sigma * sigma) * phi
+
+
+def derivative_sigma(sigma: float) -> float:
+    """Sigma of the derivative kernels used at scale `sigma`.
+
+    Scale 1 uses exactly skimage's kernels. Larger scales use sigma 2 (two
+    well-sampled passes of sigma sqrt(2)) on top of a pre-smoothed level; a
+    sampled Gaussian narrower than that no longer has the nominal variance.
+    """
+    return min(float(sigma), 2.0)
+
+
+def derivative_kernels(sigma: float):
+    """1D Gaussian smoothing and first-derivative kernels of sigma / sqrt(2).
+
+    Like skimage, each Hessian element is two successive first-order Gaussian
+    derivative passes, whose combined scale is `sigma`. Kernels are reversed so
+    that correlation (cv2 / correlate1d) equals scipy's convolution.
+    """
+    s = sigma / math.sqrt(2.0)
+    return tuple(np.ascontiguousarray(_gaussian_kernel(s, order)[::-1], dtype=np.float32) for order in (0, 1))
+
+
+def _sep_filter(img: np.ndarray, k_rows: np.ndarray, k_cols: np.ndarray) -> np.ndarray:
+    """Separable correlation: k_rows along axis 0 (y), k_cols along axis 1 (x); reflect borders."""
+    if cv2 is not None:
+        return cv2.sepFilter2D(img, cv2.CV_32F, k_cols, k_rows, borderType=cv2.BORDER_REFLECT)
+    tmp = correlate1d(img, k_rows, axis=0, mode='reflect')
+    return correlate1d(tmp, k_cols, axis=1, mode='reflect', output=tmp)
+
+
+def _blur(img: np.ndarray, sigma: float) -> np.ndarray:
+    if sigma <= 0:
+        return img
+    k = np.ascontiguousarray(_gaussian_kernel(sigma, 0), dtype=np.float32)
+    return _sep_filter(img, k, k)
+
+
+def hessian_terms(level: np.ndarray, kernels, beta: float):
+    """Blobness term exp(-Rb^2 / 2 beta^2) and squared Hessian norm S^2 for one scale.
+
+    Eigenvalues of [[Hrr, Hrc], [Hrc, Hcc]] are tr +- d with tr = (Hrr + Hcc) / 2,
+    d = sqrt(((Hrr - Hcc) / 2)^2 + Hrc^2). The larger-magnitude one is
+    lambda2 = tr + sign(tr) d, so no per-pixel sort is needed.
+    """
+    g0, g1 = kernels
+    grad = _sep_filter(level, g1, g0)
+    hrr = _sep_filter(grad, g1, g0)
+    hrc = _sep_filter(grad, g0, g1)
+    grad = _sep_filter(level, g0, g1)
+    hcc = _sep_filter(grad, g0, g1)
+    del grad
+
+    tr = hrr + hcc
+    tr *= 0.5
+    d = np.subtract(hrr, hcc, out=hrr)
+    d *= 0.5
+    d *= d
+    hrc *= hrc
+    d += hrc
+    np.sqrt(d, out=d)
+
+    # S^2 = lambda1^2 + lambda2^2 = 2 (tr^2 + d^2); reuses the Hcc / Hrc buffers
+    s2 = np.square(tr, out=hcc)
+    s2 += np.square(d, out=hrc)
+    s2 *= 2.0
+
+    sd = np.copysign(d, tr, out=d)
+    lam2 = np.add(tr, sd, out=hrc)
+    lam1 = np.subtract(tr, sd, out=tr)
+    np.maximum(lam2, np.float32(1e-10), out=lam2)
+    # Rb = |lambda1| / lambda2 ; blobness = exp(-Rb^2 / (2 beta^2))
+    rb = np.divide(lam1, lam2, out=lam1)
+    rb *= rb
+    rb *= np.float32(-1.0 / (2.0 * beta * beta))
+    blob = np.exp(rb, out=rb)
+    return blob, s2
+
+
+def vesselness(image: np.ndarray, sigmas: Sequence[float] = DEFAULT_SIGMAS, alpha: float = 0.5,
+               beta: float = 0.5, gamma: Optional[float] = None, black_ridges: bool = True,
+               workers: Optional[int] = None) -> np.ndarray:
+    """Frangi vesselness of a 2D image (float32 result, max over `sigmas`).
+
+    alpha only weights the plate-like term, which is constant for 2D images; it
+    is accepted for signature compatibility with skimage.filters.frangi.
+    workers: threads used across scales (default: THREADS, else min(len(sigmas) - 1, cpu count)).
+    """
+    sigmas = sorted(float(s) for s in sigmas)
+    if sigmas[0] < MIN_SIGMA:
+        raise ValueError(f"sigmas must be >= {MIN_SIGMA}")
+    img = np.asarray(image, dtype=np.float32)
+    if img.ndim != 2:
+        raise ValueError("vesselness expects a 2D image")
+    if not black_ridges:
+        img = -img
+    img = np.ascontiguousarray(img)
+    kernels = {d: derivative_kernels(d) for d in {derivative_sigma(s) for s in sigmas}}
+
+    def levels():
+        # scale space: level i is the input smoothed to sqrt(sigma_i^2 - d_i^2), d_i the
+        # derivative kernel sigma; each level is one incremental blur from the previous
+        # one and only the previous level is kept
+        level, prev_t = img, 0.0
+        for s in sigmas:
+            d = derivative_sigma(s)
+            t = math.sqrt(s * s - d * d)
+            level = _blur(level, math.sqrt(max(t * t - prev_t * prev_t, 0.0)))
+            prev_t = t
+            yield s, level
+
+    scales = levels()
+    sigma, level = next(scales)
+    # gamma comes from the first scale (as in skimage), so that scale runs first
+    blob, s2 = hessian_terms(level, kernels[derivative_sigma(sigma)], beta)
+    if gamma is None:
+        gamma = math.sqrt(float(s2.max())) / 2 or 1.0
+    c = np.float32(-1.0 / (2.0 * gamma * gamma))
+
+    def response(blob: np.ndarray, s2: np.ndarray) -> np.ndarray:
+        # blobness * structuredness, (1 - exp(-S^2 / (2 gamma^2)))
+        s2 *= c
+        np.exp(s2, out=s2)
+        np.subtract(np.float32(1.0), s2, out=s2)
+        blob *= s2
+        return blob
+
+    def scale(sigma: float, level: np.ndarray) -> np.ndarray:
+        return response(*hessian_terms(level, kernels[derivative_sigma(sigma)], beta))
+
+    result = response(blob, s2)
+    del blob, s2, level
+    workers = workers or THREADS or min(len(sigmas) - 1, os.cpu_count() or 1)
+    if workers <= 1:
+        for sigma, level in scales:
+            np.maximum(result, scale(sigma, level), out=result)
+        return result
+
+    # at most `workers` scales in flight, so memory grows with workers, not with len(sigmas)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for sigma, level in scales:
+            if len(pending) >= workers:
+                np.maximum(result, pending.popleft().result(), out=result)
+            pending.append(pool.submit(scale, sigma, level))
+        for fut in pending:
+            np.maximum(result, fut.result(), out=result)
+    return result